@@ -0,0 +1,301 @@
+"""
+West Money OS - API Cache
+=========================
+Antwort-Cache für APIConnector.get (app_api_hub). Welche API wie lange
+gecacht wird, steht in API_CONFIG["<api>"]["cache"]:
+{"ttl": Sekunden frisch, "stale": Sekunden danach noch nutzbar,
+"negative_ttl": Sekunden für 4xx-Antworten}.
+
+- frisch: Antwort direkt aus dem Speicher
+- stale (ttl .. ttl + stale): sofort die alte Antwort, neu geladen wird im
+  Hintergrund (stale-while-revalidate, pro Schlüssel nur ein Nachlader)
+- Negative Caching: 4xx-Antworten (z.B. unbekannte PLZ) für negative_ttl,
+  Timeouts/5xx werden nicht gecacht und ersetzen keine gültige Antwort
+- LRU-Grenze im Prozess (API_CACHE_SIZE)
+- Optional eine gemeinsame SQLite-Datei (API_CACHE_DB), damit sich die
+  gunicorn-Worker eines Hosts die Treffer teilen
+- Schlüssel: API, Endpoint und sortierte Parameter samt Typ - int exakt,
+  float über repr (50.11 und 50.110 als float treffen denselben Eintrag),
+  None/True/False/'' getrennt; Strings (auch Werte aus Query-Strings) nur
+  mit normalisiertem Leerraum, sonst nicht kanonisiert ('50.11' != '50.110')
+- SingleFlight: gleichzeitige Aufrufe mit demselben Schlüssel teilen sich
+  einen laufenden Upstream-Request (Threads eines Prozesses) - auch für
+  APIs ohne Cache-Policy
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from urllib.parse import urlencode
+
+API_CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', '1024'))
+API_CACHE_DB = os.environ.get('API_CACHE_DB', '')  # leer = nur im Prozess
+SHARED_CACHE_SIZE = int(os.environ.get('API_CACHE_DB_SIZE', '20000'))
+PRUNE_INTERVAL = 60  # Sekunden zwischen zwei Aufräumläufen der SQLite-Datei
+
+# Nicht negativ cachen: Timeout und Rate-Limit sind vorübergehend
+TRANSIENT_STATUS = frozenset({408, 429})
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    fresh_until REAL NOT NULL,
+    stale_until REAL NOT NULL,
+    stored_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_api_cache_stored ON api_cache (stored_at);
+"""
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _normalize(value):
+    # Typ-Präfix: 0, False, None und '' dürfen nicht zusammenfallen
+    if value is None:
+        return 'none:'
+    if isinstance(value, bool):
+        return f'bool:{value}'
+    if isinstance(value, int):
+        return f'int:{value}'  # exakt, auch jenseits von 2**53
+    if isinstance(value, float):
+        return f'float:{value!r}'
+    return 'str:' + ' '.join(str(value).split())
+
+
+def cache_key(api, endpoint, params):
+    """'api:endpoint?a=1&b=x' with sorted, normalized parameters"""
+    normalized = sorted((name, _normalize(value)) for name, value in params.items())
+    return f'{api}:{endpoint}?{urlencode(normalized)}'
+
+
+def lifetime(policy, result):
+    """(fresh seconds, stale seconds) for a connector result - None: do not cache"""
+    if result.get('success'):
+        return policy.get('ttl', 0), policy.get('stale', 0)
+    status = result.get('status_code')
+    if status and 400 <= status < 500 and status not in TRANSIENT_STATUS:
+        return policy.get('negative_ttl', 0), 0
+    return None
+
+
+class ResponseCache:
+    """LRU response cache with stale-while-revalidate (optionally shared via SQLite)"""
+
+    def __init__(self, maxsize=API_CACHE_SIZE, path=API_CACHE_DB):
+        self.maxsize = maxsize
+        self.path = path or None
+        self.counters = Counter()
+        self._entries = OrderedDict()  # key -> (value, fresh_until, stale_until)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def get(self, key, policy, fetch):
+        """(result, 'hit' | 'stale' | 'miss') - fetch() loads the result on a miss"""
+        now = time.time()
+        entry = self._lookup(key, now)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self._count('negative_hits' if not value.get('success') else 'hits')
+                return value, 'hit'
+            if now < stale_until:
+                self._count('stale_hits')
+                self._revalidate(key, policy, fetch)
+                return value, 'stale'
+
+        self._count('misses')
+        value = fetch()
+        self._store(key, policy, value)
+        return value, 'miss'
+
+    # ------------------------------------------------------------------
+    # Lesen / Schreiben
+    # ------------------------------------------------------------------
+
+    def _lookup(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if self.path and (entry is None or now >= entry[1]):
+            # Ein anderer Worker hat den Eintrag vielleicht schon (neu) geladen
+            shared = self._shared_get(key)
+            if shared is not None and (entry is None or shared[1] > entry[1]):
+                entry = shared
+                self._remember(key, entry)
+        if entry is not None and now >= entry[2]:
+            return None
+        return entry
+
+    def _store(self, key, policy, value):
+        ttl = lifetime(policy, value)
+        if ttl is None or ttl[0] <= 0:
+            self._count('not_cached')
+            return
+        now = time.time()
+        entry = (value, now + ttl[0], now + ttl[0] + ttl[1])
+        self._remember(key, entry)
+        if self.path:
+            self._shared_put(key, entry, now)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def _revalidate(self, key, policy, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.counters['revalidations'] += 1
+
+        def run():
+            try:
+                self._store(key, policy, fetch())
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='api-cache-revalidate', daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Gemeinsame SQLite-Datei
+    # ------------------------------------------------------------------
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _open(self.path)
+        return conn
+
+    def _shared_get(self, key):
+        try:
+            row = self._connect().execute(
+                'SELECT value, fresh_until, stale_until FROM api_cache WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error:
+            self._count('shared_errors')
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def _shared_put(self, key, entry, now):
+        value, fresh_until, stale_until = entry
+        try:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO api_cache (key, value, fresh_until, stale_until, stored_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(value), fresh_until, stale_until, now)
+            )
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._pruned_at = now
+                conn.execute('DELETE FROM api_cache WHERE stale_until < ?', (now,))
+                conn.execute(
+                    'DELETE FROM api_cache WHERE key IN (SELECT key FROM api_cache '
+                    'ORDER BY stored_at DESC LIMIT -1 OFFSET ?)', (SHARED_CACHE_SIZE,)
+                )
+        except (sqlite3.Error, TypeError, ValueError):
+            self._count('shared_errors')
+
+    # ------------------------------------------------------------------
+    # Verwaltung
+    # ------------------------------------------------------------------
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            self._connect().execute('DELETE FROM api_cache')
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'shared': self.path,
+                'refreshing': len(self._refreshing),
+                **self.counters
+            }
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one upstream call"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """(result, shared) - shared=True if another thread's call was joined"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.counters['issued'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'issued': self.counters['issued'],
+                'coalesced': self.counters['coalesced']
+            }
+
+
+API_CACHE = ResponseCache()
+API_FLIGHTS = SingleFlight()
+
+
+__all__ = ['API_CACHE', 'API_FLIGHTS', 'ResponseCache', 'SingleFlight', 'cache_key', 'lifetime']
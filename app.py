@@ -5,6 +5,7 @@ from functools import wraps
 from datetime import datetime
 from dotenv import load_dotenv
 import os, requests, hashlib, sqlite3
+from hubspot_transport import hubspot_request
 
 load_dotenv()
 app = Flask(__name__)
@@ -39,24 +40,23 @@ def init_db():
 class HubSpotAPI:
     def __init__(self):
         self.api_key = CONFIG['HUBSPOT_API_KEY']
-        self.headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
     def get_contacts(self, limit=100):
         if not self.api_key: return []
         try:
-            r = requests.get('https://api.hubapi.com/crm/v3/objects/contacts', headers=self.headers, params={'limit': limit, 'properties': 'firstname,lastname,email,phone,company,hs_lead_status,hs_whatsapp_consent'}, timeout=10)
+            r = hubspot_request('GET', '/crm/v3/objects/contacts', self.api_key, params={'limit': limit, 'properties': 'firstname,lastname,email,phone,company,hs_lead_status,hs_whatsapp_consent'}, timeout=10)
             return r.json().get('results', []) if r.ok else []
         except: return []
     def get_deals(self, limit=100):
         if not self.api_key: return []
         try:
-            r = requests.get('https://api.hubapi.com/crm/v3/objects/deals', headers=self.headers, params={'limit': limit, 'properties': 'dealname,amount,dealstage'}, timeout=10)
+            r = hubspot_request('GET', '/crm/v3/objects/deals', self.api_key, params={'limit': limit, 'properties': 'dealname,amount,dealstage'}, timeout=10)
             return r.json().get('results', []) if r.ok else []
         except: return []
     def bulk_update_consent(self, ids, status):
         results = {'success': 0, 'failed': 0}
         for cid in ids:
             try:
-                r = requests.patch(f'https://api.hubapi.com/crm/v3/objects/contacts/{cid}', headers=self.headers, json={'properties': {'hs_whatsapp_consent': status}}, timeout=10)
+                r = hubspot_request('PATCH', f'/crm/v3/objects/contacts/{cid}', self.api_key, json={'properties': {'hs_whatsapp_consent': status}}, timeout=10)
                 if r.ok: results['success'] += 1
                 else: results['failed'] += 1
             except: results['failed'] += 1
@@ -10,8 +10,21 @@ from datetime import datetime
 import json
 import os
 
+from intent_matcher import IntentMatcher
+
 ai_chat_bp = Blueprint('ai_chat', __name__)
 
+# Themen der Auto-Antworten - höhere Priorität gewinnt bei mehreren Treffern
+CHAT_INTENTS = (
+    IntentMatcher()
+    .add('email_template', ['email', 'e-mail', 'template', 'nachricht'], priority=5)
+    .add('whatsapp_followup', ['whatsapp', 'follow-up', 'nachfassen'], priority=4)
+    .add('smart_home', ['loxone', 'smart home', 'automation'], priority=3)
+    .add('quote', ['angebot', 'preis', 'kosten'], priority=2)
+    .add('campaign_analysis', ['kampagne', 'analyse', 'performance'], priority=1)
+    .compile()
+)
+
 AI_CHAT_HTML = """
 <!DOCTYPE html>
 <html lang="de">
@@ -472,10 +485,9 @@ def chat_with_ai():
 
 def generate_ai_response(message: str, knowledge: dict) -> str:
     """Generate AI response based on message"""
-    message_lower = message.lower()
+    intent = CHAT_INTENTS.best(message)
     
-    # Check for keywords
-    if any(word in message_lower for word in ['email', 'e-mail', 'template', 'nachricht']):
+    if intent == 'email_template':
         return """Hier ist ein professionelles E-Mail Template:
 
 **Betreff:** Ihre Smart Home Beratung - Persönliches Angebot
@@ -504,7 +516,7 @@ West Money Bau GmbH
 
 *Sie können die Variablen {{first_name}} und {{last_name}} verwenden, die automatisch ersetzt werden.*"""
 
-    elif any(word in message_lower for word in ['whatsapp', 'follow-up', 'nachfassen']):
+    elif intent == 'whatsapp_followup':
         return """Hier ist eine WhatsApp Follow-Up Nachricht:
 
 ---
@@ -524,7 +536,7 @@ Beste Grüße,
 
 *Tipp: Personalisierte Nachrichten haben 40% höhere Antwortrate!*"""
 
-    elif any(word in message_lower for word in ['loxone', 'smart home', 'automation']):
+    elif intent == 'smart_home':
         return """**LOXONE Smart Home - Vorteile:**
 
 🏠 **All-in-One Lösung**
@@ -551,7 +563,7 @@ Beste Grüße,
 
 Als zertifizierter LOXONE Partner beraten wir Sie gerne!"""
 
-    elif any(word in message_lower for word in ['angebot', 'preis', 'kosten']):
+    elif intent == 'quote':
         return """**Angebotserstellung für Smart Home:**
 
 Um ein passendes Angebot zu erstellen, benötige ich folgende Informationen:
@@ -576,7 +588,7 @@ Um ein passendes Angebot zu erstellen, benötige ich folgende Informationen:
 
 Soll ich ein konkretes Angebot vorbereiten?"""
 
-    elif any(word in message_lower for word in ['kampagne', 'analyse', 'performance']):
+    elif intent == 'campaign_analysis':
         return """**📊 Kampagnen-Analyse:**
 
 Basierend auf Ihren aktuellen Kampagnen:
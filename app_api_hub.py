@@ -13,6 +13,8 @@ from datetime import datetime, timedelta
 from functools import wraps
 import hashlib
 
+from api_cache import API_CACHE, API_FLIGHTS, cache_key
+
 # ============================================================================
 # BLUEPRINT
 # ============================================================================
@@ -33,6 +35,7 @@ API_CONFIG = {
         "free_tier": "unlimited",
         "category": "germany",
         "icon": "🇩🇪",
+        "cache": {"ttl": 24 * 3600, "stale": 7 * 24 * 3600, "negative_ttl": 3600},
         "endpoints": {
             "search": "/openregister.json?_search={query}",
             "company": "/openregister/{id}.json"
@@ -59,6 +62,7 @@ API_CONFIG = {
         "free_tier": "unlimited",
         "category": "geo",
         "icon": "🗺️",
+        "cache": {"ttl": 30 * 24 * 3600, "stale": 30 * 24 * 3600, "negative_ttl": 24 * 3600},
         "endpoints": {
             "search": "/search?q={query}&format=json",
             "reverse": "/reverse?lat={lat}&lon={lon}&format=json"
@@ -73,6 +77,7 @@ API_CONFIG = {
         "free_tier": "unlimited",
         "category": "germany",
         "icon": "📮",
+        "cache": {"ttl": 30 * 24 * 3600, "stale": 90 * 24 * 3600, "negative_ttl": 24 * 3600},
         "endpoints": {
             "lookup": "/de/{plz}",
             "lookup_at": "/at/{plz}",
@@ -91,6 +96,7 @@ API_CONFIG = {
         "free_tier": "unlimited",
         "category": "weather",
         "icon": "🌤️",
+        "cache": {"ttl": 10 * 60, "stale": 30 * 60, "negative_ttl": 60},
         "endpoints": {
             "forecast": "/forecast?latitude={lat}&longitude={lon}&current_weather=true&hourly=temperature_2m,precipitation,windspeed_10m&daily=temperature_2m_max,temperature_2m_min&timezone=Europe/Berlin",
             "historical": "/archive?latitude={lat}&longitude={lon}&start_date={start}&end_date={end}&hourly=temperature_2m"
@@ -122,6 +128,7 @@ API_CONFIG = {
         "free_tier": "1500/month",
         "category": "finance",
         "icon": "💱",
+        "cache": {"ttl": 6 * 3600, "stale": 24 * 3600, "negative_ttl": 3600},
         "endpoints": {
             "latest": "/latest/{base}",
             "pair": "/latest/{base}"
@@ -518,7 +525,23 @@ class APIConnector:
         return url
     
     def get(self, endpoint_name, **params):
-        """Make GET request to API"""
+        """Make GET request to API - cached if API_CONFIG[api]["cache"] is set (see api_cache)
+        
+        Gleichzeitige identische Aufrufe teilen sich einen Upstream-Request.
+        """
+        key = cache_key(self.name, endpoint_name, params)
+        
+        def fetch():
+            return API_FLIGHTS.do(key, lambda: self._get(endpoint_name, **params))[0]
+        
+        policy = self.config.get("cache")
+        if not policy:
+            return dict(fetch())
+        
+        result, state = API_CACHE.get(key, policy, fetch)
+        return dict(result, cache=state)
+    
+    def _get(self, endpoint_name, **params):
         url = self._build_url(endpoint_name, **params)
         headers = self._get_headers()
         
@@ -1255,10 +1278,18 @@ def api_config():
             "free_tier": api.get("free_tier"),
             "auth_type": api.get("auth_type"),
             "icon": api.get("icon"),
-            "configured": bool(API_CREDENTIALS.get(api_id))
+            "configured": bool(API_CREDENTIALS.get(api_id)),
+            "cache": api.get("cache")
         }
     return jsonify(safe_config)
 
+@api_hub_bp.route('/cache', methods=['GET', 'DELETE'])
+def api_cache_status():
+    """Response cache and request coalescing metrics (DELETE empties the cache)"""
+    if request.method == 'DELETE':
+        API_CACHE.clear()
+    return jsonify(dict(API_CACHE.metrics(), single_flight=API_FLIGHTS.metrics()))
+
 # ============================================================================
 # EXPORT
 # ============================================================================
@@ -6,15 +6,43 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Blueprint, render_template_string, request, jsonify, session
-from datetime import datetime, timedelta
+from flask import Blueprint, current_app, render_template_string, request, jsonify, session
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from itertools import chain
+import bisect
 import json
+import math
+import os
 import random
 import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+
+from sqlalchemy import select, insert, update, bindparam, case, and_, or_, func
+
+from campaign_analytics import CAMPAIGN_ROLLUPS, EVENT_COUNTERS, parse_period, rates
+from campaign_dispatcher import CAMPAIGN_DISPATCHER
+from message_templates import compile_template
+from timing_wheel import TimingWheel
+from webhook_queue import SeenSet, WebhookQueue, WebhookWorkerPool
+from westmoney_db import get_db, get_table
+
+try:
+    import numpy as np
+except ImportError:  # Batch-Scoring läuft dann über array-basierte Python-Schleifen
+    np = None
 
 broly_bp = Blueprint('broly', __name__)
 
+EMAIL_EVENT_WORKERS = int(os.environ.get('EMAIL_EVENT_WORKERS', '2'))
+EMAIL_EVENT_BATCH = int(os.environ.get('EMAIL_EVENT_BATCH', '200'))  # Requests pro Flush-Fenster
+
 # ============================================================================
 # DATABASE MODELS - Erweitert für Broly Automation
 # ============================================================================
@@ -1560,9 +1588,7 @@ Beste Grüße,
                                         <option value="send_whatsapp">💬 WhatsApp senden</option>
                                         <option value="add_tag">🏷️ Tag hinzufügen</option>
                                         <option value="update_score">📊 Score ändern</option>
-                                        <option value="assign_user">👤 Zuweisen</option>
                                         <option value="create_task">✅ Task erstellen</option>
-                                        <option value="webhook">🔗 Webhook</option>
                                     </select>
                                     <input type="text" class="form-input" name="action_1_value" placeholder="Template auswählen oder Wert eingeben">
                                 </div>
@@ -2026,110 +2052,212 @@ def update_lead(lead_id):
 
 @broly_bp.route('/api/broly/leads/<int:lead_id>/score', methods=['POST'])
 def update_lead_score(lead_id):
-    """Recalculate lead score"""
-    # AI-based scoring algorithm
-    score_factors = {
-        'email_opens': 5,
-        'email_clicks': 10,
-        'website_visits': 3,
-        'form_submits': 20,
-        'meeting_booked': 30,
-        'proposal_viewed': 15
-    }
-    
-    # In production: Calculate based on actual engagement
-    new_score = random.randint(50, 95)
-    temperature = 'cold' if new_score < 40 else ('warm' if new_score < 70 else 'hot')
+    """Recalculate lead score (profile + decayed engagement)"""
+    result = LeadScoringEngine.current_score(lead_id)
+    if result is None:
+        return jsonify({'success': False, 'error': 'Lead nicht gefunden'}), 404
     
     return jsonify({
         'success': True, 
         'lead_id': lead_id,
-        'new_score': new_score,
-        'temperature': temperature
+        'new_score': result['score'],
+        'temperature': result['temperature']
     })
 
 
+@broly_bp.route('/api/broly/leads/<int:lead_id>/events', methods=['POST'])
+def add_lead_event(lead_id):
+    """Record an engagement event (opened, clicked, form_submit, meeting_booked, ...)"""
+    data = request.json or {}
+    if 'points' in data:
+        event_type = data['points']
+        # bool ist ein int - true würde sonst als 1 Punkt zählen
+        if isinstance(event_type, bool) or not isinstance(event_type, (int, float)) or not math.isfinite(event_type):
+            return jsonify({'success': False, 'error': 'points muss eine endliche Zahl sein'}), 400
+        if not event_type:
+            return jsonify({'success': False, 'error': 'points darf nicht 0 sein'}), 400
+    else:
+        event_type = data.get('event')
+        if not isinstance(event_type, str) or not LeadScoringEngine.event_points(event_type):
+            return jsonify({'success': False, 'error': 'Unbekannter Event-Typ'}), 400
+    
+    result = LeadScoringEngine.apply_event(lead_id, event_type)
+    if result is None:
+        return jsonify({'success': False, 'error': 'Lead nicht gefunden'}), 404
+    
+    return jsonify({'success': True, 'lead_id': lead_id, **result})
+
+
 # ----- CAMPAIGNS API -----
 
 @broly_bp.route('/api/broly/campaigns', methods=['GET'])
 def get_campaigns():
     """Get all campaigns"""
-    campaigns = [
-        {'id': 1, 'name': 'Smart Home Launch 2025', 'type': 'email', 'status': 'running',
-         'sent_count': 450, 'open_count': 203, 'click_count': 67, 'conversion_count': 12},
-        {'id': 2, 'name': 'LOXONE Partner Outreach', 'type': 'whatsapp', 'status': 'running',
-         'sent_count': 120, 'open_count': 98, 'click_count': 45, 'conversion_count': 8},
-    ]
+    campaigns_table = get_table('campaigns')
+    rows = get_db().session.execute(
+        select(
+            campaigns_table.c.id, campaigns_table.c.name, campaigns_table.c.type,
+            campaigns_table.c.status, campaigns_table.c.sent_count, campaigns_table.c.failed_count,
+            campaigns_table.c.open_count, campaigns_table.c.click_count,
+            campaigns_table.c.conversion_count
+        ).order_by(campaigns_table.c.id.desc())
+    ).mappings().all()
+    campaigns = [dict(row) for row in rows]
     return jsonify({'success': True, 'campaigns': campaigns})
 
 
 @broly_bp.route('/api/broly/campaigns', methods=['POST'])
 def create_campaign():
     """Create a new campaign"""
-    data = request.json
+    data = request.json or {}
+    if not data.get('name'):
+        return jsonify({'success': False, 'error': 'Name erforderlich'}), 400
+    
+    scheduled_at = None
+    if data.get('scheduled_at'):
+        try:
+            scheduled_at = datetime.fromisoformat(data['scheduled_at'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Ungültiges Datum'}), 400
     
     campaign = {
-        'id': random.randint(100, 9999),
-        **data,
-        'created_at': datetime.now().isoformat(),
+        'name': data['name'],
+        'type': data.get('type', 'email'),
+        'status': 'scheduled' if data.get('status') == 'scheduled' else 'draft',
+        'subject': data.get('subject'),
+        'content': data.get('content'),
+        'template_id': data.get('template_id') or None,
+        'whatsapp_template': data.get('whatsapp_template') or None,
+        'audience_filter': json.dumps({'audience': data.get('audience', 'all')}),
+        'scheduled_at': scheduled_at,
+        'created_at': datetime.utcnow()
+    }
+    
+    db = get_db()
+    result = db.session.execute(insert(get_table('campaigns')).values(**campaign))
+    db.session.commit()
+    
+    campaign.update({
+        'id': result.inserted_primary_key[0],
+        'scheduled_at': scheduled_at.isoformat() if scheduled_at else None,
+        'created_at': campaign['created_at'].isoformat(),
         'sent_count': 0,
         'open_count': 0,
         'click_count': 0
-    }
-    
+    })
     return jsonify({'success': True, 'campaign': campaign, 'message': 'Kampagne erstellt'})
 
 
 @broly_bp.route('/api/broly/campaigns/<int:campaign_id>/start', methods=['POST'])
 def start_campaign(campaign_id):
-    """Start a campaign"""
-    # In production: Start background job to send messages
+    """Start or resume a campaign - sending runs in the background"""
+    ok, message = CAMPAIGN_DISPATCHER.start(campaign_id, current_app._get_current_object())
+    if not ok:
+        status = 404 if message == 'Kampagne nicht gefunden' else 409
+        return jsonify({'success': False, 'error': message}), status
     return jsonify({'success': True, 'message': f'Kampagne {campaign_id} gestartet'})
 
 
 @broly_bp.route('/api/broly/campaigns/<int:campaign_id>/pause', methods=['POST'])
 def pause_campaign(campaign_id):
-    """Pause a campaign"""
+    """Pause a campaign after the batch in progress"""
+    if not CAMPAIGN_DISPATCHER.pause(campaign_id):
+        return jsonify({'success': False, 'error': 'Kampagne läuft nicht'}), 409
     return jsonify({'success': True, 'message': f'Kampagne {campaign_id} pausiert'})
 
 
+@broly_bp.route('/api/broly/campaigns/dispatcher', methods=['GET'])
+def campaign_dispatcher_status():
+    """Send rate, queue depth and latency per channel"""
+    return jsonify({'success': True, **CAMPAIGN_DISPATCHER.metrics()})
+
+
 # ----- AUTOMATIONS API -----
 
 @broly_bp.route('/api/broly/automations', methods=['GET'])
 def get_automations():
     """Get all automations"""
+    automations_table = get_table('automations')
+    rows = get_db().session.execute(
+        select(automations_table).order_by(automations_table.c.id)
+    ).mappings().all()
+    
     automations = [
-        {'id': 1, 'name': 'Welcome Sequence', 'trigger_type': 'new_lead', 'is_active': True, 'run_count': 234},
-        {'id': 2, 'name': 'Hot Lead Alert', 'trigger_type': 'score_threshold', 'is_active': True, 'run_count': 89},
+        {**TriggerIndex.compile(row), 'run_count': row['run_count'] or 0}
+        for row in rows
     ]
-    return jsonify({'success': True, 'automations': automations})
+    return jsonify({'success': True, 'automations': automations, 'index': TRIGGER_INDEX.stats()})
 
 
 @broly_bp.route('/api/broly/automations', methods=['POST'])
 def create_automation():
     """Create a new automation"""
-    data = request.json
-    
-    automation = {
-        'id': random.randint(100, 9999),
-        **data,
+    data = request.json or {}
+    if data.get('trigger_type') not in AutomationEngine.TRIGGERS:
+        return jsonify({'success': False, 'error': 'Unbekannter Trigger'}), 400
+    actions = data.get('actions') or []
+    if not isinstance(actions, list) or not all(isinstance(action, dict) for action in actions):
+        return jsonify({'success': False, 'error': 'actions muss eine Liste von Aktionen sein'}), 400
+    unsupported = sorted({str(action.get('type')) for action in actions} - AutomationEngine.SUPPORTED_ACTIONS)
+    if unsupported:
+        return jsonify({'success': False, 'error': f'Nicht unterstützte Aktion(en): {", ".join(unsupported)}'}), 400
+    
+    automations_table = get_table('automations')
+    now = datetime.utcnow()
+    values = {
+        'user_id': session.get('user_id'),
+        'name': data.get('name') or 'Automation',
+        'trigger_type': data['trigger_type'],
+        'trigger_config': json.dumps(data.get('trigger_config') or {}),
+        'actions': json.dumps(actions),
         'is_active': True,
         'run_count': 0,
-        'created_at': datetime.now().isoformat()
+        'created_at': now,
+        'updated_at': now
     }
+    db = get_db()
+    automation_id = db.session.execute(insert(automations_table).values(values)).inserted_primary_key[0]
+    db.session.commit()
+    
+    row = {**values, 'id': automation_id}
+    TRIGGER_INDEX.upsert(row)
     
+    automation = {**TriggerIndex.compile(row), 'run_count': 0, 'created_at': now.isoformat()}
     return jsonify({'success': True, 'automation': automation, 'message': 'Automation erstellt und aktiviert'})
 
 
 @broly_bp.route('/api/broly/automations/<int:automation_id>/toggle', methods=['POST'])
 def toggle_automation(automation_id):
     """Toggle automation on/off"""
-    data = request.json
-    active = data.get('active', False)
-    # In production: Update in database
+    data = request.json or {}
+    active = bool(data.get('active', False))
+    
+    automations_table = get_table('automations')
+    db = get_db()
+    result = db.session.execute(
+        update(automations_table)
+        .where(automations_table.c.id == automation_id)
+        .values(is_active=active, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Automation nicht gefunden'}), 404
+    db.session.commit()
+    
+    row = db.session.execute(
+        select(automations_table).where(automations_table.c.id == automation_id)
+    ).mappings().first()
+    TRIGGER_INDEX.upsert(row)
     return jsonify({'success': True, 'automation_id': automation_id, 'active': active})
 
 
+@broly_bp.route('/api/broly/automations/executor', methods=['GET'])
+def automation_executor_status():
+    """Executor throughput, lag and run counts"""
+    ACTION_EXECUTOR.ensure_started(current_app._get_current_object())
+    return jsonify({'success': True, 'executor': ACTION_EXECUTOR.metrics()})
+
+
 # ----- AI CAMPAIGN -----
 
 @broly_bp.route('/api/broly/ai-campaign', methods=['POST'])
@@ -2205,121 +2333,197 @@ def sync_explorium():
 @broly_bp.route('/webhook/broly/lead', methods=['POST'])
 def webhook_new_lead():
     """Webhook for new leads (forms, integrations)"""
-    data = request.json
+    data = request.json or {}
     
     # Process incoming lead
     # Trigger automations
+    triggered = AutomationEngine.dispatch('new_lead', data)
+    if data.get('lead_id'):
+        ACTION_EXECUTOR.start_runs(triggered, data['lead_id'])
     
-    return jsonify({'success': True, 'message': 'Lead received'})
+    return jsonify({
+        'success': True,
+        'message': 'Lead received',
+        'automations': [a['id'] for a in triggered]
+    })
 
 
 @broly_bp.route('/webhook/broly/email-event', methods=['POST'])
 def webhook_email_event():
-    """Webhook for email events (opens, clicks, bounces)"""
-    data = request.json
-    event_type = data.get('event')  # opened, clicked, bounced, unsubscribed
-    
-    # Update campaign stats
-    # Update lead engagement score
-    # Trigger follow-up automations
-    
+    """Webhook for email events (opens, clicks, bounces) - single event or batch
+    
+    Die Payload wird nur in die Webhook-Queue geschrieben; Deduplizierung,
+    Speicherung und Zähler laufen gebündelt im EmailEventIngestor.
+    """
+    body = request.get_data()
+    if not body:
+        return jsonify({'success': False, 'error': 'Leere Payload'}), 400
+    
+    pool = get_email_event_pool()
+    pool.ensure_started(current_app._get_current_object())
+    pool.queue.append(body)
+    pool.notify()
     return jsonify({'success': True})
 
 
+@broly_bp.route('/webhook/broly/email-event/status', methods=['GET'])
+def email_event_status():
+    """Queue depth, worker counters and dedupe statistics"""
+    pool = get_email_event_pool()
+    return jsonify({'success': True, 'webhooks': pool.metrics(), 'ingestion': pool.handler.metrics()})
+
+
 # ----- ANALYTICS API -----
 
 @broly_bp.route('/api/broly/analytics', methods=['GET'])
 def get_analytics():
-    """Get analytics data"""
+    """Get analytics data - campaign numbers come from the hourly rollups"""
     period = request.args.get('period', '7d')
+    since = datetime.utcnow() - parse_period(period)
+    db = get_db()
+    leads_table = get_table('leads')
+    campaigns_table = get_table('campaigns')
+    
+    leads = db.session.execute(
+        select(
+            func.count(),
+            func.count(case((leads_table.c.created_at >= since, 1))),
+            func.count(case((leads_table.c.converted_at >= since, 1)))
+        ).select_from(leads_table)
+    ).one()
+    new_leads = leads[1]
+    
+    summary = CAMPAIGN_ROLLUPS.summary(since=since)
+    active = db.session.execute(
+        select(func.count()).select_from(campaigns_table).where(campaigns_table.c.status == 'running')
+    ).scalar()
+    
+    top = sorted(summary['campaigns'].items(), key=lambda item: item[1]['converted'], reverse=True)[:5]
+    names = dict(db.session.execute(
+        select(campaigns_table.c.id, campaigns_table.c.name)
+        .where(campaigns_table.c.id.in_([campaign_id for campaign_id, _ in top]))
+    ).all()) if top else {}
     
     analytics = {
+        'period': period,
         'leads': {
-            'total': 1247,
-            'new_this_period': 89,
-            'converted': 34,
-            'conversion_rate': 8.5
+            'total': leads[0],
+            'new_this_period': new_leads,
+            'converted': leads[2],
+            'conversion_rate': round(100.0 * leads[2] / new_leads, 1) if new_leads else 0.0
         },
         'campaigns': {
-            'active': 4,
-            'sent': 2450,
-            'open_rate': 45.2,
-            'click_rate': 12.8,
-            'reply_rate': 5.3
+            'active': active,
+            **summary['total'],
+            **rates(summary['total'])
         },
         'channels': {
-            'email': {'sent': 1800, 'open_rate': 42.1, 'click_rate': 11.2},
-            'whatsapp': {'sent': 500, 'delivery_rate': 89.0, 'reply_rate': 23.4},
-            'sms': {'sent': 150, 'delivery_rate': 95.0, 'click_rate': 8.9}
+            channel: {**counters, **rates(counters)} for channel, counters in summary['channels'].items()
         },
         'top_performing': [
-            {'campaign': 'Smart Home Launch', 'conversions': 12, 'roi': 450},
-            {'campaign': 'LOXONE Partners', 'conversions': 8, 'roi': 320}
+            {'campaign_id': campaign_id, 'campaign': names.get(campaign_id),
+             'conversions': counters['converted'], 'sent': counters['sent']}
+            for campaign_id, counters in top
         ]
     }
     
     return jsonify({'success': True, 'analytics': analytics})
 
 
+@broly_bp.route('/api/broly/analytics/rebuild', methods=['POST'])
+def rebuild_analytics():
+    """Recompute the campaign rollups from campaign_events"""
+    campaign_id = (request.json or {}).get('campaign_id') if request.is_json else None
+    result = CAMPAIGN_ROLLUPS.rebuild(campaign_id)
+    return jsonify({'success': True, **result})
+
+
 # ----- TEMPLATES API -----
 
 @broly_bp.route('/api/broly/templates', methods=['GET'])
 def get_templates():
     """Get message templates"""
     template_type = request.args.get('type', 'all')
+    templates_table = get_table('templates')
     
-    templates = [
-        {
-            'id': 1,
-            'name': 'Cold Email - Smart Home',
-            'type': 'email',
-            'category': 'outreach',
-            'subject': 'Interesse an Smart Home für {{company}}?',
-            'content': 'Hallo {{first_name}},\n\nich habe gesehen, dass {{company}} im Bereich...',
-            'variables': ['first_name', 'company', 'industry'],
-            'use_count': 234,
-            'avg_open_rate': 48.5
-        },
-        {
-            'id': 2,
-            'name': 'WhatsApp - Erstansprache',
-            'type': 'whatsapp',
-            'category': 'outreach',
-            'subject': None,
-            'content': 'Hallo {{first_name}}! 👋\n\nHier ist Ömer von West Money...',
-            'variables': ['first_name'],
-            'use_count': 156,
-            'avg_open_rate': 92.0
-        }
-    ]
-    
+    query = select(templates_table).where(templates_table.c.is_active.is_(True)).order_by(templates_table.c.id)
     if template_type != 'all':
-        templates = [t for t in templates if t['type'] == template_type]
+        query = query.where(templates_table.c.type == template_type)
+    
+    templates = []
+    for row in get_db().session.execute(query).mappings():
+        template = dict(row)
+        template['variables'] = json.loads(template['variables'] or '[]')
+        template['created_at'] = template['created_at'].isoformat() if template['created_at'] else None
+        templates.append(template)
     
     return jsonify({'success': True, 'templates': templates})
 
 
+def _template_variables(data):
+    """Variables used in subject + content (compiled once, cached by text)"""
+    variables = compile_template(data.get('subject')).variables + compile_template(data.get('content')).variables
+    return list(dict.fromkeys(variables))
+
+
 @broly_bp.route('/api/broly/templates', methods=['POST'])
 def create_template():
     """Create a new template"""
-    data = request.json
-    
-    # Extract variables from content
-    import re
-    content = data.get('content', '')
-    variables = re.findall(r'\{\{(\w+)\}\}', content)
+    data = request.json or {}
+    if not data.get('name'):
+        return jsonify({'success': False, 'error': 'Name erforderlich'}), 400
     
     template = {
-        'id': random.randint(100, 9999),
-        **data,
-        'variables': list(set(variables)),
+        'name': data['name'],
+        'type': data.get('type', 'email'),
+        'category': data.get('category'),
+        'subject': data.get('subject'),
+        'content': data.get('content', ''),
+        'variables': json.dumps(_template_variables(data)),
+        'version': 1,
         'use_count': 0,
-        'created_at': datetime.now().isoformat()
+        'created_at': datetime.utcnow()
     }
     
+    db = get_db()
+    result = db.session.execute(insert(get_table('templates')).values(**template))
+    db.session.commit()
+    
+    template.update({
+        'id': result.inserted_primary_key[0],
+        'variables': json.loads(template['variables']),
+        'created_at': template['created_at'].isoformat()
+    })
     return jsonify({'success': True, 'template': template})
 
 
+@broly_bp.route('/api/broly/templates/<int:template_id>', methods=['PUT'])
+def update_template(template_id):
+    """Update a template - bumps the version, so cached compilations are replaced"""
+    data = request.json or {}
+    templates_table = get_table('templates')
+    db = get_db()
+    
+    current = db.session.execute(
+        select(templates_table.c.subject, templates_table.c.content)
+        .where(templates_table.c.id == template_id)
+    ).mappings().first()
+    if current is None:
+        return jsonify({'success': False, 'error': 'Template nicht gefunden'}), 404
+    
+    values = {key: data[key] for key in ('name', 'type', 'category', 'subject', 'content', 'is_active') if key in data}
+    merged = {**current, **values}
+    values['variables'] = json.dumps(_template_variables(merged))
+    
+    db.session.execute(
+        update(templates_table)
+        .where(templates_table.c.id == template_id)
+        .values(version=func.coalesce(templates_table.c.version, 1) + 1, **values)
+    )
+    db.session.commit()
+    return jsonify({'success': True, 'template_id': template_id, 'variables': json.loads(values['variables'])})
+
+
 # ============================================================================
 # LEAD SCORING ENGINE
 # ============================================================================
@@ -2356,6 +2560,39 @@ class LeadScoringEngine:
     }
     
     DECAY_RATE = 0.05  # 5% decay per week of inactivity
+    DECAY_PERIOD_SECONDS = 7 * 24 * 3600
+    
+    # Event-Typen (CampaignEvent.event_type, LeadActivity.activity_type) -> SCORING_RULES
+    EVENT_RULES = {
+        'opened': 'email_opened',
+        'clicked': 'email_clicked',
+        'page_view': 'page_views',
+        'meeting': 'meeting_booked',
+        'form': 'form_submit',
+        'download': 'content_download'
+    }
+    
+    DECISION_MAKER_TITLES = ['ceo', 'cto', 'cfo', 'owner', 'director', 'head', 'vp', 'president', 'founder']
+    TEMPERATURES = ('cold', 'warm', 'hot')  # Index = Code für das Batch-Scoring
+    
+    # Spalten für calculate_scores() - Präsenz-Flags (0/1) und Zähler
+    FRAME_WEIGHTS = {
+        'has_email': SCORING_RULES['has_email'],
+        'has_phone': SCORING_RULES['has_phone'],
+        'has_company': SCORING_RULES['has_company'],
+        'has_job_title': SCORING_RULES['has_job_title'],
+        'is_decision_maker': SCORING_RULES['is_decision_maker'],
+        'email_opens': SCORING_RULES['email_opened'],
+        'email_clicks': SCORING_RULES['email_clicked'],
+        'website_visits': SCORING_RULES['website_visit']
+    }
+    # Integer-Spalten aus _frame_query() - danach folgen engagement + decayed_at
+    FRAME_COLUMNS = (
+        'id', 'old_score', 'old_temperature',
+        'has_email', 'has_phone', 'has_company', 'has_job_title', 'is_decision_maker'
+    )
+    
+    RESCORE_CHUNK = 50000
     
     @classmethod
     def calculate_score(cls, lead_data: dict, engagement_data: dict = None) -> dict:
@@ -2381,8 +2618,7 @@ class LeadScoringEngine:
             factors.append(('has_job_title', cls.SCORING_RULES['has_job_title']))
             
             # Check if decision maker
-            dm_titles = ['ceo', 'cto', 'cfo', 'owner', 'director', 'head', 'vp', 'president', 'founder']
-            if any(t in lead_data['job_title'].lower() for t in dm_titles):
+            if any(t in lead_data['job_title'].lower() for t in cls.DECISION_MAKER_TITLES):
                 score += cls.SCORING_RULES['is_decision_maker']
                 factors.append(('is_decision_maker', cls.SCORING_RULES['is_decision_maker']))
         
@@ -2410,6 +2646,283 @@ class LeadScoringEngine:
             'recommendation': cls._get_recommendation(score, temperature)
         }
     
+    @classmethod
+    def calculate_scores(cls, frame: dict) -> dict:
+        """Score many leads at once from columnar arrays
+        
+        frame: gleich lange Arrays (NumPy oder Sequenzen) für die Keys aus
+        FRAME_WEIGHTS - fehlende Spalten zählen als 0. Entspricht
+        calculate_score() pro Zeile (is_decision_maker nur mit Job-Titel).
+        Optional 'engagement': bereits abgeklungene Engagement-Punkte (float).
+        """
+        scores, codes = cls._score_columns(frame)
+        if np is not None:
+            temperatures = np.asarray(cls.TEMPERATURES)[codes]
+        else:
+            temperatures = [cls.TEMPERATURES[c] for c in codes]
+        return {'score': scores, 'temperature': temperatures}
+    
+    @classmethod
+    def _score_columns(cls, frame):
+        """-> (scores, temperature codes) as arrays"""
+        columns = {k: frame[k] for k in cls.FRAME_WEIGHTS if k in frame and len(frame[k])}
+        present = list(columns.values()) + ([frame['engagement']] if 'engagement' in frame else [])
+        length = len(present[0]) if present else 0
+        
+        if np is not None:
+            scores = np.zeros(length, dtype=np.int64)
+            for key, values in columns.items():
+                values = np.asarray(values, dtype=np.int64)
+                if key == 'is_decision_maker' and 'has_job_title' in columns:
+                    values = values & np.asarray(columns['has_job_title'], dtype=np.int64)
+                scores += values * cls.FRAME_WEIGHTS[key]
+            if 'engagement' in frame:
+                scores += np.rint(np.asarray(frame['engagement'], dtype=np.float64)).astype(np.int64)
+            np.clip(scores, 0, 100, out=scores)
+            codes = (scores >= 40).astype(np.int8) + (scores >= 70)
+            return scores, codes
+        
+        scores = array('q', bytes(8 * length))
+        for key, values in columns.items():
+            weight = cls.FRAME_WEIGHTS[key]
+            if key == 'is_decision_maker' and 'has_job_title' in columns:
+                values = [a and b for a, b in zip(values, columns['has_job_title'])]
+            scores = array('q', [s + int(v) * weight for s, v in zip(scores, values)])
+        if 'engagement' in frame:
+            scores = array('q', [s + round(e) for s, e in zip(scores, frame['engagement'])])
+        scores = array('q', [max(0, min(s, 100)) for s in scores])
+        codes = array('b', [(s >= 40) + (s >= 70) for s in scores])
+        return scores, codes
+    
+    @classmethod
+    def _frame_query(cls, leads, after_id, limit):
+        """SELECT computing presence flags in SQL - one int row per lead"""
+        def present(column):
+            return case((and_(column.isnot(None), column != ''), 1), else_=0)
+        
+        title = func.lower(func.coalesce(leads.c.job_title, ''))
+        return (
+            select(
+                leads.c.id,
+                func.coalesce(leads.c.score, 0),
+                case((leads.c.temperature == 'hot', 2), (leads.c.temperature == 'warm', 1), else_=0),
+                present(leads.c.email),
+                present(leads.c.phone),
+                present(leads.c.company_name),
+                present(leads.c.job_title),
+                case((or_(*[title.contains(t) for t in cls.DECISION_MAKER_TITLES]), 1), else_=0),
+                func.coalesce(leads.c.engagement_score, cls._legacy_engagement_sql(leads)),
+                leads.c.engagement_decayed_at
+            )
+            .where(leads.c.id > after_id)
+            .order_by(leads.c.id)
+            .limit(limit)
+        )
+    
+    @classmethod
+    def rescore_all(cls, chunk_size: int = None) -> dict:
+        """Materialize decayed scores for the whole leads table (chunked, only changed rows)
+        
+        Events halten den Score laufend aktuell (apply_events); dieser Lauf
+        schreibt nur den inzwischen eingetretenen Zerfall in score/temperature,
+        damit Sortierung und Filter in SQL stimmen.
+        """
+        db = get_db()
+        leads = get_table('leads')
+        chunk_size = chunk_size or cls.RESCORE_CHUNK
+        now = datetime.utcnow()
+        stmt = (
+            update(leads)
+            .where(leads.c.id == bindparam('_id'))
+            .values(score=bindparam('_score'), temperature=bindparam('_temperature'))
+        )
+        
+        stats = {'scored': 0, 'updated': 0}
+        after_id = 0
+        width = len(cls.FRAME_COLUMNS)
+        while True:
+            rows = db.session.execute(cls._frame_query(leads, after_id, chunk_size)).all()
+            if not rows:
+                break
+            
+            ages = [(now - r[width + 1]).total_seconds() if r[width + 1] else 0.0 for r in rows]
+            if np is not None:
+                matrix = np.fromiter(
+                    chain.from_iterable(r[:width] for r in rows), dtype=np.int64, count=len(rows) * width
+                ).reshape(len(rows), width)
+                frame = dict(zip(cls.FRAME_COLUMNS, matrix.T))
+                engagement = np.fromiter((r[width] for r in rows), dtype=np.float64, count=len(rows))
+                frame['engagement'] = engagement * cls._decay_factor(np.maximum(np.asarray(ages), 0.0))
+            else:
+                frame = dict(zip(cls.FRAME_COLUMNS, zip(*(r[:width] for r in rows))))
+                frame['engagement'] = [r[width] * cls._decay_factor(max(age, 0.0)) for r, age in zip(rows, ages)]
+            
+            scores, codes = cls._score_columns(frame)
+            changed = [
+                {'_id': lead_id, '_score': score, '_temperature': cls.TEMPERATURES[code]}
+                for lead_id, score, code, old_score, old_code in zip(
+                    _as_list(frame['id']), _as_list(scores), _as_list(codes),
+                    _as_list(frame['old_score']), _as_list(frame['old_temperature'])
+                )
+                if score != old_score or code != old_code
+            ]
+            if changed:
+                db.session.execute(stmt, changed)
+            db.session.commit()
+            
+            stats['scored'] += len(rows)
+            stats['updated'] += len(changed)
+            after_id = rows[-1][0]
+        
+        return stats
+    
+    # -------------------------------------------------------------------------
+    # INCREMENTAL SCORING (Zerfall in geschlossener Form)
+    # -------------------------------------------------------------------------
+    # Pro Lead werden engagement_score und engagement_decayed_at gespeichert.
+    # Der Wert zum Zeitpunkt t ist engagement_score * (1 - DECAY_RATE) ** (Δt / Woche)
+    # - ein Event zerfällt den gespeicherten Wert bis jetzt und addiert sein Delta,
+    # ohne Historie oder Neuberechnung über alle Events.
+    
+    @classmethod
+    def _decay_factor(cls, age_seconds):
+        return (1 - cls.DECAY_RATE) ** (age_seconds / cls.DECAY_PERIOD_SECONDS)
+    
+    @classmethod
+    def decayed(cls, value: float, since: datetime, now: datetime) -> float:
+        """Engagement value stored at `since`, decayed until `now`"""
+        return value * cls._decay_factor(max((now - since).total_seconds(), 0.0))
+    
+    @classmethod
+    def event_points(cls, event_type) -> int:
+        """Score delta for an event type (or explicit points) - 0 for anything unknown"""
+        if isinstance(event_type, bool):
+            return 0
+        if isinstance(event_type, (int, float)):
+            return event_type if math.isfinite(event_type) else 0
+        if not isinstance(event_type, str):
+            return 0
+        rule = cls.EVENT_RULES.get(event_type, event_type)
+        return cls.SCORING_RULES.get(rule, 0)
+    
+    @classmethod
+    def temperature_for(cls, score: int) -> str:
+        return cls.TEMPERATURES[(score >= 40) + (score >= 70)]
+    
+    @classmethod
+    def _legacy_engagement_sql(cls, leads):
+        # Leads ohne engagement_decayed_at starten mit ihren Zählern
+        return (
+            func.coalesce(leads.c.email_opens, 0) * cls.SCORING_RULES['email_opened']
+            + func.coalesce(leads.c.email_clicks, 0) * cls.SCORING_RULES['email_clicked']
+            + func.coalesce(leads.c.website_visits, 0) * cls.SCORING_RULES['website_visit']
+        )
+    
+    @classmethod
+    def _score_row(cls, row, now):
+        """(stored engagement, its timestamp, profile score) for a lead row"""
+        since = row.engagement_decayed_at
+        if since is None:
+            value, since = float(row.legacy_engagement or 0), now
+        else:
+            value = row.engagement_score or 0.0
+        return value, since, cls.calculate_score(row._mapping)['score']
+    
+    @staticmethod
+    def _final_score(profile, engagement):
+        return max(0, min(100, round(profile + engagement)))
+    
+    @classmethod
+    def _score_select(cls, leads):
+        return select(
+            leads.c.id, leads.c.email, leads.c.phone, leads.c.company_name, leads.c.job_title,
+            leads.c.engagement_score, leads.c.engagement_decayed_at,
+            cls._legacy_engagement_sql(leads).label('legacy_engagement')
+        )
+    
+    @classmethod
+    def apply_events(cls, events, now: datetime = None) -> dict:
+        """Apply engagement events in O(1) per event - caller commits
+        
+        events: Iterable von (lead_id, event_type oder Punkte, occurred_at|None).
+        Pro Lead ein SELECT ... FOR UPDATE und ein UPDATE (executemany), egal
+        wie viele Events. Verspätete Events werden ab ihrem Zeitpunkt zerfallen.
+        Returns {lead_id: {'score', 'temperature'}}.
+        """
+        db = get_db()
+        leads = get_table('leads')
+        now = now or datetime.utcnow()
+        
+        per_lead = {}
+        for lead_id, event_type, occurred_at in events:
+            points = cls.event_points(event_type)
+            if points:
+                per_lead.setdefault(lead_id, []).append((occurred_at or now, points))
+        if not per_lead:
+            return {}
+        
+        rows = db.session.execute(
+            cls._score_select(leads).where(leads.c.id.in_(list(per_lead))).with_for_update()
+        ).all()
+        
+        updates, results = [], {}
+        for row in rows:
+            value, since, profile = cls._score_row(row, now)
+            deltas = per_lead[row.id]
+            anchor = max([since] + [t for t, _ in deltas])
+            value = cls.decayed(value, since, anchor) + sum(
+                points * cls._decay_factor((anchor - t).total_seconds()) for t, points in deltas
+            )
+            
+            score = cls._final_score(profile, cls.decayed(value, anchor, now))
+            temperature = cls.temperature_for(score)
+            updates.append({
+                '_id': row.id, '_engagement': value, '_decayed_at': anchor,
+                '_score': score, '_temperature': temperature
+            })
+            results[row.id] = {'score': score, 'temperature': temperature}
+        
+        if updates:
+            db.session.execute(
+                update(leads)
+                .where(leads.c.id == bindparam('_id'))
+                .values(
+                    engagement_score=bindparam('_engagement'),
+                    engagement_decayed_at=bindparam('_decayed_at'),
+                    score=bindparam('_score'),
+                    temperature=bindparam('_temperature')
+                ),
+                updates
+            )
+        return results
+    
+    @classmethod
+    def apply_event(cls, lead_id: int, event_type, occurred_at: datetime = None):
+        """Apply one event and commit - returns {'score', 'temperature'} or None"""
+        result = cls.apply_events([(lead_id, event_type, occurred_at)])
+        get_db().session.commit()
+        return result.get(lead_id)
+    
+    @classmethod
+    def current_score(cls, lead_id: int, materialize: bool = True):
+        """Score as of now (lazy decay) - optionally written to score/temperature"""
+        db = get_db()
+        leads = get_table('leads')
+        row = db.session.execute(cls._score_select(leads).where(leads.c.id == lead_id)).first()
+        if row is None:
+            return None
+        
+        now = datetime.utcnow()
+        value, since, profile = cls._score_row(row, now)
+        score = cls._final_score(profile, cls.decayed(value, since, now))
+        temperature = cls.temperature_for(score)
+        if materialize:
+            db.session.execute(
+                update(leads).where(leads.c.id == lead_id).values(score=score, temperature=temperature)
+            )
+            db.session.commit()
+        return {'score': score, 'temperature': temperature}
+    
     @classmethod
     def _get_recommendation(cls, score: int, temperature: str) -> str:
         """Get action recommendation based on score"""
@@ -2421,6 +2934,19 @@ class LeadScoringEngine:
             return 'In Nurturing-Sequenz aufnehmen. Mehr Engagement generieren.'
 
 
+def _as_list(values):
+    """NumPy array or sequence -> list of Python ints"""
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+class LeadScoringBot:
+    """Nightly materialization of decayed scores (bot_scheduler)"""
+    
+    @classmethod
+    def run(cls):
+        return LeadScoringEngine.rescore_all()
+
+
 # ============================================================================
 # AUTOMATION ENGINE
 # ============================================================================
@@ -2455,6 +2981,11 @@ class AutomationEngine:
         'condition': 'Bedingung prüfen'
     }
     
+    # Von execute_action() bzw. dem ActionExecutor (wait) tatsächlich ausgeführt
+    SUPPORTED_ACTIONS = frozenset({
+        'send_email', 'send_whatsapp', 'add_tag', 'update_score', 'change_stage', 'create_task', 'wait'
+    })
+    
     @classmethod
     def check_trigger(cls, trigger_type: str, trigger_config: dict, event_data: dict) -> bool:
         """Check if automation should trigger"""
@@ -2475,6 +3006,11 @@ class AutomationEngine:
             
         return False
     
+    @classmethod
+    def dispatch(cls, trigger_type: str, event_data: dict) -> list:
+        """Automations triggered by an event (via TRIGGER_INDEX, not a scan)"""
+        return TRIGGER_INDEX.match(trigger_type, event_data)
+    
     @classmethod
     def execute_action(cls, action_type: str, action_config: dict, lead_data: dict) -> dict:
         """Execute an automation action"""
@@ -2513,6 +3049,674 @@ class AutomationEngine:
         return result
 
 
+class TriggerIndex:
+    """Active automations compiled into lookup tables per trigger type
+    
+    - new_lead: Liste aller aktiven Automationen
+    - tag_added / stage_change: dict Tag bzw. Ziel-Stage -> IDs
+    - score_threshold: nach Schwelle sortierte Liste, bisect liefert alle
+      Schwellen <= Score (mit old_score nur die, die überschritten wurden)
+    
+    Ein Event berührt damit nur passende Automationen statt alle mit
+    check_trigger() zu prüfen. Änderungen an einzelnen Zeilen werden per
+    refresh() inkrementell übernommen (automations.updated_at), auch wenn
+    sie in einem anderen Worker-Prozess passiert sind.
+    """
+    
+    REFRESH_SECONDS = 5
+    SUPPORTED = ('new_lead', 'score_threshold', 'tag_added', 'stage_change')
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+    
+    def _reset(self):
+        self._automations = {}  # id -> kompilierte Automation
+        self._unconditional = {}  # trigger_type -> set(ids)
+        self._by_key = {'tag_added': {}, 'stage_change': {}}
+        self._thresholds = []  # sortiert: (threshold, id)
+        self._loaded = False
+        self._seen_until = None
+        self._checked_at = 0.0
+    
+    @staticmethod
+    def compile(row) -> dict:
+        """Automation row -> dict with parsed config and actions"""
+        def parse(value, default):
+            if not value:
+                return default
+            try:
+                return json.loads(value) if isinstance(value, str) else value
+            except ValueError:
+                return default
+        
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'trigger_type': row['trigger_type'],
+            'trigger_config': parse(row['trigger_config'], {}),
+            'actions': parse(row['actions'], []),
+            'is_active': bool(row['is_active'])
+        }
+    
+    def _index_key(self, automation):
+        """Tag / stage / numeric threshold the automation is indexed under (None: not indexable)"""
+        trigger_type, config = automation['trigger_type'], automation['trigger_config']
+        if trigger_type in self._by_key:
+            # Ohne Tag/Stage würde die Automation auf Events ohne Tag/Stage feuern
+            return config.get('tag' if trigger_type == 'tag_added' else 'stage') or None
+        if trigger_type == 'score_threshold':
+            try:
+                return float(config.get('threshold', 70))  # aus dem Formular oft als String
+            except (TypeError, ValueError):
+                return None
+        return trigger_type
+    
+    def _remove(self, automation_id):
+        old = self._automations.pop(automation_id, None)
+        if old is None:
+            return
+        trigger_type, key = old['trigger_type'], self._index_key(old)
+        if trigger_type in self._by_key:
+            ids = self._by_key[trigger_type].get(key)
+            if ids:
+                ids.discard(automation_id)
+                if not ids:
+                    del self._by_key[trigger_type][key]
+        elif trigger_type == 'score_threshold':
+            entry = (key, automation_id)
+            i = bisect.bisect_left(self._thresholds, entry)
+            if i < len(self._thresholds) and self._thresholds[i] == entry:
+                del self._thresholds[i]
+        else:
+            self._unconditional.get(trigger_type, set()).discard(automation_id)
+    
+    def _add(self, automation):
+        if not automation['is_active'] or automation['trigger_type'] not in self.SUPPORTED:
+            return
+        key = self._index_key(automation)
+        if key is None:
+            return
+        automation_id = automation['id']
+        trigger_type = automation['trigger_type']
+        self._automations[automation_id] = automation
+        if trigger_type in self._by_key:
+            self._by_key[trigger_type].setdefault(key, set()).add(automation_id)
+        elif trigger_type == 'score_threshold':
+            bisect.insort(self._thresholds, (key, automation_id))
+        else:
+            self._unconditional.setdefault(trigger_type, set()).add(automation_id)
+    
+    def upsert(self, row):
+        """(Re)index one automation row - inactive rows are dropped"""
+        automation = self.compile(row)
+        with self._lock:
+            self._remove(automation['id'])
+            self._add(automation)
+    
+    def remove(self, automation_id):
+        with self._lock:
+            self._remove(automation_id)
+    
+    def refresh(self, force=False):
+        """Load all active automations once, then only rows changed since the last check"""
+        now = time.monotonic()
+        if not force and self._loaded and now - self._checked_at < self.REFRESH_SECONDS:
+            return
+        
+        automations = get_table('automations')
+        stmt = select(automations)
+        if self._loaded and not force:
+            stmt = stmt.where(automations.c.updated_at >= self._seen_until)
+        else:
+            stmt = stmt.where(automations.c.is_active.is_(True))
+        rows = get_db().session.execute(stmt).mappings().all()
+        
+        with self._lock:
+            if force or not self._loaded:
+                self._reset()
+            for row in rows:
+                self._remove(row['id'])
+                self._add(self.compile(row))
+                if row['updated_at'] and (self._seen_until is None or row['updated_at'] > self._seen_until):
+                    self._seen_until = row['updated_at']
+            if self._seen_until is None:
+                self._seen_until = datetime.utcnow()
+            self._loaded = True
+            self._checked_at = now
+    
+    def match(self, trigger_type: str, event_data: dict) -> list:
+        """Automations whose trigger matches the event"""
+        self.refresh()
+        with self._lock:
+            if trigger_type in self._by_key:
+                key_field = 'tags' if trigger_type == 'tag_added' else 'new_stage'
+                keys = event_data.get(key_field)
+                keys = keys if isinstance(keys, (list, tuple, set)) else [keys]
+                ids = set().union(*(self._by_key[trigger_type].get(k, ()) for k in keys))
+            elif trigger_type == 'score_threshold':
+                score = event_data.get('score', 0)
+                hi = bisect.bisect_right(self._thresholds, (score, float('inf')))
+                lo = 0
+                if event_data.get('old_score') is not None:
+                    lo = bisect.bisect_right(self._thresholds, (event_data['old_score'], float('inf')))
+                ids = {automation_id for _, automation_id in self._thresholds[lo:hi]}
+            else:
+                ids = self._unconditional.get(trigger_type, set())
+            return [self._automations[i] for i in sorted(ids)]
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._automations),
+                'new_lead': len(self._unconditional.get('new_lead', ())),
+                'tags': len(self._by_key['tag_added']),
+                'stages': len(self._by_key['stage_change']),
+                'thresholds': len(self._thresholds)
+            }
+
+
+TRIGGER_INDEX = TriggerIndex()
+
+
+# ============================================================================
+# AUTOMATION EXECUTOR (dauerhafte Aktions-Sequenzen mit Wartezeiten)
+# ============================================================================
+
+class ActionExecutor:
+    """Durable, resumable executor for automation action sequences
+    
+    Jede ausgelöste Automation wird pro Lead als Zeile in automation_runs
+    gespeichert (step_index = nächste Aktion). Aktionen laufen nacheinander,
+    bis ein 'wait' kommt - dann wird due_at gesetzt und die Zeile ruht in
+    der Datenbank. Ein Loader holt alles, was innerhalb von LOOKAHEAD_SECONDS
+    fällig wird, beansprucht es per lease_owner und legt es ins TimingWheel;
+    fällige Einträge gehen batchweise an den Worker-Pool.
+    
+    Nach einem Neustart werden pending/waiting-Zeilen einfach wieder geladen;
+    'scheduled'-Zeilen eines toten Prozesses werden nach LEASE_SECONDS neu
+    vergeben (at-least-once pro Abschnitt zwischen zwei Wartezeiten).
+    """
+    
+    LOOKAHEAD_SECONDS = 300
+    LOAD_INTERVAL = 10
+    LOAD_LIMIT = 5000
+    LEASE_SECONDS = 600
+    BATCH_SIZE = 200
+    WORKERS = 4
+    MAX_ATTEMPTS = 5
+    RETRY_BACKOFF_SECONDS = 60
+    METRICS_WINDOW_SECONDS = 60
+    
+    DELAY_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    
+    def __init__(self):
+        self.wheel = None
+        self.pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._recent = deque()  # (finished monotonic, lag seconds)
+        self.counters = {'runs_started': 0, 'steps_executed': 0, 'runs_completed': 0,
+                         'runs_failed': 0, 'batches': 0, 'loaded': 0}
+        self.last_error = None
+    
+    # -------------------------------------------------------------------------
+    # Public API
+    # -------------------------------------------------------------------------
+    
+    @classmethod
+    def parse_delay(cls, delay) -> int:
+        """'30m', '2h', '1d', 90 -> seconds"""
+        if isinstance(delay, (int, float)):
+            return int(delay)
+        delay = str(delay or '').strip().lower()
+        if delay[-1:] in cls.DELAY_UNITS and delay[:-1].isdigit():
+            return int(delay[:-1]) * cls.DELAY_UNITS[delay[-1]]
+        return int(delay) if delay.isdigit() else 0
+    
+    def start_runs(self, automations, lead_id):
+        """Persist one run per triggered automation - executed by the worker pool"""
+        if not automations:
+            return []
+        runs = get_table('automation_runs')
+        now = datetime.utcnow()
+        db = get_db()
+        db.session.execute(insert(runs), [
+            {'automation_id': a['id'], 'lead_id': lead_id, 'step_index': 0, 'status': 'pending',
+             'due_at': now, 'attempts': 0, 'created_at': now, 'updated_at': now}
+            for a in automations
+        ])
+        db.session.commit()
+        with self._lock:
+            self.counters['runs_started'] += len(automations)
+        # Erst starten, wenn dieser Prozess Runs anlegt (wie die Webhook-Pools) -
+        # wartende Runs nach einem Neustart übernimmt start_action_executor()
+        self.ensure_started(current_app._get_current_object())
+        self._wake.set()  # Loader sofort laufen lassen
+        return [a['id'] for a in automations]
+    
+    def ensure_started(self, app):
+        """Start loader, ticker and worker pool once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.wheel = TimingWheel(time.time())
+            self.pool = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='automation')
+            for target in (self._load_loop, self._tick_loop):
+                threading.Thread(target=target, args=(app,), daemon=True,
+                                 name=f'automation-{target.__name__.strip("_")}').start()
+    
+    def metrics(self):
+        with self._lock:
+            self._prune_recent(time.monotonic())
+            lags = [lag for _, lag in self._recent]
+            metrics = dict(self.counters)
+            metrics.update({
+                'steps_per_second': round(len(lags) / self.METRICS_WINDOW_SECONDS, 2),
+                'lag_avg_seconds': round(sum(lags) / len(lags), 3) if lags else 0.0,
+                'lag_max_seconds': round(max(lags), 3) if lags else 0.0,
+                'in_wheel': len(self.wheel) if self.wheel else 0,
+                'last_error': self.last_error
+            })
+        runs = get_table('automation_runs')
+        counts = get_db().session.execute(
+            select(runs.c.status, func.count()).group_by(runs.c.status)
+        ).all()
+        metrics['runs'] = {status: count for status, count in counts}
+        return metrics
+    
+    # -------------------------------------------------------------------------
+    # Loader: Datenbank -> TimingWheel
+    # -------------------------------------------------------------------------
+    
+    def _load_loop(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    loaded = self._load_due()
+            except Exception as e:
+                loaded = 0
+                self._record_error(e)
+            if loaded < self.LOAD_LIMIT:
+                self._wake.wait(self.LOAD_INTERVAL)
+                self._wake.clear()
+    
+    def _load_due(self):
+        runs = get_table('automation_runs')
+        db = get_db()
+        now = datetime.utcnow()
+        horizon = now + timedelta(seconds=self.LOOKAHEAD_SECONDS)
+        abandoned = now - timedelta(seconds=self.LEASE_SECONDS)
+        
+        claimable = or_(
+            and_(runs.c.status.in_(('pending', 'waiting')), runs.c.due_at <= horizon),
+            and_(runs.c.status == 'scheduled', runs.c.due_at < abandoned)
+        )
+        ids = db.session.execute(
+            select(runs.c.id).where(claimable).order_by(runs.c.due_at).limit(self.LOAD_LIMIT)
+        ).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return 0
+        
+        token = uuid.uuid4().hex
+        db.session.execute(
+            update(runs).where(runs.c.id.in_(ids), claimable)
+            .values(status='scheduled', lease_owner=token, updated_at=now)
+        )
+        db.session.commit()
+        
+        claimed = db.session.execute(
+            select(runs.c.id, runs.c.due_at).where(runs.c.lease_owner == token)
+        ).all()
+        db.session.rollback()
+        for run_id, due_at in claimed:
+            self.wheel.add(due_at.replace(tzinfo=timezone.utc).timestamp(), (run_id, token, due_at))
+        with self._lock:
+            self.counters['loaded'] += len(claimed)
+        return len(ids)
+    
+    # -------------------------------------------------------------------------
+    # Ticker + Worker
+    # -------------------------------------------------------------------------
+    
+    def _tick_loop(self, app):
+        while True:
+            due = self.wheel.advance(time.time())
+            for i in range(0, len(due), self.BATCH_SIZE):
+                self.pool.submit(self._run_batch, app, due[i:i + self.BATCH_SIZE])
+            time.sleep(self.wheel.tick)
+    
+    def _run_batch(self, app, entries):
+        # Bei Fehlern bleiben die Zeilen 'scheduled' und werden nach LEASE_SECONDS neu geladen
+        with app.app_context():
+            try:
+                self._execute(entries)
+            except Exception as e:
+                get_db().session.rollback()
+                self._record_error(e)
+    
+    def _execute(self, entries):
+        runs = get_table('automation_runs')
+        db = get_db()
+        now = datetime.utcnow()
+        tokens = {run_id: token for run_id, token, _ in entries}
+        due = {run_id: due_at for run_id, _, due_at in entries}
+        
+        rows = [
+            row for row in db.session.execute(
+                select(runs).where(runs.c.id.in_(list(tokens)), runs.c.status == 'scheduled')
+            ).mappings()
+            if row['lease_owner'] == tokens[row['id']]  # inzwischen neu vergeben?
+        ]
+        if not rows:
+            db.session.rollback()
+            return
+        
+        automations = self._load_automations({row['automation_id'] for row in rows})
+        leads_table = get_table('leads')
+        leads = {
+            lead['id']: dict(lead) for lead in db.session.execute(
+                select(leads_table).where(leads_table.c.id.in_({row['lead_id'] for row in rows}))
+            ).mappings()
+        }
+        
+        updates, completed, steps = [], {}, 0
+        for row in rows:
+            state, executed = self._advance(row, automations.get(row['automation_id']), leads.get(row['lead_id']), now)
+            steps += executed
+            updates.append({'_id': row['id'], **{f'_{k}': v for k, v in state.items()}})
+            if state['status'] == 'completed':
+                completed[row['automation_id']] = completed.get(row['automation_id'], 0) + 1
+        
+        db.session.execute(
+            update(runs).where(runs.c.id == bindparam('_id')).values(
+                step_index=bindparam('_step_index'), status=bindparam('_status'),
+                due_at=bindparam('_due_at'), attempts=bindparam('_attempts'),
+                last_error=bindparam('_last_error'), lease_owner=None, updated_at=now
+            ),
+            updates
+        )
+        if completed:
+            automations_table = get_table('automations')
+            db.session.execute(
+                update(automations_table).where(automations_table.c.id == bindparam('_id')).values(
+                    run_count=func.coalesce(automations_table.c.run_count, 0) + bindparam('_n'),
+                    last_run=now
+                ),
+                [{'_id': automation_id, '_n': n} for automation_id, n in completed.items()]
+            )
+        db.session.commit()
+        
+        finished = time.monotonic()
+        with self._lock:
+            self.counters['steps_executed'] += steps
+            self.counters['runs_completed'] += sum(completed.values())
+            self.counters['runs_failed'] += sum(1 for u in updates if u['_status'] == 'failed')
+            self.counters['batches'] += 1
+            for row in rows:
+                self._recent.append((finished, max(0.0, (now - due[row['id']]).total_seconds())))
+            self._prune_recent(finished)
+    
+    def _prune_recent(self, now):
+        # Beim Anhängen aufräumen - metrics() wird evtl. nie abgefragt (caller holds _lock)
+        while self._recent and now - self._recent[0][0] > self.METRICS_WINDOW_SECONDS:
+            self._recent.popleft()
+    
+    def _advance(self, row, automation, lead, now):
+        """Run actions until the next wait / the end - returns (new state, steps executed)"""
+        state = {'step_index': row['step_index'] or 0, 'status': 'completed',
+                 'due_at': row['due_at'], 'attempts': row['attempts'] or 0, 'last_error': None}
+        if automation is None or not automation['is_active']:
+            state['status'] = 'cancelled'
+            return state, 0
+        
+        actions = automation['actions']
+        executed = 0
+        while state['step_index'] < len(actions):
+            action = actions[state['step_index']]
+            action_type = action.get('type')
+            config = action.get('config', action)
+            state['step_index'] += 1
+            
+            if action_type == 'wait':
+                state['status'] = 'waiting'
+                state['due_at'] = now + timedelta(seconds=self.parse_delay(config.get('delay', '1d')))
+                return state, executed
+            
+            if action_type not in AutomationEngine.SUPPORTED_ACTIONS:
+                # Ein Retry ändert daran nichts - sofort scheitern statt MAX_ATTEMPTS mal warten
+                state['step_index'] -= 1
+                state['status'] = 'failed'
+                state['last_error'] = f'Aktion {action_type} wird nicht unterstützt'
+                return state, executed
+            
+            try:
+                result = AutomationEngine.execute_action(action_type, config, lead or {})
+            except Exception as e:
+                result = {'success': False, 'message': str(e)}
+            executed += 1
+            
+            if not result.get('success'):
+                state['step_index'] -= 1
+                state['attempts'] += 1
+                state['last_error'] = result.get('message') or f'Aktion {action_type} fehlgeschlagen'
+                if state['attempts'] >= self.MAX_ATTEMPTS:
+                    state['status'] = 'failed'
+                else:
+                    state['status'] = 'waiting'
+                    state['due_at'] = now + timedelta(seconds=self.RETRY_BACKOFF_SECONDS * 2 ** (state['attempts'] - 1))
+                return state, executed
+            state['attempts'] = 0
+        
+        return state, executed
+    
+    def _load_automations(self, automation_ids):
+        automations_table = get_table('automations')
+        rows = get_db().session.execute(
+            select(automations_table).where(automations_table.c.id.in_(automation_ids))
+        ).mappings()
+        return {row['id']: TriggerIndex.compile(row) for row in rows}
+    
+    def _record_error(self, error):
+        with self._lock:
+            self.last_error = str(error)
+
+
+ACTION_EXECUTOR = ActionExecutor()
+
+
+def start_action_executor(app):
+    """Explicit entry point (e.g. bot_scheduler) - resumes waiting runs without web traffic"""
+    ACTION_EXECUTOR.ensure_started(app)
+
+
+# ============================================================================
+# EMAIL EVENT INGESTION (Provider-Webhooks in Batches)
+# ============================================================================
+
+class EmailEventIngestor:
+    """Dedupe, store and count queued email-provider events per flush window
+    
+    Ein Aufruf = ein claim() der Webhook-Queue (viele Requests, je Request
+    ein Event oder eine Liste wie bei SendGrid). Duplikate fallen über die
+    Provider-Event-ID heraus (SeenSet, SEEN_TTL_SECONDS). Pro Fenster ein
+    Bulk-INSERT in campaign_events plus je ein executemany-UPDATE für die
+    Lead-Zähler, das Engagement-Scoring und die Kampagnen-Zähler.
+    """
+    
+    SEEN_TTL_SECONDS = 72 * 3600  # SendGrid wiederholt Zustellungen bis zu 72h
+    SEEN_HOLD_SECONDS = 150  # Vormerkung bis zum Commit - kürzer als das Queue-Lease (300s)
+    LEAD_COUNTERS = {'opened': 'email_opens', 'clicked': 'email_clicks'}
+    CAMPAIGN_COUNTERS = {
+        'opened': 'open_count',
+        'clicked': 'click_count',
+        'replied': 'reply_count',
+        'converted': 'conversion_count'
+    }
+    
+    def __init__(self, seen=None):
+        self.seen = seen or SeenSet('email_events', self.SEEN_TTL_SECONDS)
+        self.stored = 0
+        self.ignored = 0
+        self.last_error = None
+    
+    def __call__(self, payloads):
+        events = self.parse(payloads)
+        # Bis zum Commit nur vorgemerkt: stirbt der Worker vorher, läuft die
+        # Vormerkung vor dem Queue-Lease ab und die Wiederholung zählt
+        new_keys = set(self.seen.add_new([event['key'] for event in events], hold=self.SEEN_HOLD_SECONDS))
+        fresh = []
+        for event in events:
+            if event['key'] in new_keys:
+                new_keys.discard(event['key'])  # Duplikate im selben Fenster
+                fresh.append(event)
+        if not fresh:
+            return
+        
+        keys = [event['key'] for event in fresh]
+        try:
+            self.store(fresh)
+        except Exception:
+            get_db().session.rollback()
+            try:
+                self.seen.forget(keys)  # Retry darf nicht als Duplikat gelten
+            except sqlite3.Error as e:
+                self.last_error = f'Dedupe-Vormerkung nicht entfernt (läuft nach {self.SEEN_HOLD_SECONDS}s ab): {e}'
+            raise
+        self.stored += len(fresh)
+        try:
+            self.seen.confirm(keys)
+        except sqlite3.Error as e:
+            self.last_error = f'Dedupe-Einträge nicht bestätigt: {e}'
+    
+    def parse(self, payloads):
+        """Raw webhook bodies -> normalized events (unknown event types are skipped)"""
+        events = []
+        for payload in payloads:
+            try:
+                body = json.loads(payload)
+            except ValueError:
+                continue  # kaputte Payload nicht endlos wiederholen
+            if isinstance(body, dict):
+                body = body.get('events', [body])
+            
+            for item in body if isinstance(body, list) else []:
+                event_type = EVENT_COUNTERS.get(item.get('event')) if isinstance(item, dict) else None
+                if event_type is None:
+                    self.ignored += 1
+                    continue
+                key = item.get('sg_event_id') or item.get('event_id') or item.get('id')
+                if not key:
+                    key = hashlib.sha1(json.dumps(item, sort_keys=True).encode('utf-8')).hexdigest()
+                timestamp = item.get('timestamp')
+                events.append({
+                    'key': str(key),
+                    'event_type': event_type,
+                    'campaign_id': _as_int(item.get('campaign_id')),
+                    'lead_id': _as_int(item.get('lead_id')),
+                    'timestamp': (datetime.utcfromtimestamp(timestamp)
+                                  if isinstance(timestamp, (int, float)) else datetime.utcnow()),
+                    'raw': item
+                })
+        return events
+    
+    def store(self, events):
+        """Bulk insert + aggregated counter updates for one window - commits"""
+        db = get_db()
+        leads = get_table('leads')
+        campaigns = get_table('campaigns')
+        
+        campaign_ids = {event['campaign_id'] for event in events if event['campaign_id']}
+        if campaign_ids:
+            campaign_ids = set(db.session.execute(
+                select(campaigns.c.id).where(campaigns.c.id.in_(campaign_ids))
+            ).scalars())
+        
+        rows = [{
+            'campaign_id': event['campaign_id'] if event['campaign_id'] in campaign_ids else None,
+            'lead_id': event['lead_id'],
+            'event_type': event['event_type'],
+            'channel': 'email',
+            'metadata': json.dumps(event['raw']),
+            'timestamp': event['timestamp']
+        } for event in events]
+        db.session.execute(insert(get_table('campaign_events')), rows)
+        CAMPAIGN_ROLLUPS.record(rows)
+        
+        # Scoring vor den Zählern: Leads ohne Engagement-Stand starten mit ihren alten Zählern
+        LeadScoringEngine.apply_events(
+            [(row['lead_id'], row['event_type'], row['timestamp']) for row in rows if row['lead_id']]
+        )
+        
+        lead_deltas = {}
+        campaign_deltas = {}
+        for row in rows:
+            column = self.LEAD_COUNTERS.get(row['event_type'])
+            if column and row['lead_id']:
+                deltas = lead_deltas.setdefault(row['lead_id'], dict.fromkeys(self.LEAD_COUNTERS.values(), 0))
+                deltas[column] += 1
+            column = self.CAMPAIGN_COUNTERS.get(row['event_type'])
+            if column and row['campaign_id']:
+                deltas = campaign_deltas.setdefault(row['campaign_id'], dict.fromkeys(self.CAMPAIGN_COUNTERS.values(), 0))
+                deltas[column] += 1
+        
+        # Sortiert nach ID, damit parallele Worker Zeilen in gleicher Reihenfolge sperren
+        if lead_deltas:
+            db.session.execute(
+                update(leads)
+                .where(leads.c.id == bindparam('_id'))
+                .values({column: func.coalesce(leads.c[column], 0) + bindparam(f'_{column}')
+                         for column in self.LEAD_COUNTERS.values()}),
+                [{'_id': lead_id, **{f'_{c}': n for c, n in deltas.items()}}
+                 for lead_id, deltas in sorted(lead_deltas.items())]
+            )
+        if campaign_deltas:
+            db.session.execute(
+                update(campaigns)
+                .where(campaigns.c.id == bindparam('_id'))
+                .values({column: func.coalesce(campaigns.c[column], 0) + bindparam(f'_{column}')
+                         for column in self.CAMPAIGN_COUNTERS.values()}),
+                [{'_id': campaign_id, **{f'_{c}': n for c, n in deltas.items()}}
+                 for campaign_id, deltas in sorted(campaign_deltas.items())]
+            )
+        db.session.commit()
+    
+    def metrics(self):
+        return {'stored': self.stored, 'ignored': self.ignored, 'last_error': self.last_error,
+                'seen': self.seen.metrics()}
+
+
+def _as_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+_email_event_pool = None
+_email_event_pool_lock = threading.Lock()
+
+
+def get_email_event_pool():
+    """Process-wide queue + worker pool for email-provider webhooks"""
+    global _email_event_pool
+    if _email_event_pool is None:
+        with _email_event_pool_lock:
+            if _email_event_pool is None:
+                _email_event_pool = WebhookWorkerPool(
+                    WebhookQueue('email_events'),
+                    EmailEventIngestor(),
+                    workers=EMAIL_EVENT_WORKERS,
+                    batch_size=EMAIL_EVENT_BATCH
+                )
+    return _email_event_pool
+
+
 # ============================================================================
 # INTEGRATION: Register Blueprint
 # ============================================================================
@@ -2524,4 +3728,4 @@ def register_broly_blueprint(app):
 
 
 # Export
-__all__ = ['broly_bp', 'register_broly_blueprint', 'LeadScoringEngine', 'AutomationEngine', 'BROLY_MODELS']
+__all__ = ['broly_bp', 'register_broly_blueprint', 'LeadScoringEngine', 'LeadScoringBot', 'AutomationEngine', 'TriggerIndex', 'ActionExecutor', 'start_action_executor', 'EmailEventIngestor', 'BROLY_MODELS']
@@ -5,10 +5,15 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Blueprint, render_template_string, request, jsonify
+from flask import Blueprint, current_app, render_template_string, request, jsonify
 from datetime import datetime, timedelta
 import json
-import random
+
+from sqlalchemy import select, insert
+
+from campaign_analytics import CAMPAIGN_ROLLUPS, parse_period, rates
+from campaign_dispatcher import CAMPAIGN_DISPATCHER
+from westmoney_db import get_db, get_table
 
 campaigns_bp = Blueprint('campaigns', __name__)
 
@@ -745,53 +750,95 @@ def campaigns_page():
 @campaigns_bp.route('/api/campaigns', methods=['GET'])
 def get_campaigns():
     """Get all campaigns"""
-    campaigns = []
+    campaigns_table = get_table('campaigns')
+    rows = get_db().session.execute(
+        select(
+            campaigns_table.c.id, campaigns_table.c.name, campaigns_table.c.type,
+            campaigns_table.c.status, campaigns_table.c.sent_count, campaigns_table.c.failed_count,
+            campaigns_table.c.open_count, campaigns_table.c.click_count,
+            campaigns_table.c.conversion_count, campaigns_table.c.last_error
+        ).order_by(campaigns_table.c.id.desc())
+    ).mappings().all()
+    campaigns = [dict(row) for row in rows]
     return jsonify({'success': True, 'campaigns': campaigns})
 
 
 @campaigns_bp.route('/api/campaigns', methods=['POST'])
 def create_campaign():
     """Create a new campaign"""
-    data = request.json
+    data = request.json or {}
+    if not data.get('name'):
+        return jsonify({'success': False, 'error': 'Name erforderlich'}), 400
+    
+    scheduled_at = None
+    if data.get('scheduled_at'):  # datetime-local aus dem Formular, leer = sofort
+        try:
+            scheduled_at = datetime.fromisoformat(data['scheduled_at'])
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Ungültiges Datum'}), 400
     
     campaign = {
-        'id': random.randint(100, 9999),
-        **data,
-        'sent_count': 0,
-        'open_count': 0,
-        'click_count': 0,
-        'created_at': datetime.now().isoformat()
+        'name': data['name'],
+        'type': data.get('type', 'email'),
+        'status': 'scheduled' if data.get('status') == 'scheduled' else 'draft',
+        'subject': data.get('subject'),
+        'content': data.get('content'),
+        'template_id': data.get('template_id') or None,
+        'whatsapp_template': data.get('whatsapp_template') or None,
+        'audience_filter': json.dumps({'audience': data.get('audience', 'all')}),
+        'scheduled_at': scheduled_at,
+        'created_at': datetime.utcnow()
     }
     
-    return jsonify({'success': True, 'campaign': campaign})
+    db = get_db()
+    result = db.session.execute(insert(get_table('campaigns')).values(**campaign))
+    db.session.commit()
+    
+    campaign.update({
+        'id': result.inserted_primary_key[0],
+        'scheduled_at': scheduled_at.isoformat() if scheduled_at else None,
+        'created_at': campaign['created_at'].isoformat(),
+        'sent_count': 0,
+        'open_count': 0,
+        'click_count': 0
+    })
+    return jsonify({'success': True, 'campaign': campaign, 'message': 'Kampagne erstellt'})
 
 
 @campaigns_bp.route('/api/campaigns/<int:campaign_id>/start', methods=['POST'])
 def start_campaign(campaign_id):
-    """Start a campaign"""
+    """Start or resume a campaign - sending runs in the background"""
+    ok, message = CAMPAIGN_DISPATCHER.start(campaign_id, current_app._get_current_object())
+    if not ok:
+        status = 404 if message == 'Kampagne nicht gefunden' else 409
+        return jsonify({'success': False, 'error': message}), status
     return jsonify({'success': True, 'message': f'Kampagne {campaign_id} gestartet'})
 
 
 @campaigns_bp.route('/api/campaigns/<int:campaign_id>/pause', methods=['POST'])
 def pause_campaign(campaign_id):
-    """Pause a campaign"""
+    """Pause a campaign after the batch in progress"""
+    if not CAMPAIGN_DISPATCHER.pause(campaign_id):
+        return jsonify({'success': False, 'error': 'Kampagne läuft nicht'}), 409
     return jsonify({'success': True, 'message': f'Kampagne {campaign_id} pausiert'})
 
 
 @campaigns_bp.route('/api/campaigns/<int:campaign_id>/stats', methods=['GET'])
 def get_campaign_stats(campaign_id):
-    """Get campaign statistics"""
-    stats = {
-        'sent': 450,
-        'delivered': 445,
-        'opened': 215,
-        'clicked': 68,
-        'replied': 23,
-        'bounced': 5,
-        'unsubscribed': 2,
-        'conversions': 12
-    }
-    return jsonify({'success': True, 'stats': stats})
+    """Get campaign statistics (from the hourly rollups)"""
+    since = None
+    if request.args.get('period'):
+        since = datetime.utcnow() - parse_period(request.args['period'])
+    
+    summary = CAMPAIGN_ROLLUPS.summary(since=since, campaign_id=campaign_id)
+    stats = dict(summary['total'])
+    stats['conversions'] = stats['converted']
+    stats.update(rates(summary['total']))
+    
+    result = {'success': True, 'stats': stats, 'channels': summary['channels']}
+    if request.args.get('timeline'):
+        result['timeline'] = CAMPAIGN_ROLLUPS.timeline(campaign_id, since)
+    return jsonify(result)
 
 
 def register_campaigns_blueprint(app):
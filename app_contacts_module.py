@@ -5,13 +5,24 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Blueprint, render_template_string, request, jsonify, session, send_file
+from flask import Blueprint, render_template_string, request, jsonify, session, send_file, current_app
 from datetime import datetime
+from sqlalchemy import select, insert, update, bindparam, func, or_, and_
+import base64
+import hashlib
 import json
 import csv
 import io
+import math
 import requests
 import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+from westmoney_db import get_db, get_table
+from streaming_export import csv_response, iter_query, wants_gzip
 
 contacts_bp = Blueprint('contacts', __name__)
 
@@ -714,7 +725,7 @@ CONTACTS_HTML = """
                 </div>
                 <div style="background: rgba(255,0,255,0.1); padding: 15px; border-radius: 10px; margin-top: 15px;">
                     <strong>📋 CSV Format:</strong><br>
-                    <small>first_name, last_name, email, phone, company, tags</small>
+                    <small>first_name, last_name, email, phone, company, tags (oder Explorium-Export)</small>
                 </div>
             </div>
             <div class="modal-footer">
@@ -958,14 +969,32 @@ CONTACTS_HTML = """
                 
                 if (result.success) {
                     closeModal('import');
-                    showToast(`✅ ${result.imported} Kontakte importiert!`);
-                    setTimeout(() => location.reload(), 1000);
+                    showToast('📤 Import läuft...');
+                    pollImport(result.job_id);
+                } else {
+                    showToast(`❌ ${result.error}`, 'error');
                 }
             } catch (error) {
                 showToast('❌ Import fehlgeschlagen', 'error');
             }
         }
         
+        async function pollImport(jobId) {
+            const response = await fetch(`/api/contacts/import/${jobId}`);
+            const result = await response.json();
+            const job = result.job;
+            
+            if (job.status === 'done') {
+                showToast(`✅ ${job.inserted} neu, ${job.updated} aktualisiert!`);
+                setTimeout(() => location.reload(), 1000);
+            } else if (job.status === 'failed') {
+                showToast('❌ Import fehlgeschlagen', 'error');
+            } else {
+                showToast(`📤 Import ${job.progress}% (${job.processed} Zeilen)`);
+                setTimeout(() => pollImport(jobId), 2000);
+            }
+        }
+        
         // HubSpot Sync
         async function syncHubSpot() {
             showToast('🔄 HubSpot Sync gestartet...');
@@ -998,6 +1027,361 @@ CONTACTS_HTML = """
 """
 
 
+# ============================================================================
+# CONTACT QUERY ENGINE
+# ============================================================================
+
+class ContactQueryEngine:
+    """Keyset (seek) pagination over contacts ordered by (updated_at, id)
+    
+    Jede Seite setzt dort an, wo die vorige aufgehört hat:
+    WHERE (updated_at, id) < (cursor) ORDER BY updated_at DESC, id DESC LIMIT n.
+    Mit den Indexen auf Contact kostet Seite 5000 damit so viel wie Seite 1.
+    """
+    
+    DEFAULT_PER_PAGE = 50
+    MAX_PER_PAGE = 200
+    
+    LIST_COLUMNS = (
+        'id', 'first_name', 'last_name', 'email', 'phone', 'company',
+        'job_title', 'whatsapp_consent', 'source', 'tags', 'hubspot_id',
+        'created_at', 'updated_at'
+    )
+    
+    @staticmethod
+    def encode_cursor(updated_at, contact_id):
+        """Opaque cursor for the last row of a page"""
+        raw = json.dumps([updated_at.isoformat() if updated_at else None, contact_id])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a cursor into (updated_at, id) - raises ValueError if invalid"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            updated_at, contact_id = json.loads(base64.urlsafe_b64decode(padded))
+            return (datetime.fromisoformat(updated_at) if updated_at else None), int(contact_id)
+        except (TypeError, ValueError, json.JSONDecodeError) as e:
+            raise ValueError('Ungültiger Cursor') from e
+    
+    @classmethod
+    def build_query(cls, search='', consent='', source='', cursor=None):
+        """Filtered, keyset-ordered SELECT (without LIMIT)"""
+        contacts = get_table('contacts')
+        stmt = select(*[contacts.c[name] for name in cls.LIST_COLUMNS])
+        
+        # Filter pushdown - consent/source treffen die zusammengesetzten Indexe
+        if consent:
+            stmt = stmt.where(contacts.c.whatsapp_consent == consent)
+        if source:
+            stmt = stmt.where(contacts.c.source == source)
+        if search:
+            pattern = f'%{search}%'
+            stmt = stmt.where(or_(
+                contacts.c.first_name.ilike(pattern),
+                contacts.c.last_name.ilike(pattern),
+                contacts.c.email.ilike(pattern),
+                contacts.c.company.ilike(pattern)
+            ))
+        
+        if cursor:
+            last_updated, last_id = cls.decode_cursor(cursor)
+            stmt = stmt.where(or_(
+                contacts.c.updated_at < last_updated,
+                and_(contacts.c.updated_at == last_updated, contacts.c.id < last_id)
+            ))
+        
+        return stmt.order_by(contacts.c.updated_at.desc(), contacts.c.id.desc())
+    
+    @classmethod
+    def fetch_page(cls, per_page=DEFAULT_PER_PAGE, cursor=None, search='', consent='', source=''):
+        """Fetch one page - returns (rows, next_cursor)"""
+        per_page = max(1, min(per_page, cls.MAX_PER_PAGE))
+        stmt = cls.build_query(search, consent, source, cursor).limit(per_page + 1)
+        
+        # Eine Zeile mehr lesen, um ohne COUNT(*) zu wissen, ob es weitergeht
+        rows = [dict(row) for row in get_db().session.execute(stmt).mappings()]
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = cls.encode_cursor(rows[-1]['updated_at'], rows[-1]['id'])
+        
+        for row in rows:
+            row['tags'] = cls._parse_tags(row['tags'])
+            for key in ('created_at', 'updated_at'):
+                if row[key]:
+                    row[key] = row[key].isoformat()
+        
+        return rows, next_cursor
+    
+    @staticmethod
+    def _parse_tags(raw):
+        """Tags are stored as JSON array, older rows as comma-separated text"""
+        if not raw:
+            return []
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return [t.strip() for t in raw.split(',') if t.strip()]
+
+
+# ============================================================================
+# STREAMING CONTACT IMPORT
+# ============================================================================
+
+class EmailBloomFilter:
+    """Fixed-size bloom filter over normalized e-mail addresses
+    
+    Speicher hängt nur von der Kapazität ab, nicht von der Dateigröße.
+    Ein Treffer heißt "vielleicht vorhanden" und wird gegen die DB geprüft,
+    ein Nicht-Treffer heißt sicher neu.
+    """
+    
+    def __init__(self, capacity=2_000_000, error_rate=0.01):
+        self.size = max(1024, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, email):
+        digest = hashlib.blake2b(email.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+    
+    def add(self, email):
+        for pos in self._positions(email):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, email):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(email))
+
+
+class ContactImporter:
+    """Streaming CSV/Excel import with batched upserts on Contact.email
+    
+    Die Datei wird zeilenweise gelesen, pro Batch gibt es genau eine
+    IN-Abfrage für "vielleicht vorhandene" E-Mails, ein executemany-INSERT
+    und ein executemany-UPDATE. Fortschritt landet in import_jobs.
+    """
+    
+    BATCH_SIZE = 2000
+    MAX_ERRORS = 100
+    
+    # CSV-Spalte -> Contact-Spalte (eigenes Format, Export, Explorium)
+    FIELD_ALIASES = {
+        'first_name': 'first_name', 'firstname': 'first_name', 'vorname': 'first_name',
+        'prospect_first_name': 'first_name',
+        'last_name': 'last_name', 'lastname': 'last_name', 'nachname': 'last_name',
+        'prospect_last_name': 'last_name',
+        'email': 'email', 'e-mail': 'email', 'contact_professions_email': 'email',
+        'phone': 'phone', 'telefon': 'phone', 'mobilephone': 'phone',
+        'contact_mobile_phone': 'phone',
+        'company': 'company', 'firma': 'company', 'prospect_company_name': 'company',
+        'job_title': 'job_title', 'jobtitle': 'job_title', 'position': 'job_title',
+        'prospect_job_title': 'job_title',
+        'tags': 'tags',
+        'notes': 'notes',
+    }
+    
+    UPDATE_FIELDS = ('first_name', 'last_name', 'phone', 'company', 'job_title', 'tags', 'notes')
+    
+    def __init__(self, job_id, path, file_format='csv', contact_source='import'):
+        self.job_id = job_id
+        self.path = path
+        self.file_format = file_format
+        self.contact_source = contact_source
+        self.contacts = get_table('contacts')
+        self.jobs = get_table('import_jobs')
+        self.db = get_db()
+        self.stats = {'processed': 0, 'inserted': 0, 'updated': 0, 'skipped': 0}
+        self.errors = []
+        self._insert_stmt = insert(self.contacts)
+        self._update_stmt = (
+            update(self.contacts)
+            .where(self.contacts.c.id == bindparam('_id'))
+            .values({
+                name: func.coalesce(bindparam(f'_{name}'), self.contacts.c[name])
+                for name in self.UPDATE_FIELDS
+            })
+        )
+    
+    # ----- Reader -----
+    
+    def _iter_csv(self, raw):
+        text = io.TextIOWrapper(raw, encoding='utf-8-sig', errors='replace', newline='')
+        try:
+            yield from csv.DictReader(text)
+        finally:
+            text.detach()  # raw bleibt offen für tell()
+    
+    def _iter_xlsx(self, raw):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise RuntimeError('openpyxl nicht installiert - Excel-Import nicht verfügbar')
+        
+        sheet = load_workbook(raw, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(h or '').strip() for h in next(rows, [])]
+        for values in rows:
+            yield {h: v for h, v in zip(header, values) if h}
+    
+    def _map_row(self, row):
+        contact = {}
+        for key, value in row.items():
+            field = self.FIELD_ALIASES.get((key or '').strip().lower())
+            if field and value not in (None, ''):
+                contact[field] = str(value).strip()
+        if contact.get('email'):
+            contact['email'] = contact['email'].lower()
+        return contact
+    
+    # ----- Upsert -----
+    
+    def _load_known_emails(self, bloom):
+        """Seed the filter with existing e-mails (server-side cursor)"""
+        stmt = select(self.contacts.c.email).where(self.contacts.c.email.isnot(None))
+        result = self.db.session.execute(stmt.execution_options(yield_per=10000))
+        for (email,) in result:
+            bloom.add(email.lower())
+    
+    def _flush(self, batch, maybe_known):
+        existing = {}
+        if maybe_known:
+            email_key = func.lower(self.contacts.c.email)
+            stmt = select(self.contacts.c.id, email_key).where(email_key.in_(maybe_known))
+            existing = {email: cid for cid, email in self.db.session.execute(stmt)}
+        
+        inserts, updates = [], []
+        for email, contact in batch.items():
+            if email in existing:
+                params = {'_id': existing[email]}
+                params.update({f'_{name}': contact.get(name) for name in self.UPDATE_FIELDS})
+                updates.append(params)
+            else:
+                inserts.append({
+                    'first_name': contact.get('first_name', ''),
+                    'last_name': contact.get('last_name'),
+                    'email': email,
+                    'phone': contact.get('phone'),
+                    'company': contact.get('company'),
+                    'job_title': contact.get('job_title'),
+                    'tags': contact.get('tags'),
+                    'notes': contact.get('notes'),
+                    'source': self.contact_source,
+                })
+        
+        if inserts:
+            self.db.session.execute(self._insert_stmt, inserts)
+        if updates:
+            self.db.session.execute(self._update_stmt, updates)
+        
+        self.stats['inserted'] += len(inserts)
+        self.stats['updated'] += len(updates)
+    
+    def _report(self, status, bytes_read=None, finished=False):
+        values = dict(self.stats, status=status, errors=json.dumps(self.errors))
+        if bytes_read is not None:
+            values['bytes_read'] = bytes_read
+        if finished:
+            values['finished_at'] = datetime.utcnow()
+        self.db.session.execute(
+            update(self.jobs).where(self.jobs.c.id == self.job_id).values(**values)
+        )
+        self.db.session.commit()
+    
+    def run(self):
+        """Import the whole file - one transaction per batch"""
+        try:
+            bloom = EmailBloomFilter()
+            self._load_known_emails(bloom)
+            self._report('running')
+            
+            with open(self.path, 'rb') as raw:
+                rows = self._iter_xlsx(raw) if self.file_format == 'excel' else self._iter_csv(raw)
+                batch, maybe_known = {}, []
+                
+                for line_no, row in enumerate(rows, start=2):
+                    self.stats['processed'] += 1
+                    contact = self._map_row(row)
+                    email = contact.get('email')
+                    
+                    if not email or '@' not in email:
+                        self.stats['skipped'] += 1
+                        if len(self.errors) < self.MAX_ERRORS:
+                            self.errors.append({'line': line_no, 'error': 'E-Mail fehlt oder ungültig'})
+                        continue
+                    
+                    if email in batch:
+                        # Duplikat in derselben Datei - letzte Zeile gewinnt
+                        batch[email].update(contact)
+                        self.stats['skipped'] += 1
+                        continue
+                    
+                    if email in bloom:
+                        maybe_known.append(email)
+                    else:
+                        bloom.add(email)
+                    batch[email] = contact
+                    
+                    if len(batch) >= self.BATCH_SIZE:
+                        self._flush(batch, maybe_known)
+                        self._report('running', raw.tell())
+                        batch, maybe_known = {}, []
+                
+                if batch:
+                    self._flush(batch, maybe_known)
+            self._report('done', os.path.getsize(self.path), finished=True)
+        except Exception as e:
+            self.db.session.rollback()
+            self.errors.append({'error': str(e)})
+            self._report('failed', finished=True)
+        finally:
+            os.remove(self.path)
+    
+    @classmethod
+    def start(cls, upload, file_format='csv', contact_source='import'):
+        """Spool the upload to disk and import it in a background thread"""
+        job_id = uuid.uuid4().hex
+        fd, path = tempfile.mkstemp(prefix='wm_import_', suffix='.upload')
+        with os.fdopen(fd, 'wb') as target:
+            shutil.copyfileobj(upload.stream, target, length=1024 * 1024)
+        
+        db = get_db()
+        db.session.execute(insert(get_table('import_jobs')).values(
+            id=job_id,
+            user_id=session.get('user_id'),
+            filename=upload.filename,
+            status='queued',
+            bytes_total=os.path.getsize(path),
+            created_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        
+        app = current_app._get_current_object()
+        
+        def worker():
+            with app.app_context():
+                cls(job_id, path, file_format, contact_source).run()
+        
+        threading.Thread(target=worker, name=f'contact-import-{job_id[:8]}', daemon=True).start()
+        return job_id
+    
+    @staticmethod
+    def get_job(job_id):
+        jobs = get_table('import_jobs')
+        row = get_db().session.execute(select(jobs).where(jobs.c.id == job_id)).mappings().first()
+        if not row:
+            return None
+        job = dict(row)
+        job['errors'] = json.loads(job['errors']) if job['errors'] else []
+        job['progress'] = round(100 * job['bytes_read'] / job['bytes_total'], 1) if job['bytes_total'] else 0
+        for key in ('created_at', 'finished_at'):
+            if job[key]:
+                job[key] = job[key].isoformat()
+        return job
+
+
 # ============================================================================
 # API ROUTES
 # ============================================================================
@@ -1030,25 +1414,30 @@ def contacts_page():
 
 @contacts_bp.route('/api/contacts', methods=['GET'])
 def get_contacts():
-    """Get all contacts with filters"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
+    """Get contacts with filters (keyset pagination via ?cursor=)"""
+    per_page = request.args.get('per_page', ContactQueryEngine.DEFAULT_PER_PAGE, type=int)
+    cursor = request.args.get('cursor') or None
     search = request.args.get('search', '')
     consent = request.args.get('consent', '')
     source = request.args.get('source', '')
     
-    # In production: Query from database with pagination
-    contacts = [
-        {'id': 1, 'first_name': 'Max', 'last_name': 'Mustermann', 'email': 'max@example.com'},
-        {'id': 2, 'first_name': 'Anna', 'last_name': 'Schmidt', 'email': 'anna@building.de'},
-    ]
+    try:
+        contacts, next_cursor = ContactQueryEngine.fetch_page(
+            per_page=per_page,
+            cursor=cursor,
+            search=search,
+            consent=consent,
+            source=source
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     
     return jsonify({
         'success': True,
         'contacts': contacts,
-        'total': len(contacts),
-        'page': page,
-        'per_page': per_page
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
     })
 
 
@@ -1126,60 +1515,61 @@ def bulk_delete_contacts():
 
 @contacts_bp.route('/api/contacts/import', methods=['POST'])
 def import_contacts():
-    """Import contacts from CSV/Excel"""
+    """Import contacts from CSV/Excel (background job)"""
     file = request.files.get('file')
     source = request.form.get('source', 'csv')
     
     if not file:
         return jsonify({'success': False, 'error': 'Keine Datei'}), 400
     
-    imported = 0
-    errors = []
+    if source not in ('csv', 'excel'):
+        return jsonify({'success': False, 'error': 'Unsupported format'}), 400
     
     try:
-        if source == 'csv':
-            content = file.read().decode('utf-8')
-            reader = csv.DictReader(io.StringIO(content))
-            
-            for row in reader:
-                # In production: Save each contact to database
-                imported += 1
+        job_id = ContactImporter.start(
+            file,
+            file_format=source,
+            contact_source=request.form.get('contact_source', 'import')
+        )
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
     
-    return jsonify({
-        'success': True,
-        'imported': imported,
-        'errors': errors
-    })
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
+
+@contacts_bp.route('/api/contacts/import/<job_id>', methods=['GET'])
+def import_status(job_id):
+    """Poll progress of an import job"""
+    job = ContactImporter.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Import-Job nicht gefunden'}), 404
+    return jsonify({'success': True, 'job': job})
 
 
 @contacts_bp.route('/api/contacts/export', methods=['GET'])
 def export_contacts():
-    """Export contacts to CSV"""
+    """Export contacts to CSV (streamed, ?gzip=1 for .csv.gz)"""
     format_type = request.args.get('format', 'csv')
     
-    # In production: Query all contacts from database
-    contacts = [
-        {'first_name': 'Max', 'last_name': 'Mustermann', 'email': 'max@example.com', 
-         'phone': '+49 170 1234567', 'company': 'TechCorp GmbH'},
-        {'first_name': 'Anna', 'last_name': 'Schmidt', 'email': 'anna@building.de',
-         'phone': '+49 171 9876543', 'company': 'Building AG'},
-    ]
+    if format_type != 'csv':
+        return jsonify({'success': False, 'error': 'Unsupported format'}), 400
     
-    if format_type == 'csv':
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=['first_name', 'last_name', 'email', 'phone', 'company'])
-        writer.writeheader()
-        writer.writerows(contacts)
-        
-        output.seek(0)
-        return output.getvalue(), 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': f'attachment; filename=contacts_{datetime.now().strftime("%Y%m%d")}.csv'
-        }
+    columns = ['first_name', 'last_name', 'email', 'phone', 'company']
+    contacts = get_table('contacts')
+    
+    # Gleiche Filter wie die Liste, Sortierung über den Keyset-Index
+    stmt = ContactQueryEngine.build_query(
+        search=request.args.get('search', ''),
+        consent=request.args.get('consent', ''),
+        source=request.args.get('source', '')
+    ).with_only_columns(*[contacts.c[name] for name in columns])
     
-    return jsonify({'success': False, 'error': 'Unsupported format'}), 400
+    return csv_response(
+        f'contacts_{datetime.now().strftime("%Y%m%d")}.csv',
+        columns,
+        iter_query(stmt),
+        compress=wants_gzip(request.args)
+    )
 
 
 # ----- HUBSPOT SYNC -----
@@ -1272,4 +1662,4 @@ def register_contacts_blueprint(app):
     print("📇 CONTACTS MODULE loaded!")
 
 
-__all__ = ['contacts_bp', 'register_contacts_blueprint']
+__all__ = ['contacts_bp', 'register_contacts_blueprint', 'ContactQueryEngine', 'ContactImporter']
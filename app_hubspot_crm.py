@@ -12,15 +12,27 @@ Author: West Money OS Team
 Version: 1.0.0
 """
 
-from flask import Blueprint, render_template_string, request, jsonify, session
+from flask import Blueprint, render_template_string, request, jsonify, session, current_app
 import requests
+import base64
 import json
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import hashlib
 import hmac
 
+from sqlalchemy import select, insert, update, bindparam
+
+from hubspot_transport import hubspot_request, rate_limit_metrics
+from phone_index import PHONE_INDEX
+from streaming_export import csv_response, wants_gzip
+from webhook_queue import WebhookQueue, WebhookWorkerPool
+from westmoney_db import get_db, get_table
+
 hubspot_crm_bp = Blueprint('hubspot_crm', __name__, url_prefix='/hubspot-crm')
 
 # ============================================================================
@@ -33,6 +45,15 @@ class HubSpotConfig:
     PORTAL_ID = os.environ.get('HUBSPOT_PORTAL_ID', '')
     BASE_URL = 'https://api.hubapi.com'
     
+    # Webhooks: Signatur mit dem Client Secret der App, ohne Secret keine Prüfung (Dev)
+    CLIENT_SECRET = os.environ.get('HUBSPOT_CLIENT_SECRET', '')
+    # Öffentliche Basis-URL, die HubSpot signiert (z.B. https://app.west-money.com) -
+    # leer: aus X-Forwarded-Proto/-Host des TLS-Proxys rekonstruiert
+    WEBHOOK_BASE_URL = os.environ.get('HUBSPOT_WEBHOOK_BASE_URL', '').rstrip('/')
+    WEBHOOK_MAX_AGE_SECONDS = 300
+    # Ein Worker hält die Reihenfolge pro objectId ein - Batches sind groß genug
+    WEBHOOK_WORKERS = int(os.environ.get('HUBSPOT_WEBHOOK_WORKERS', '1'))
+    
     # Pipeline Stages (West Money Bau)
     PIPELINE_STAGES = {
         'neu': 'appointmentscheduled',
@@ -44,6 +65,17 @@ class HubSpotConfig:
         'verloren': 'closedlost'
     }
     
+    # HubSpot Deal-Stage -> lokale Lead-Stage (leads.stage)
+    DEAL_STAGE_TO_LEAD_STAGE = {
+        'appointmentscheduled': 'new',
+        'qualifiedtobuy': 'contacted',
+        'presentationscheduled': 'qualified',
+        'decisionmakerboughtin': 'proposal',
+        'contractsent': 'negotiation',
+        'closedwon': 'won',
+        'closedlost': 'lost'
+    }
+    
     # WhatsApp Consent Status
     CONSENT_STATUSES = {
         'OPT_IN': 'opted_in',
@@ -51,14 +83,36 @@ class HubSpotConfig:
         'NOT_SET': 'not_set',
         'PENDING': 'pending'
     }
+    
+    # HubSpot Consent -> lokaler Consent (contacts.whatsapp_consent)
+    CONSENT_TO_LOCAL = {
+        'opted_in': 'yes',
+        'opted_out': 'no'
+    }
 
 # ============================================================================
 # HUBSPOT API CLIENT
 # ============================================================================
 
+class HubSpotAPIError(Exception):
+    """Raised by the paginating iterators - a partial result is never returned silently"""
+
+
 class HubSpotClient:
     """HubSpot API Client for CRM Operations"""
     
+    PAGE_SIZE = 100
+    SEARCH_PAGE_SIZE = 200
+    BATCH_LIMIT = 100  # max. Inputs pro batch/read, batch/create, batch/update
+    SEARCH_RESULT_CAP = 10000  # Search API liefert max. 10.000 Treffer pro Query
+    
+    # Property für Zeitfenster/Watermarks je Objekttyp
+    LAST_MODIFIED_PROPERTY = {
+        'contacts': 'lastmodifieddate',
+        'deals': 'hs_lastmodifieddate',
+        'companies': 'hs_lastmodifieddate'
+    }
+    
     def __init__(self, api_key=None):
         self.api_key = api_key or HubSpotConfig.API_KEY
         self.base_url = HubSpotConfig.BASE_URL
@@ -68,15 +122,14 @@ class HubSpotClient:
         }
     
     def _request(self, method, endpoint, data=None, params=None):
-        """Make API request to HubSpot"""
-        url = f"{self.base_url}{endpoint}"
+        """Make rate-limited API request to HubSpot"""
         try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=self.headers,
-                json=data,
+            response = hubspot_request(
+                method,
+                f"{self.base_url}{endpoint}",
+                self.api_key,
                 params=params,
+                json=data,
                 timeout=30
             )
             response.raise_for_status()
@@ -105,22 +158,25 @@ class HubSpotClient:
             params['properties'] = ','.join(properties)
         return self._request('GET', f'/crm/v3/objects/contacts/{contact_id}', params=params)
     
-    def search_contacts(self, filters, properties=None, limit=100):
-        """Search contacts with filters"""
-        data = {
-            'filterGroups': [{'filters': filters}],
-            'limit': limit
-        }
-        if properties:
-            data['properties'] = properties
-        return self._request('POST', '/crm/v3/objects/contacts/search', data)
+    def search_contacts(self, filters, properties=None, limit=None):
+        """Search contacts with filters - all pages unless an explicit limit is given"""
+        return self.search('contacts', filters, properties, limit)
     
     def get_all_contacts(self, limit=100, properties=None):
-        """Get all contacts with pagination"""
-        params = {'limit': limit}
-        if properties:
-            params['properties'] = ','.join(properties)
-        return self._request('GET', '/crm/v3/objects/contacts', params=params)
+        """Get all contacts (follows paging cursors - prefer iter_contacts for large portals)"""
+        return self._collect(self.iter_contacts(properties, page_size=limit))
+    
+    def iter_contacts(self, properties=None, page_size=PAGE_SIZE):
+        """Lazily iterate all contacts"""
+        return self.iter_objects('contacts', properties, page_size)
+    
+    def iter_search_contacts(self, filters, properties=None, sorts=None):
+        """Lazily iterate all search results (no 10k cap)"""
+        return self.iter_search('contacts', filters, properties, sorts)
+    
+    def batch_read_contacts(self, ids, id_property=None, properties=None):
+        """Read up to BATCH_LIMIT contacts by ID or a unique property (e.g. email)"""
+        return self.batch_read('contacts', ids, id_property, properties)
     
     def bulk_create_contacts(self, contacts_list):
         """Bulk create contacts"""
@@ -153,22 +209,144 @@ class HubSpotClient:
             params['properties'] = ','.join(properties)
         return self._request('GET', f'/crm/v3/objects/deals/{deal_id}', params=params)
     
-    def search_deals(self, filters, properties=None, limit=100):
-        """Search deals with filters"""
+    def search_deals(self, filters, properties=None, limit=None):
+        """Search deals with filters - all pages unless an explicit limit is given"""
+        return self.search('deals', filters, properties, limit)
+    
+    def get_all_deals(self, limit=100, properties=None):
+        """Get all deals (follows paging cursors - prefer iter_deals for large portals)"""
+        return self._collect(self.iter_deals(properties, page_size=limit))
+    
+    def iter_deals(self, properties=None, page_size=PAGE_SIZE):
+        """Lazily iterate all deals"""
+        return self.iter_objects('deals', properties, page_size)
+    
+    # -------------------------------------------------------------------------
+    # PAGINATION
+    # -------------------------------------------------------------------------
+    
+    def _iter_pages(self, fetch_page):
+        """Follow paging.next.after - the next page is fetched while the current one is consumed"""
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='hubspot-prefetch') as prefetch:
+            future = prefetch.submit(fetch_page, None)
+            while future is not None:
+                page = future.result()
+                if 'error' in page:
+                    raise HubSpotAPIError(page['error'])
+                
+                after = page.get('paging', {}).get('next', {}).get('after')
+                future = prefetch.submit(fetch_page, after) if after else None
+                yield page
+    
+    def iter_objects(self, object_type, properties=None, page_size=PAGE_SIZE):
+        """Lazily iterate all objects of a type via the list endpoint"""
+        def fetch_page(after):
+            params = {'limit': page_size}
+            if properties:
+                params['properties'] = ','.join(properties)
+            if after:
+                params['after'] = after
+            return self._request('GET', f'/crm/v3/objects/{object_type}', params=params)
+        
+        for page in self._iter_pages(fetch_page):
+            yield from page.get('results', [])
+    
+    def search(self, object_type, filters, properties=None, limit=None):
+        """All search results as {'results', 'total'} - limit: nur eine Seite mit so vielen Treffern"""
+        if limit is None:
+            return self._collect(self.iter_search(object_type, filters, properties))
         data = {
             'filterGroups': [{'filters': filters}],
             'limit': limit
         }
         if properties:
             data['properties'] = properties
-        return self._request('POST', '/crm/v3/objects/deals/search', data)
+        return self._request('POST', f'/crm/v3/objects/{object_type}/search', data)
     
-    def get_all_deals(self, limit=100, properties=None):
-        """Get all deals"""
-        params = {'limit': limit}
+    def iter_search(self, object_type, filters, properties=None, sorts=None):
+        """Lazily iterate all search results
+        
+        Die Search API bricht bei 10.000 Treffern ab. Ohne eigene Sortierung
+        wird aufsteigend nach lastmodifieddate gelesen und vor dem Limit ein
+        neues Zeitfenster ab dem zuletzt gesehenen Zeitstempel geöffnet.
+        IDs mit genau diesem Zeitstempel werden dabei nicht doppelt geliefert.
+        """
+        if sorts:
+            yield from self._iter_search_window(object_type, filters, properties, sorts)
+            return
+        
+        modified_prop = self.LAST_MODIFIED_PROPERTY.get(object_type, 'hs_lastmodifieddate')
+        properties = list(properties or [])
+        if modified_prop not in properties:
+            properties.append(modified_prop)
+        sorts = [{'propertyName': modified_prop, 'direction': 'ASCENDING'}]
+        
+        window_start = None
+        boundary_ids = set()
+        while True:
+            window_filters = list(filters)
+            if window_start is not None:
+                window_filters.append({
+                    'propertyName': modified_prop,
+                    'operator': 'GTE',
+                    'value': str(window_start)
+                })
+            
+            seen = 0
+            last_ts = window_start
+            for obj in self._iter_search_window(object_type, window_filters, properties, sorts):
+                seen += 1
+                ts = _to_epoch_ms(obj.get('properties', {}).get(modified_prop))
+                if ts is not None and ts == window_start and obj['id'] in boundary_ids:
+                    continue
+                if ts != last_ts:
+                    last_ts, boundary_ids = ts, set()
+                boundary_ids.add(obj['id'])
+                yield obj
+            
+            if seen < self.SEARCH_RESULT_CAP or last_ts is None:
+                return
+            if last_ts == window_start:
+                raise HubSpotAPIError(
+                    f'Mehr als {self.SEARCH_RESULT_CAP} Treffer mit identischem {modified_prop}'
+                )
+            window_start = last_ts
+    
+    def _iter_search_window(self, object_type, filters, properties, sorts):
+        def fetch_page(after):
+            data = {
+                'filterGroups': [{'filters': filters}] if filters else [],
+                'sorts': sorts or [],
+                'limit': self.SEARCH_PAGE_SIZE
+            }
+            if properties:
+                data['properties'] = properties
+            if after:
+                # Letzte Seite vor dem Limit: HubSpot lehnt after >= 10.000 ab
+                if int(after) >= self.SEARCH_RESULT_CAP:
+                    return {'results': []}
+                data['after'] = after
+            return self._request('POST', f'/crm/v3/objects/{object_type}/search', data)
+        
+        for page in self._iter_pages(fetch_page):
+            yield from page.get('results', [])
+    
+    def batch_read(self, object_type, ids, id_property=None, properties=None):
+        """Read up to BATCH_LIMIT objects by ID or a unique property"""
+        data = {'inputs': [{'id': str(i)} for i in ids]}
+        if id_property:
+            data['idProperty'] = id_property
         if properties:
-            params['properties'] = ','.join(properties)
-        return self._request('GET', '/crm/v3/objects/deals', params=params)
+            data['properties'] = properties
+        return self._request('POST', f'/crm/v3/objects/{object_type}/batch/read', data)
+    
+    @staticmethod
+    def _collect(iterator):
+        try:
+            results = list(iterator)
+        except HubSpotAPIError as e:
+            return {'error': str(e)}
+        return {'results': results, 'total': len(results)}
     
     # -------------------------------------------------------------------------
     # COMPANIES
@@ -179,15 +357,9 @@ class HubSpotClient:
         data = {'properties': properties}
         return self._request('POST', '/crm/v3/objects/companies', data)
     
-    def search_companies(self, filters, properties=None, limit=100):
-        """Search companies"""
-        data = {
-            'filterGroups': [{'filters': filters}],
-            'limit': limit
-        }
-        if properties:
-            data['properties'] = properties
-        return self._request('POST', '/crm/v3/objects/companies/search', data)
+    def search_companies(self, filters, properties=None, limit=None):
+        """Search companies - all pages unless an explicit limit is given"""
+        return self.search('companies', filters, properties, limit)
     
     # -------------------------------------------------------------------------
     # ASSOCIATIONS
@@ -257,6 +429,17 @@ class HubSpotClient:
             'hs_whatsapp_consent_status', 'hs_whatsapp_consent_date'
         ])
 
+def _to_epoch_ms(value):
+    """HubSpot timestamp (ISO string or epoch ms) -> epoch ms"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        return int(value)
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
 # ============================================================================
 # LEAD SYNC ENGINE
 # ============================================================================
@@ -269,39 +452,85 @@ class LeadSyncEngine:
         self.sync_log = []
     
     def import_explorium_leads(self, leads_data):
-        """Import leads from Explorium B2B data"""
+        """Import leads from Explorium B2B data
+        
+        Pro 100 Leads: ein batch/read (idProperty=email), ein batch/create
+        und ein batch/update - statt Suche + Create/Update pro Lead.
+        """
         results = {'created': 0, 'updated': 0, 'errors': []}
         
+        batch = []
         for lead in leads_data:
             try:
                 # Map Explorium fields to HubSpot properties
-                properties = self._map_explorium_to_hubspot(lead)
-                
-                # Check if contact exists
-                existing = self.hubspot.search_contacts([{
-                    'propertyName': 'email',
-                    'operator': 'EQ',
-                    'value': properties.get('email', '')
-                }])
-                
-                if existing.get('results'):
-                    # Update existing contact
-                    contact_id = existing['results'][0]['id']
-                    self.hubspot.update_contact(contact_id, properties)
-                    results['updated'] += 1
-                else:
-                    # Create new contact
-                    self.hubspot.create_contact(properties)
-                    results['created'] += 1
-                    
+                batch.append((lead, self._map_explorium_to_hubspot(lead)))
             except Exception as e:
                 results['errors'].append({
                     'lead': lead.get('prospect_full_name', 'Unknown'),
                     'error': str(e)
                 })
+            
+            if len(batch) >= HubSpotClient.BATCH_LIMIT:
+                self._upsert_batch(batch, results)
+                batch = []
+        
+        if batch:
+            self._upsert_batch(batch, results)
         
         return results
     
+    def _upsert_batch(self, batch, results):
+        """Resolve emails with one batch/read, then bulk create/update"""
+        # Gleiche E-Mail mehrfach im Batch: ein Input, letzter Datensatz gewinnt
+        by_email = {}
+        without_email = []
+        for lead, properties in batch:
+            email = (properties.get('email') or '').strip().lower()
+            if email:
+                by_email[email] = (lead, properties)
+            else:
+                without_email.append((lead, properties))
+        
+        existing = {}
+        if by_email:
+            found = self.hubspot.batch_read_contacts(
+                list(by_email), id_property='email', properties=['email']
+            )
+            if 'error' in found:
+                self._record_errors(batch, found['error'], results)
+                return
+            for contact in found.get('results', []):
+                email = (contact.get('properties', {}).get('email') or '').lower()
+                existing[email] = contact['id']
+        
+        creates = without_email + [item for email, item in by_email.items() if email not in existing]
+        updates = [(existing[email], item) for email, item in by_email.items() if email in existing]
+        
+        if creates:
+            response = self.hubspot.bulk_create_contacts([properties for _, properties in creates])
+            if 'error' in response:
+                self._record_errors(creates, response['error'], results)
+            else:
+                results['created'] += len(creates)
+        
+        if updates:
+            response = self.hubspot.bulk_update_contacts([
+                {'id': contact_id, 'properties': properties}
+                for contact_id, (_, properties) in updates
+            ])
+            if 'error' in response:
+                self._record_errors([item for _, item in updates], response['error'], results)
+            else:
+                results['updated'] += len(updates)
+    
+    @staticmethod
+    def _record_errors(items, error, results):
+        for lead, _ in items:
+            results['errors'].append({
+                'lead': lead.get('prospect_full_name', 'Unknown'),
+                'error': error
+            })
+    
     def _map_explorium_to_hubspot(self, lead):
         """Map Explorium data fields to HubSpot properties"""
         # Parse emails from contact_emails JSON
@@ -374,35 +603,388 @@ class LeadSyncEngine:
         return min(score, 100)
     
     def sync_to_local_db(self, db_connection=None):
-        """Sync HubSpot contacts to local West Money OS database"""
-        # Get all contacts from HubSpot
-        contacts = self.hubspot.get_all_contacts(
-            limit=100,
-            properties=[
-                'firstname', 'lastname', 'email', 'phone', 'company',
-                'jobtitle', 'hs_lead_status', 'lifecyclestage',
-                'hs_whatsapp_consent_status', 'createdate', 'lastmodifieddate'
-            ]
+        """Sync HubSpot contacts and deals to the local database (incremental)"""
+        return IncrementalSyncEngine(self.hubspot).run()
+
+# ============================================================================
+# INCREMENTAL SYNC (HubSpot -> lokale DB)
+# ============================================================================
+
+class IncrementalSyncEngine:
+    """Pull only records changed since the last run (lastmodifieddate watermark)
+    
+    Pro Objekttyp wird das höchste gesehene lastmodifieddate in
+    sync_watermarks gespeichert. Folgeläufe suchen ab Watermark minus
+    OVERLAP_MS (der Search-Index von HubSpot hinkt einige Sekunden hinterher)
+    und schreiben batchweise per hubspot_id-Upsert - Watermark und Daten
+    eines Batches werden in derselben Transaktion committet.
+    """
+    
+    BATCH_SIZE = 500
+    OVERLAP_MS = 60 * 1000
+    
+    OBJECT_TABLES = {
+        'contacts': 'contacts',
+        'deals': 'leads'
+    }
+    
+    # HubSpot-Property -> lokale Spalte
+    COLUMN_MAP = {
+        'contacts': {
+            'firstname': 'first_name',
+            'lastname': 'last_name',
+            'email': 'email',
+            'phone': 'phone',
+            'company': 'company',
+            'jobtitle': 'job_title',
+            'hs_whatsapp_consent_status': 'whatsapp_consent'
+        },
+        'deals': {
+            'dealname': 'company_name',
+            'amount': 'deal_value',
+            'dealstage': 'stage'
+        }
+    }
+    
+    PROPERTIES = {
+        object_type: list(columns) + [HubSpotClient.LAST_MODIFIED_PROPERTY[object_type]]
+        for object_type, columns in COLUMN_MAP.items()
+    }
+    # Zusätzlich gelesen, nur für den Telefon-Index (phone_index)
+    PROPERTIES['contacts'] += ['mobilephone', 'hs_whatsapp_phone_number']
+    
+    def __init__(self, hubspot_client=None):
+        self.hubspot = hubspot_client or HubSpotClient()
+        self.db = get_db()
+    
+    def run(self, object_types=('contacts', 'deals')):
+        """Sync all object types - returns per-type counters"""
+        return {object_type: self.sync(object_type) for object_type in object_types}
+    
+    def sync(self, object_type):
+        """Sync one object type from its watermark"""
+        started_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        modified_prop = HubSpotClient.LAST_MODIFIED_PROPERTY[object_type]
+        properties = self.PROPERTIES[object_type]
+        watermark = self._get_watermark(object_type)
+        
+        if watermark is None:
+            # Erstlauf: Liste ist nicht nach Änderungsdatum sortiert, die
+            # Watermark wird deshalb erst am Ende auf den Startzeitpunkt gesetzt
+            records = self.hubspot.iter_objects(object_type, properties)
+        else:
+            records = self.hubspot.iter_search(object_type, [{
+                'propertyName': modified_prop,
+                'operator': 'GTE',
+                'value': str(watermark - self.OVERLAP_MS)
+            }], properties)
+        
+        stats = {'mode': 'full' if watermark is None else 'incremental',
+                 'fetched': 0, 'inserted': 0, 'updated': 0}
+        batch = {}
+        for record in records:
+            batch[record['id']] = record
+            stats['fetched'] += 1
+            if len(batch) >= self.BATCH_SIZE:
+                watermark = self._apply_batch(object_type, batch, watermark, stats, checkpoint=stats['mode'] == 'incremental')
+                batch = {}
+        
+        if stats['mode'] == 'full':
+            watermark = started_ms - self.OVERLAP_MS
+        self._apply_batch(object_type, batch, watermark, stats, checkpoint=True)
+        stats['watermark_ms'] = self._get_watermark(object_type)
+        return stats
+    
+    def _apply_batch(self, object_type, batch, watermark, stats, checkpoint):
+        """Upsert one batch and (optionally) advance the watermark - one transaction"""
+        modified_prop = HubSpotClient.LAST_MODIFIED_PROPERTY[object_type]
+        try:
+            if batch:
+                rows = [self.map_record(object_type, record) for record in batch.values()]
+                inserted, updated = self._upsert(get_table(self.OBJECT_TABLES[object_type]), rows)
+                if object_type == 'contacts':
+                    PHONE_INDEX.update(
+                        ((record['id'], record.get('properties', {})) for record in batch.values()),
+                        full=True
+                    )
+                stats['inserted'] += inserted
+                stats['updated'] += updated
+                
+                if checkpoint and stats['mode'] == 'incremental':
+                    seen = [_to_epoch_ms(r.get('properties', {}).get(modified_prop)) for r in batch.values()]
+                    watermark = max([ts for ts in seen if ts is not None] + [watermark or 0])
+            
+            if checkpoint:
+                self._save_watermark(object_type, watermark, stats['fetched'])
+            self.db.session.commit()
+        except Exception:
+            self.db.session.rollback()
+            raise
+        return watermark
+    
+    def _upsert(self, table, rows):
+        """Insert/update rows by hubspot_id with executemany statements
+        
+        Zeilen dürfen unterschiedliche Spalten haben (Webhook-Teilupdates) -
+        pro Spaltensatz wird ein eigenes Statement gebaut.
+        """
+        ids = [row['hubspot_id'] for row in rows]
+        existing = dict(self.db.session.execute(
+            select(table.c.hubspot_id, table.c.id).where(table.c.hubspot_id.in_(ids))
+        ).all())
+        
+        now = datetime.utcnow()
+        inserts, updates = {}, {}
+        for row in rows:
+            row_id = existing.get(row['hubspot_id'])
+            fields = tuple(k for k in row if k != 'hubspot_id')
+            if row_id is None:
+                inserts.setdefault(fields, []).append(
+                    {**row, 'source': 'hubspot', 'created_at': now, 'updated_at': now}
+                )
+            else:
+                updates.setdefault(fields, []).append(
+                    {'_id': row_id, 'updated_at': now, **{f'_{k}': row[k] for k in fields}}
+                )
+        
+        for params in inserts.values():
+            self.db.session.execute(insert(table), params)
+        for fields, params in updates.items():
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam('_id'))
+                .values({**{k: bindparam(f'_{k}') for k in fields}, 'updated_at': bindparam('updated_at')})
+            )
+            self.db.session.execute(stmt, params)
+        return sum(map(len, inserts.values())), sum(map(len, updates.values()))
+    
+    @classmethod
+    def map_record(cls, object_type, record, partial=False):
+        """HubSpot object -> local row; partial=True maps only the properties present"""
+        props = record.get('properties', {})
+        row = {'hubspot_id': str(record['id'])}
+        for prop, column in cls.COLUMN_MAP[object_type].items():
+            if partial and prop not in props:
+                continue
+            row[column] = cls._convert(column, props.get(prop))
+        return row
+    
+    @staticmethod
+    def _convert(column, value):
+        if column == 'whatsapp_consent':
+            return HubSpotConfig.CONSENT_TO_LOCAL.get(value or 'not_set', 'pending')
+        if column == 'stage':
+            return HubSpotConfig.DEAL_STAGE_TO_LEAD_STAGE.get(value, 'new')
+        if column == 'deal_value':
+            try:
+                return float(value or 0)
+            except ValueError:
+                return 0.0
+        return value or ''
+    
+    def _get_watermark(self, object_type):
+        table = get_table('sync_watermarks')
+        return self.db.session.execute(
+            select(table.c.watermark_ms).where(table.c.object_type == object_type)
+        ).scalar()
+    
+    def _save_watermark(self, object_type, watermark, synced):
+        table = get_table('sync_watermarks')
+        values = {'watermark_ms': watermark, 'last_run_at': datetime.utcnow(), 'last_synced': synced}
+        result = self.db.session.execute(
+            update(table).where(table.c.object_type == object_type).values(values)
         )
-        
-        synced_leads = []
-        for contact in contacts.get('results', []):
-            props = contact.get('properties', {})
-            synced_leads.append({
-                'hubspot_id': contact['id'],
-                'name': f"{props.get('firstname', '')} {props.get('lastname', '')}".strip(),
-                'email': props.get('email', ''),
-                'phone': props.get('phone', ''),
-                'company': props.get('company', ''),
-                'position': props.get('jobtitle', ''),
-                'status': props.get('hs_lead_status', 'NEW'),
-                'stage': props.get('lifecyclestage', 'lead'),
-                'whatsapp_consent': props.get('hs_whatsapp_consent_status', 'not_set'),
-                'created_at': props.get('createdate', ''),
-                'updated_at': props.get('lastmodifieddate', '')
-            })
-        
-        return synced_leads
+        if result.rowcount == 0:
+            self.db.session.execute(insert(table).values(object_type=object_type, **values))
+
+
+class SyncBot:
+    """Scheduled HubSpot -> local sync (bot_scheduler, alle 5 Minuten)"""
+    
+    @classmethod
+    def run(cls):
+        if not HubSpotConfig.API_KEY:
+            return {'skipped': 'HUBSPOT_API_KEY nicht gesetzt'}
+        return IncrementalSyncEngine().run()
+
+# ============================================================================
+# WEBHOOK INGESTION
+# ============================================================================
+
+def webhook_public_url(req):
+    """URL as HubSpot called it - not the http:// URL behind the TLS-terminating proxy"""
+    path = req.path
+    if req.query_string:
+        path += '?' + req.query_string.decode('latin-1')
+    if HubSpotConfig.WEBHOOK_BASE_URL:
+        return HubSpotConfig.WEBHOOK_BASE_URL + path
+    scheme = req.headers.get('X-Forwarded-Proto', req.scheme).split(',')[0].strip()
+    host = req.headers.get('X-Forwarded-Host', req.host).split(',')[0].strip()
+    return f'{scheme}://{host}{path}'
+
+
+def verify_webhook_signature(req, body):
+    """Check X-HubSpot-Signature (v1, v2) or X-HubSpot-Signature-v3"""
+    secret = HubSpotConfig.CLIENT_SECRET
+    if not secret:
+        return True
+    
+    signature_v3 = req.headers.get('X-HubSpot-Signature-v3')
+    if signature_v3:
+        timestamp = req.headers.get('X-HubSpot-Request-Timestamp', '')
+        if not timestamp.isdigit() or abs(time.time() * 1000 - int(timestamp)) > HubSpotConfig.WEBHOOK_MAX_AGE_SECONDS * 1000:
+            return False
+        source = req.method.encode() + webhook_public_url(req).encode() + body + timestamp.encode()
+        expected = base64.b64encode(hmac.new(secret.encode(), source, hashlib.sha256).digest()).decode()
+        return hmac.compare_digest(expected, signature_v3)
+    
+    signature = req.headers.get('X-HubSpot-Signature', '')
+    if req.headers.get('X-HubSpot-Signature-Version') == 'v2':
+        source = secret.encode() + req.method.encode() + webhook_public_url(req).encode() + body
+    else:
+        source = secret.encode() + body
+    return hmac.compare_digest(hashlib.sha256(source).hexdigest(), signature)
+
+
+class HubSpotWebhookProcessor:
+    """Coalesce queued webhook batches per objectId and apply them in bulk
+    
+    Pro Objekt zählt nur der letzte Stand: die jeweils letzte Änderung jeder
+    Property (nach occurredAt), creation -> Objekt wird per batch/read
+    vollständig geholt, deletion -> lokale Zeile wird von HubSpot entkoppelt
+    (hubspot_id = NULL, lokale Daten bleiben erhalten).
+    """
+    
+    OBJECT_TYPES = {
+        'contact': 'contacts',
+        'deal': 'deals'
+    }
+    
+    def __init__(self, hubspot_client=None):
+        self.hubspot = hubspot_client or HubSpotClient()
+    
+    def __call__(self, payloads):
+        changes = self.coalesce(payloads)
+        engine = IncrementalSyncEngine(self.hubspot)
+        errors = []
+        try:
+            # Pro Objekttyp ein Savepoint: scheitern die Deals, bleiben die Kontakte gespeichert
+            for object_type, objects in changes.items():
+                try:
+                    with engine.db.session.begin_nested():
+                        errors.extend(self._apply(engine, object_type, objects))
+                except Exception as e:
+                    errors.append(f'{object_type}: {e}')
+            engine.db.session.commit()
+        except Exception:
+            engine.db.session.rollback()
+            raise
+        if errors:
+            # Batch bleibt in der Queue - erneut angewendet ist idempotent
+            raise HubSpotAPIError('; '.join(errors))
+    
+    @classmethod
+    def coalesce(cls, payloads):
+        """Raw webhook bodies -> {object_type: {object_id: state}}"""
+        events = []
+        for payload in payloads:
+            try:
+                batch = json.loads(payload)
+            except ValueError:
+                continue  # kaputte Payload nicht endlos wiederholen
+            events.extend(batch if isinstance(batch, list) else [batch])
+        events.sort(key=lambda e: e.get('occurredAt') or 0)
+        
+        changes = {}
+        for event in events:
+            kind, _, action = (event.get('subscriptionType') or '').partition('.')
+            object_type = cls.OBJECT_TYPES.get(kind)
+            if object_type is None or event.get('objectId') is None:
+                continue
+            
+            state = changes.setdefault(object_type, {}).setdefault(
+                str(event['objectId']), {'props': {}, 'fetch': False, 'deleted': False}
+            )
+            if action == 'deletion':
+                state.update(props={}, fetch=False, deleted=True)
+            elif action in ('creation', 'restore'):
+                state.update(fetch=True, deleted=False)
+            elif action == 'propertyChange' and event.get('propertyName'):
+                state['props'][event['propertyName']] = event.get('propertyValue')
+                state['deleted'] = False
+        return changes
+    
+    def _apply(self, engine, object_type, objects):
+        table = get_table(IncrementalSyncEngine.OBJECT_TABLES[object_type])
+        columns = IncrementalSyncEngine.COLUMN_MAP[object_type]
+        
+        live = {oid: state for oid, state in objects.items() if not state['deleted']}
+        deleted = [oid for oid, state in objects.items() if state['deleted']]
+        
+        known = set()
+        if live:
+            known = set(engine.db.session.execute(
+                select(table.c.hubspot_id).where(table.c.hubspot_id.in_(list(live)))
+            ).scalars())
+        
+        # Neue oder lokal unbekannte Objekte vollständig holen, sonst Teilupdate
+        fetch = [oid for oid, state in live.items() if state['fetch'] or oid not in known]
+        fetched, errors = self._fetch(object_type, fetch)
+        rows = [IncrementalSyncEngine.map_record(object_type, record) for record in fetched]
+        phones = []
+        for oid, state in live.items():
+            if oid in known and not state['fetch']:
+                props = {k: v for k, v in state['props'].items() if k in columns}
+                if props:
+                    rows.append(IncrementalSyncEngine.map_record(
+                        object_type, {'id': oid, 'properties': props}, partial=True
+                    ))
+                phones.append((oid, state['props']))
+        
+        if rows:
+            engine._upsert(table, rows)
+        if object_type == 'contacts':
+            PHONE_INDEX.update([(record['id'], record.get('properties', {})) for record in fetched], full=True)
+            PHONE_INDEX.update(phones)
+            PHONE_INDEX.remove(deleted)
+        if deleted:
+            engine.db.session.execute(
+                update(table).where(table.c.hubspot_id.in_(deleted)).values(hubspot_id=None)
+            )
+        return errors
+    
+    def _fetch(self, object_type, object_ids):
+        """(records, errors) - a failing chunk does not stop the other chunks"""
+        records = []
+        errors = []
+        for i in range(0, len(object_ids), HubSpotClient.BATCH_LIMIT):
+            chunk = object_ids[i:i + HubSpotClient.BATCH_LIMIT]
+            found = self.hubspot.batch_read(
+                object_type, chunk, properties=IncrementalSyncEngine.PROPERTIES[object_type]
+            )
+            if 'error' in found:
+                errors.append(f'{object_type} batch_read ({len(chunk)} IDs): {found["error"]}')
+                continue
+            records.extend(found.get('results', []))
+        return records, errors
+
+
+_webhook_pool = None
+_webhook_pool_lock = threading.Lock()
+
+
+def get_webhook_pool():
+    """Process-wide queue + worker pool for HubSpot webhooks"""
+    global _webhook_pool
+    if _webhook_pool is None:
+        with _webhook_pool_lock:
+            if _webhook_pool is None:
+                _webhook_pool = WebhookWorkerPool(
+                    WebhookQueue('hubspot'),
+                    HubSpotWebhookProcessor(),
+                    workers=HubSpotConfig.WEBHOOK_WORKERS
+                )
+    return _webhook_pool
 
 # ============================================================================
 # SAMPLE DATA (Explorium Results)
@@ -1359,11 +1941,15 @@ def dashboard():
 
 @hubspot_crm_bp.route('/sync-from-hubspot', methods=['POST'])
 def sync_from_hubspot():
-    """Sync contacts from HubSpot to local"""
+    """Sync contacts and deals changed since the last run from HubSpot to local"""
     try:
         sync_engine = LeadSyncEngine()
-        leads = sync_engine.sync_to_local_db()
-        return jsonify({'success': True, 'synced': len(leads)})
+        results = sync_engine.sync_to_local_db()
+        return jsonify({
+            'success': True,
+            'synced': sum(r['fetched'] for r in results.values()),
+            'results': results
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1424,44 +2010,30 @@ def config():
 
 @hubspot_crm_bp.route('/export-csv')
 def export_csv():
-    """Export leads as CSV"""
-    import csv
-    from io import StringIO
-    from flask import Response
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow([
+    """Export leads as CSV (streamed, ?gzip=1 for .csv.gz)"""
+    header = [
         'Name', 'Position', 'Firma', 'Website', 'E-Mail', 'Telefon',
         'LinkedIn', 'Stadt', 'Land', 'Score', 'WhatsApp Consent'
-    ])
+    ]
     
-    # Data
-    sync_engine = LeadSyncEngine()
-    for lead in SAMPLE_EXPLORIUM_LEADS:
-        score = sync_engine._calculate_lead_score(lead)
-        writer.writerow([
-            lead.get('prospect_full_name', ''),
-            lead.get('prospect_job_title', ''),
-            lead.get('prospect_company_name', ''),
-            lead.get('prospect_company_website', ''),
-            lead.get('contact_professions_email', ''),
-            lead.get('contact_mobile_phone', ''),
-            lead.get('prospect_linkedin', ''),
-            lead.get('prospect_city', ''),
-            lead.get('prospect_country_name', ''),
-            score,
-            'not_set'
-        ])
+    def rows():
+        sync_engine = LeadSyncEngine()
+        for lead in SAMPLE_EXPLORIUM_LEADS:
+            yield [
+                lead.get('prospect_full_name', ''),
+                lead.get('prospect_job_title', ''),
+                lead.get('prospect_company_name', ''),
+                lead.get('prospect_company_website', ''),
+                lead.get('contact_professions_email', ''),
+                lead.get('contact_mobile_phone', ''),
+                lead.get('prospect_linkedin', ''),
+                lead.get('prospect_city', ''),
+                lead.get('prospect_country_name', ''),
+                sync_engine._calculate_lead_score(lead),
+                'not_set'
+            ]
     
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=leads_export.csv'}
-    )
+    return csv_response('leads_export.csv', header, rows(), compress=wants_gzip(request.args))
 
 @hubspot_crm_bp.route('/update-consent', methods=['POST'])
 def update_consent():
@@ -1478,31 +2050,28 @@ def update_consent():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@hubspot_crm_bp.route('/rate-limit')
+def rate_limit_status():
+    """Current HubSpot rate limiter state (tokens, queue depth, 429s)"""
+    return jsonify({'success': True, 'limiters': rate_limit_metrics()})
+
 @hubspot_crm_bp.route('/webhook', methods=['POST'])
 def webhook():
-    """HubSpot webhook endpoint for real-time updates"""
-    try:
-        data = request.get_json()
-        
-        # Process webhook events
-        for event in data:
-            event_type = event.get('subscriptionType')
-            object_id = event.get('objectId')
-            
-            # Handle different event types
-            if event_type == 'contact.creation':
-                # New contact created in HubSpot
-                pass
-            elif event_type == 'contact.propertyChange':
-                # Contact property changed
-                pass
-            elif event_type == 'deal.creation':
-                # New deal created
-                pass
-        
-        return jsonify({'success': True})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+    """HubSpot webhook endpoint - verify, enqueue raw batch, ack immediately"""
+    body = request.get_data()
+    if not verify_webhook_signature(request, body):
+        return jsonify({'success': False, 'error': 'Invalid signature'}), 401
+    
+    pool = get_webhook_pool()
+    pool.ensure_started(current_app._get_current_object())
+    pool.queue.append(body)
+    pool.notify()
+    return jsonify({'success': True})
+
+@hubspot_crm_bp.route('/webhook/status')
+def webhook_status():
+    """Webhook queue depth and worker counters"""
+    return jsonify({'success': True, 'webhooks': get_webhook_pool().metrics()})
 
 # ============================================================================
 # API ENDPOINTS
@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 import json
 import random
 
+from app_broly_automation import LeadScoringEngine
+
 leads_bp = Blueprint('leads', __name__)
 
 # ============================================================================
@@ -846,14 +848,15 @@ def update_lead_stage(lead_id):
 @leads_bp.route('/api/leads/<int:lead_id>/score', methods=['POST'])
 def recalculate_score(lead_id):
     """Recalculate lead score based on engagement"""
-    # In production: Calculate based on activities
-    new_score = random.randint(50, 95)
+    result = LeadScoringEngine.current_score(lead_id)
+    if result is None:
+        return jsonify({'success': False, 'error': 'Lead nicht gefunden'}), 404
     
     return jsonify({
         'success': True,
         'lead_id': lead_id,
-        'score': new_score,
-        'temperature': 'hot' if new_score >= 70 else ('warm' if new_score >= 50 else 'cold')
+        'score': result['score'],
+        'temperature': result['temperature']
     })
 
 
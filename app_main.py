@@ -28,6 +28,8 @@ import sys
 from datetime import datetime, timedelta
 from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import json
@@ -80,6 +82,36 @@ class Contact(db.Model):
     hubspot_id = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Keyset-Pagination auf (updated_at, id) - Filter-Spalten vorne, damit
+    # consent/source-Filter und Sortierung aus demselben Index kommen
+    __table_args__ = (
+        db.Index('ix_contacts_updated_id', 'updated_at', 'id'),
+        db.Index('ix_contacts_consent_updated_id', 'whatsapp_consent', 'updated_at', 'id'),
+        db.Index('ix_contacts_source_updated_id', 'source', 'updated_at', 'id'),
+        db.Index('ix_contacts_hubspot_id', 'hubspot_id'),
+    )
+
+
+# Import-Dedupe vergleicht E-Mails case-insensitive
+db.Index('ix_contacts_email_lower', db.func.lower(Contact.email))
+
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    filename = db.Column(db.String(300))
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    bytes_total = db.Column(db.BigInteger, default=0)
+    bytes_read = db.Column(db.BigInteger, default=0)
+    processed = db.Column(db.Integer, default=0)
+    inserted = db.Column(db.Integer, default=0)
+    updated = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Text)  # JSON array (erste 100 Fehler)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
 
 
 class Lead(db.Model):
@@ -105,7 +137,14 @@ class Lead(db.Model):
     last_contacted = db.Column(db.DateTime)
     next_followup = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     converted_at = db.Column(db.DateTime)
+    hubspot_id = db.Column(db.String(50), index=True)
+    website_visits = db.Column(db.Integer, default=0)
+    email_opens = db.Column(db.Integer, default=0)
+    email_clicks = db.Column(db.Integer, default=0)
+    engagement_score = db.Column(db.Float)  # Stand zum Zeitpunkt engagement_decayed_at
+    engagement_decayed_at = db.Column(db.DateTime)
 
 
 class Campaign(db.Model):
@@ -117,6 +156,8 @@ class Campaign(db.Model):
     status = db.Column(db.String(50), default='draft')
     subject = db.Column(db.String(500))
     content = db.Column(db.Text)
+    template_id = db.Column(db.Integer)  # statt subject/content, falls gesetzt
+    whatsapp_template = db.Column(db.String(200))  # freigegebenes Meta-Template, content füllt {{1}}
     audience_filter = db.Column(db.Text)
     scheduled_at = db.Column(db.DateTime)
     sent_count = db.Column(db.Integer, default=0)
@@ -124,9 +165,125 @@ class Campaign(db.Model):
     click_count = db.Column(db.Integer, default=0)
     reply_count = db.Column(db.Integer, default=0)
     conversion_count = db.Column(db.Integer, default=0)
+    failed_count = db.Column(db.Integer, default=0)
+    send_cursor = db.Column(db.Integer, default=0)  # letzte verarbeitete Lead-ID (Pause/Resume)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Versand-Thread lebt noch?
+    dispatch_owner = db.Column(db.String(32))  # Token des versendenden Threads
+    last_error = db.Column(db.String(500))  # Grund der letzten automatischen Pause
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class CampaignEvent(db.Model):
+    __tablename__ = 'campaign_events'
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaigns.id'))
+    lead_id = db.Column(db.Integer)
+    event_type = db.Column(db.String(50))  # sent, failed, delivered, opened, clicked, replied, bounced, unsubscribed, converted
+    channel = db.Column(db.String(50))  # email, whatsapp, sms
+    event_metadata = db.Column('metadata', db.Text)  # JSON
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_campaign_events_campaign_time', 'campaign_id', 'timestamp'),
+    )
+
+
+class CampaignRollup(db.Model):
+    __tablename__ = 'campaign_rollups'
+    campaign_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    channel = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)  # volle Stunde (UTC)
+    sent = db.Column(db.Integer, default=0, nullable=False)
+    delivered = db.Column(db.Integer, default=0, nullable=False)
+    opened = db.Column(db.Integer, default=0, nullable=False)
+    clicked = db.Column(db.Integer, default=0, nullable=False)
+    replied = db.Column(db.Integer, default=0, nullable=False)
+    bounced = db.Column(db.Integer, default=0, nullable=False)
+    unsubscribed = db.Column(db.Integer, default=0, nullable=False)
+    converted = db.Column(db.Integer, default=0, nullable=False)
+    failed = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Zeitraum-Abfragen über alle Kampagnen: WHERE bucket >= :since
+    __table_args__ = (
+        db.Index('ix_campaign_rollups_bucket', 'bucket'),
+    )
+
+
+class Template(db.Model):
+    __tablename__ = 'templates'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    name = db.Column(db.String(200), nullable=False)
+    type = db.Column(db.String(50))  # email, whatsapp, sms
+    category = db.Column(db.String(100))
+    subject = db.Column(db.String(500))
+    content = db.Column(db.Text)
+    variables = db.Column(db.Text)  # JSON
+    version = db.Column(db.Integer, default=1)  # Cache-Schlüssel der kompilierten Fassung
+    use_count = db.Column(db.Integer, default=0)
+    avg_open_rate = db.Column(db.Float, default=0)
+    is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class SyncWatermark(db.Model):
+    __tablename__ = 'sync_watermarks'
+    object_type = db.Column(db.String(50), primary_key=True)  # contacts, deals
+    watermark_ms = db.Column(db.BigInteger)  # höchstes lastmodifieddate (epoch ms)
+    last_run_at = db.Column(db.DateTime)
+    last_synced = db.Column(db.Integer, default=0)
+
+
+class PhoneIndex(db.Model):
+    __tablename__ = 'phone_index'
+    hubspot_id = db.Column(db.String(50), primary_key=True)
+    property = db.Column(db.String(50), primary_key=True)  # phone, mobilephone, hs_whatsapp_phone_number
+    phone_e164 = db.Column(db.String(16), nullable=False)
+    contact_id = db.Column(db.Integer)  # lokaler Kontakt (contacts.id), falls gespiegelt
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Consent-Antworten: WHERE phone_e164 = :phone
+    __table_args__ = (
+        db.Index('ix_phone_index_phone_e164', 'phone_e164'),
+    )
+
+
+class ConsentSnapshot(db.Model):
+    __tablename__ = 'consent_snapshots'
+    hubspot_id = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)  # Schlüssel aus CONSENT_STATUS (OPT_IN, ...)
+    first_name = db.Column(db.String(100))
+    last_name = db.Column(db.String(100))
+    phone = db.Column(db.String(50))
+    consent_date = db.Column(db.String(40))  # hs_whatsapp_consent_date wie von HubSpot geliefert
+    modified_at = db.Column(db.DateTime)  # lastmodifieddate in HubSpot
+    refreshed_at = db.Column(db.DateTime)  # Vollabgleich: ältere Zeilen sind gelöscht
+
+    # Zähler pro Status und Zielgruppen (z.B. alle NOT_SET) aus demselben Index
+    __table_args__ = (
+        db.Index('ix_consent_snapshots_status_id', 'status', 'hubspot_id'),
+        db.Index('ix_consent_snapshots_modified', 'modified_at'),
+    )
+
+
+class WhatsAppBroadcast(db.Model):
+    __tablename__ = 'whatsapp_broadcasts'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    audience = db.Column(db.String(20))  # all_consent, hot_leads, customers, custom
+    status = db.Column(db.String(20), default='running')  # running, completed, failed
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    report = db.Column(db.Text)  # JSON (Fehler nach Code, Durchsatz, Tier)
+    error = db.Column(db.String(500))
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime)  # letzter Fortschritt - bleibt stehen, wenn der Prozess stirbt
+    completed_at = db.Column(db.DateTime)
+
+
 class Invoice(db.Model):
     __tablename__ = 'invoices'
     id = db.Column(db.Integer, primary_key=True)
@@ -160,6 +317,27 @@ class Automation(db.Model):
     run_count = db.Column(db.Integer, default=0)
     last_run = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+
+class AutomationRun(db.Model):
+    __tablename__ = 'automation_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    automation_id = db.Column(db.Integer, db.ForeignKey('automations.id'))
+    lead_id = db.Column(db.Integer)
+    step_index = db.Column(db.Integer, default=0)  # nächste auszuführende Aktion
+    status = db.Column(db.String(20), default='pending')  # pending, waiting, scheduled, completed, failed, cancelled
+    due_at = db.Column(db.DateTime, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(32))
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Fällige Schritte: WHERE status IN (...) AND due_at <= :horizon ORDER BY due_at
+    __table_args__ = (
+        db.Index('ix_automation_runs_status_due', 'status', 'due_at'),
+    )
 
 
 class AuditLog(db.Model):
@@ -980,10 +1158,25 @@ def health_check():
 # INITIALIZE DATABASE
 # ============================================================================
 
+def migrate_schema():
+    """Add columns and indexes that create_all() does not add to existing tables"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
 def init_db():
     """Initialize database with default data"""
     with app.app_context():
         db.create_all()
+        migrate_schema()
         
         # Create default admin user
         if not User.query.filter_by(username='admin').first():
@@ -1016,6 +1209,7 @@ def register_all_blueprints():
     modules = [
         ('app_broly_automation', 'broly_bp', '🐉 BROLY'),
         ('app_contacts_module', 'contacts_bp', '📇 CONTACTS'),
+        ('app_hubspot_crm', 'hubspot_crm_bp', '🔗 HUBSPOT CRM'),
         ('app_leads_module', 'leads_bp', '🎯 LEADS'),
         ('app_campaigns_module', 'campaigns_bp', '📧 CAMPAIGNS'),
         ('app_invoices_module', 'invoices_bp', '💰 INVOICES'),
@@ -6,13 +6,25 @@ Basierend auf: https://knowledge.hubspot.com/de/inbox/edit-the-whatsapp-consent-
 Enterprise Universe GmbH - 2025
 """
 
-from flask import Blueprint, render_template_string, jsonify, request, session
-import requests
+from flask import Blueprint, Response, current_app, render_template_string, jsonify, request, session, stream_with_context
 import json
+import logging
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
+from sqlalchemy import select, insert, update, delete, bindparam, func
+
+from app_hubspot_crm import HubSpotClient as CRMClient, _to_epoch_ms
+from hubspot_transport import hubspot_request
+from phone_index import PHONE_INDEX, normalize_e164, whatsapp_id
+from streaming_export import csv_response, iter_query, wants_gzip
+from whatsapp_transport import API_VERSION, SEND_WORKERS, build_message, get_transport
+from westmoney_db import get_db, get_table
+
+logger = logging.getLogger(__name__)
+
 # ============================================================================
 # BLUEPRINT
 # ============================================================================
@@ -25,7 +37,7 @@ WHATSAPP_CONFIG = {
     "phone_number_id": os.environ.get("WHATSAPP_PHONE_ID", ""),
     "access_token": os.environ.get("WHATSAPP_TOKEN", ""),
     "business_account_id": os.environ.get("WHATSAPP_BUSINESS_ID", ""),
-    "api_version": "v18.0",
+    "api_version": API_VERSION,
     "webhook_verify_token": os.environ.get("WHATSAPP_VERIFY_TOKEN", "westmoney_verify_2025"),
 }
 
@@ -44,6 +56,40 @@ CONSENT_STATUS = {
     "IMPLICIT": "implicit_consent"  # Implizite Zustimmung (z.B. durch Nachricht)
 }
 
+def consent_interactive(contact_name=""):
+    """Interactive button message asking for WhatsApp opt-in"""
+    return {
+        "type": "button",
+        "header": {
+            "type": "text",
+            "text": "📱 WhatsApp Kommunikation"
+        },
+        "body": {
+            "text": f"Hallo{' ' + contact_name if contact_name else ''}! 👋\n\nWir von West Money Bau möchten Sie gerne über WhatsApp kontaktieren, um Sie über:\n\n✅ Projektfortschritte\n✅ Termine & Angebote\n✅ Smart Home Updates\n\nzu informieren.\n\nMöchten Sie WhatsApp-Nachrichten von uns erhalten?"
+        },
+        "footer": {
+            "text": "Sie können Ihre Einwilligung jederzeit widerrufen."
+        },
+        "action": {
+            "buttons": [
+                {
+                    "type": "reply",
+                    "reply": {
+                        "id": "consent_yes",
+                        "title": "✅ Ja, gerne!"
+                    }
+                },
+                {
+                    "type": "reply",
+                    "reply": {
+                        "id": "consent_no",
+                        "title": "❌ Nein, danke"
+                    }
+                }
+            ]
+        }
+    }
+
 # ============================================================================
 # WHATSAPP CLOUD API CLIENT
 # ============================================================================
@@ -55,6 +101,7 @@ class WhatsAppClient:
         self.token = WHATSAPP_CONFIG["access_token"]
         self.version = WHATSAPP_CONFIG["api_version"]
         self.base_url = f"https://graph.facebook.com/{self.version}"
+        self.transport = get_transport(self.phone_id, self.token)
         
     def _headers(self):
         return {
@@ -63,83 +110,29 @@ class WhatsAppClient:
         }
     
     def send_message(self, to, message_type="text", **kwargs):
-        """Send WhatsApp message"""
-        url = f"{self.base_url}/{self.phone_id}/messages"
-        
-        payload = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": to,
-            "type": message_type
-        }
-        
-        if message_type == "text":
-            payload["text"] = {"body": kwargs.get("text", "")}
-        elif message_type == "template":
-            payload["template"] = {
-                "name": kwargs.get("template_name"),
-                "language": {"code": kwargs.get("language", "de")},
-                "components": kwargs.get("components", [])
-            }
-        elif message_type == "interactive":
-            payload["interactive"] = kwargs.get("interactive", {})
-            
-        try:
-            response = requests.post(url, headers=self._headers(), json=payload)
-            return response.json()
-        except Exception as e:
-            return {"error": str(e)}
+        """Send WhatsApp message (pooled, rate-limited, retried - see whatsapp_transport)"""
+        return self.transport.send_message(to, message_type, **kwargs)
     
     def send_consent_request(self, to, contact_name=""):
         """Send WhatsApp consent/opt-in request"""
-        interactive = {
-            "type": "button",
-            "header": {
-                "type": "text",
-                "text": "📱 WhatsApp Kommunikation"
-            },
-            "body": {
-                "text": f"Hallo{' ' + contact_name if contact_name else ''}! 👋\n\nWir von West Money Bau möchten Sie gerne über WhatsApp kontaktieren, um Sie über:\n\n✅ Projektfortschritte\n✅ Termine & Angebote\n✅ Smart Home Updates\n\nzu informieren.\n\nMöchten Sie WhatsApp-Nachrichten von uns erhalten?"
-            },
-            "footer": {
-                "text": "Sie können Ihre Einwilligung jederzeit widerrufen."
-            },
-            "action": {
-                "buttons": [
-                    {
-                        "type": "reply",
-                        "reply": {
-                            "id": "consent_yes",
-                            "title": "✅ Ja, gerne!"
-                        }
-                    },
-                    {
-                        "type": "reply",
-                        "reply": {
-                            "id": "consent_no",
-                            "title": "❌ Nein, danke"
-                        }
-                    }
-                ]
-            }
-        }
-        
-        return self.send_message(to, message_type="interactive", interactive=interactive)
+        return self.send_message(to, message_type="interactive", interactive=consent_interactive(contact_name))
+    
+    def consent_request_payload(self, to, contact_name=""):
+        """Consent request as Graph payload (for transport.send_many)"""
+        return build_message(to, "interactive", interactive=consent_interactive(contact_name))
     
     def get_phone_number_info(self):
         """Get registered phone number info"""
-        url = f"{self.base_url}/{self.phone_id}"
         try:
-            response = requests.get(url, headers=self._headers())
+            response = self.transport.request("GET", self.phone_id)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
     
     def get_message_templates(self):
         """Get approved message templates"""
-        url = f"{self.base_url}/{WHATSAPP_CONFIG['business_account_id']}/message_templates"
         try:
-            response = requests.get(url, headers=self._headers())
+            response = self.transport.request("GET", f"{WHATSAPP_CONFIG['business_account_id']}/message_templates")
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -150,15 +143,11 @@ class WhatsAppClient:
 class HubSpotClient:
     """HubSpot API Client für Contact & Consent Management"""
     
+    BATCH_LIMIT = 100  # max. Inputs pro batch/read und batch/update
+    
     def __init__(self):
         self.api_key = HUBSPOT_CONFIG["api_key"]
         self.base_url = HUBSPOT_CONFIG["base_url"]
-        
-    def _headers(self):
-        return {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
     
     def get_contact(self, contact_id=None, email=None, phone=None):
         """Get contact by ID, email or phone"""
@@ -173,7 +162,7 @@ class HubSpotClient:
             return {"error": "contact_id, email or phone required"}
             
         try:
-            response = requests.get(url, headers=self._headers())
+            response = hubspot_request("GET", url, self.api_key, timeout=30)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -197,7 +186,7 @@ class HubSpotClient:
             payload["query"] = query
             
         try:
-            response = requests.post(url, headers=self._headers(), json=payload)
+            response = hubspot_request("POST", url, self.api_key, json=payload, timeout=30)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -207,7 +196,7 @@ class HubSpotClient:
         url = f"{self.base_url}/crm/v3/objects/contacts/{contact_id}"
         
         try:
-            response = requests.patch(url, headers=self._headers(), json={"properties": properties})
+            response = hubspot_request("PATCH", url, self.api_key, json={"properties": properties}, timeout=30)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -219,28 +208,50 @@ class HubSpotClient:
             "hs_whatsapp_consent_date": datetime.now().isoformat()
         }
         
-        if phone_number:
-            # Format: +49XXXXXXXXXX
-            formatted = phone_number.replace(" ", "").replace("-", "")
-            if not formatted.startswith("+"):
-                formatted = "+49" + formatted.lstrip("0")
+        formatted = normalize_e164(phone_number)
+        if formatted:
             properties["hs_whatsapp_phone_number"] = formatted
             
         return self.update_contact(contact_id, properties)
     
+    def batch_read_contacts(self, contact_ids, properties=None):
+        """Read contacts by ID - one batch/read per BATCH_LIMIT IDs"""
+        url = f"{self.base_url}/crm/v3/objects/contacts/batch/read"
+        properties = properties or ["firstname", "phone", "mobilephone", "hs_whatsapp_phone_number"]
+        
+        results, errors = [], []
+        for start in range(0, len(contact_ids), self.BATCH_LIMIT):
+            chunk = contact_ids[start:start + self.BATCH_LIMIT]
+            payload = {"inputs": [{"id": str(i)} for i in chunk], "properties": properties}
+            try:
+                response = hubspot_request("POST", url, self.api_key, json=payload, timeout=30)
+                body = response.json()
+            except Exception as e:
+                body = {"error": str(e)}
+            if "error" in body or body.get("status") == "error":
+                errors.append(body.get("error") or body.get("message"))
+            results.extend(body.get("results", []))
+        
+        if errors and not results:
+            return {"error": errors[0]}
+        return {"results": results, "errors": errors}
+    
     def bulk_update_consent(self, contact_updates):
         """Bulk update WhatsApp consent for multiple contacts
         
         Args:
             contact_updates: List of dicts with 'id', 'status', and optional 'phone'
+        
+        Eine batch/update-Anfrage pro BATCH_LIMIT Kontakte.
         """
         url = f"{self.base_url}/crm/v3/objects/contacts/batch/update"
+        consent_date = datetime.now().isoformat()
         
         inputs = []
         for update in contact_updates:
             properties = {
                 "hs_whatsapp_consent_status": update["status"],
-                "hs_whatsapp_consent_date": datetime.now().isoformat()
+                "hs_whatsapp_consent_date": consent_date
             }
             if update.get("phone"):
                 properties["hs_whatsapp_phone_number"] = update["phone"]
@@ -250,11 +261,22 @@ class HubSpotClient:
                 "properties": properties
             })
         
-        try:
-            response = requests.post(url, headers=self._headers(), json={"inputs": inputs})
-            return response.json()
-        except Exception as e:
-            return {"error": str(e)}
+        results, errors = [], []
+        for start in range(0, len(inputs), self.BATCH_LIMIT):
+            try:
+                response = hubspot_request(
+                    "POST", url, self.api_key, json={"inputs": inputs[start:start + self.BATCH_LIMIT]}, timeout=30
+                )
+                body = response.json()
+            except Exception as e:
+                body = {"error": str(e)}
+            if "error" in body or body.get("status") == "error":
+                errors.append(body.get("error") or body.get("message"))
+            results.extend(body.get("results", []))
+        
+        if errors:
+            return {"error": errors[0], "errors": errors, "results": results}
+        return {"status": "COMPLETE", "results": results}
     
     def get_contacts_by_consent_status(self, status):
         """Get all contacts with specific WhatsApp consent status"""
@@ -278,11 +300,241 @@ class HubSpotClient:
         url = f"{self.base_url}/crm/v3/objects/contacts"
         
         try:
-            response = requests.post(url, headers=self._headers(), json={"properties": properties})
+            response = hubspot_request("POST", url, self.api_key, json={"properties": properties}, timeout=30)
             return response.json()
         except Exception as e:
             return {"error": str(e)}
 
+# ============================================================================
+# CONSENT SNAPSHOT
+# ============================================================================
+class ConsentSnapshot:
+    """Local copy of every contact's WhatsApp consent status (consent_snapshots)
+    
+    Ein Durchlauf über alle Kontakte mit nur den Consent-Properties statt
+    einer Search pro Status (max. 100 Treffer je Search). Danach nur noch
+    inkrementell ab lastmodifieddate-Watermark (sync_watermarks); ein
+    Vollabgleich (full=True) entfernt zusätzlich gelöschte Kontakte.
+    Dashboard-Zahlen, Zielgruppen und der CSV-Export lesen nur die Tabelle.
+    """
+    
+    WATERMARK_KEY = "consent_snapshot"
+    PROPERTIES = [
+        "firstname", "lastname", "phone", "mobilephone", "hs_whatsapp_phone_number",
+        "hs_whatsapp_consent_status", "hs_whatsapp_consent_date", "lastmodifieddate"
+    ]
+    BATCH_SIZE = 500
+    OVERLAP_MS = 60 * 1000
+    MAX_AGE = timedelta(minutes=5)  # danach stößt das Dashboard einen Abgleich im Hintergrund an
+    
+    STATUS_KEYS = {value: key for key, value in CONSENT_STATUS.items()}
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+    
+    # ------------------------------------------------------------------
+    # Abgleich mit HubSpot
+    # ------------------------------------------------------------------
+    
+    def refresh(self, full=False, client=None):
+        """Pull changed contacts (all contacts on the first run or with full=True)"""
+        with self._lock:
+            return self._refresh(full, client or CRMClient(HUBSPOT_CONFIG["api_key"]))
+    
+    def refresh_async(self, app):
+        """Start a background refresh unless one is already running"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        
+        def run():
+            try:
+                with app.app_context():
+                    self._refresh(False, CRMClient(HUBSPOT_CONFIG["api_key"]))
+            except Exception as e:
+                logger.warning("Consent-Snapshot nicht aktualisiert: %s", e)
+            finally:
+                self._lock.release()
+        
+        threading.Thread(target=run, name="consent-snapshot", daemon=True).start()
+        return True
+    
+    def _refresh(self, full, client):
+        started = datetime.utcnow()
+        started_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        watermark = None if full else self._watermark()[0]
+        
+        if watermark is None:
+            records = client.iter_objects("contacts", self.PROPERTIES)
+        else:
+            records = client.iter_search("contacts", [{
+                "propertyName": "lastmodifieddate",
+                "operator": "GTE",
+                "value": str(watermark - self.OVERLAP_MS)
+            }], self.PROPERTIES)
+        
+        stats = {"mode": "full" if watermark is None else "incremental", "fetched": 0}
+        batch = {}
+        for record in records:
+            batch[str(record["id"])] = record
+            stats["fetched"] += 1
+            if len(batch) >= self.BATCH_SIZE:
+                watermark = self._store(batch, watermark, started, checkpoint=stats["mode"] == "incremental")
+                batch = {}
+        
+        if stats["mode"] == "full":
+            watermark = started_ms - self.OVERLAP_MS
+        self._store(batch, watermark, started, checkpoint=True)
+        if stats["mode"] == "full":
+            table = get_table("consent_snapshots")
+            stats["removed"] = get_db().session.execute(
+                delete(table).where(table.c.refreshed_at < started)
+            ).rowcount
+            get_db().session.commit()
+        
+        stats["counts"] = self.counts()
+        return stats
+    
+    def _store(self, batch, watermark, refreshed_at, checkpoint):
+        """Replace one batch of rows and (optionally) advance the watermark - one transaction"""
+        table = get_table("consent_snapshots")
+        session = get_db().session
+        try:
+            if batch:
+                rows = [self.row(record, refreshed_at) for record in batch.values()]
+                session.execute(delete(table).where(table.c.hubspot_id.in_(list(batch))))
+                session.execute(insert(table), rows)
+                if checkpoint:
+                    seen = [_to_epoch_ms(r.get("properties", {}).get("lastmodifieddate")) for r in batch.values()]
+                    watermark = max([ts for ts in seen if ts is not None] + [watermark or 0])
+            if checkpoint:
+                self._save_watermark(watermark)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return watermark
+    
+    @classmethod
+    def row(cls, record, refreshed_at):
+        """HubSpot contact -> consent_snapshots row"""
+        props = record.get("properties", {})
+        modified_ms = _to_epoch_ms(props.get("lastmodifieddate"))
+        return {
+            "hubspot_id": str(record["id"]),
+            "status": cls.STATUS_KEYS.get(props.get("hs_whatsapp_consent_status"), "NOT_SET"),
+            "first_name": (props.get("firstname") or "")[:100],
+            "last_name": (props.get("lastname") or "")[:100],
+            "phone": (props.get("hs_whatsapp_phone_number") or props.get("mobilephone") or props.get("phone") or "")[:50],
+            "consent_date": props.get("hs_whatsapp_consent_date"),
+            "modified_at": datetime.utcfromtimestamp(modified_ms / 1000) if modified_ms else None,
+            "refreshed_at": refreshed_at
+        }
+    
+    def _watermark(self):
+        table = get_table("sync_watermarks")
+        row = get_db().session.execute(
+            select(table.c.watermark_ms, table.c.last_run_at).where(table.c.object_type == self.WATERMARK_KEY)
+        ).first()
+        return (row.watermark_ms, row.last_run_at) if row else (None, None)
+    
+    def _save_watermark(self, watermark):
+        table = get_table("sync_watermarks")
+        values = {"watermark_ms": watermark, "last_run_at": datetime.utcnow()}
+        result = get_db().session.execute(
+            update(table).where(table.c.object_type == self.WATERMARK_KEY).values(values)
+        )
+        if result.rowcount == 0:
+            get_db().session.execute(insert(table).values(object_type=self.WATERMARK_KEY, **values))
+    
+    def is_stale(self):
+        last_run = self._watermark()[1]
+        return last_run is None or datetime.utcnow() - last_run > self.MAX_AGE
+    
+    def mark(self, updates):
+        """Apply locally known status changes [(hubspot_id, status value)] right away - commits"""
+        updates = [(str(contact_id), self.STATUS_KEYS.get(status, "NOT_SET")) for contact_id, status in updates]
+        if not updates:
+            return
+        table = get_table("consent_snapshots")
+        session = get_db().session
+        consent_date = datetime.now().isoformat()
+        try:
+            session.execute(
+                update(table)
+                .where(table.c.hubspot_id == bindparam("key_hubspot_id"))
+                .values(status=bindparam("new_status"), consent_date=bindparam("new_date")),
+                [{"key_hubspot_id": contact_id, "new_status": status, "new_date": consent_date}
+                 for contact_id, status in updates]
+            )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning("Consent-Snapshot nicht aktualisiert: %s", e)
+    
+    # ------------------------------------------------------------------
+    # Lesen
+    # ------------------------------------------------------------------
+    
+    def counts(self):
+        """{status key: contacts} for every CONSENT_STATUS key"""
+        table = get_table("consent_snapshots")
+        counts = dict.fromkeys(CONSENT_STATUS, 0)
+        counts.update(get_db().session.execute(
+            select(table.c.status, func.count()).group_by(table.c.status)
+        ).all())
+        return counts
+    
+    def stats(self):
+        """Dashboard tiles"""
+        counts = self.counts()
+        return {
+            "opted_in": counts["OPT_IN"],
+            "opted_out": counts["OPT_OUT"],
+            "pending": counts["PENDING"],
+            "not_set": counts["NOT_SET"],
+            "implicit": counts["IMPLICIT"]
+        }
+    
+    def ids(self, status):
+        """HubSpot IDs of all contacts with a status key (e.g. 'NOT_SET')"""
+        table = get_table("consent_snapshots")
+        return list(get_db().session.execute(
+            select(table.c.hubspot_id).where(table.c.status == status).order_by(table.c.hubspot_id)
+        ).scalars())
+    
+    def recent(self, limit=100):
+        """Most recently modified contacts, shaped like HubSpot objects (dashboard list)"""
+        table = get_table("consent_snapshots")
+        rows = get_db().session.execute(
+            select(table).order_by(table.c.modified_at.desc()).limit(limit)
+        ).mappings()
+        return [self.as_contact(row) for row in rows]
+    
+    @staticmethod
+    def as_contact(row):
+        return {
+            "id": row["hubspot_id"],
+            "consent_status": row["status"],
+            "properties": {
+                "firstname": row["first_name"],
+                "lastname": row["last_name"],
+                "hs_whatsapp_phone_number": row["phone"],
+                "hs_whatsapp_consent_date": row["consent_date"]
+            }
+        }
+    
+    def iter_rows(self):
+        """All rows for the CSV export (server-side cursor)"""
+        table = get_table("consent_snapshots")
+        return iter_query(
+            select(table.c.hubspot_id, table.c.first_name, table.c.last_name,
+                   table.c.phone, table.c.status, table.c.consent_date)
+            .order_by(table.c.hubspot_id)
+        )
+
+
+CONSENT_SNAPSHOT = ConsentSnapshot()
+
 # ============================================================================
 # CONSENT MANAGEMENT SERVICE
 # ============================================================================
@@ -307,17 +559,18 @@ class ConsentManager:
         if not phone:
             return {"error": "No phone number found for contact"}
             
-        # Format phone number
-        formatted_phone = phone.replace(" ", "").replace("-", "")
-        if not formatted_phone.startswith("+"):
-            formatted_phone = "+49" + formatted_phone.lstrip("0")
+        formatted_phone = normalize_e164(phone)
+        if not formatted_phone:
+            return {"error": f"Invalid phone number: {phone}"}
         
         # Send WhatsApp consent request
-        wa_result = self.whatsapp.send_consent_request(formatted_phone.replace("+", ""), name)
+        wa_result = self.whatsapp.send_consent_request(whatsapp_id(formatted_phone), name)
         
         if "error" not in wa_result:
-            # Update HubSpot to pending
+            # Update HubSpot to pending - Antwort wird über den lokalen Index zugeordnet
             self.hubspot.update_whatsapp_consent(contact_id, CONSENT_STATUS["PENDING"], formatted_phone)
+            CONSENT_SNAPSHOT.mark([(contact_id, CONSENT_STATUS["PENDING"])])
+            PHONE_INDEX.remember([(contact_id, formatted_phone)])
             
         return {
             "success": "error" not in wa_result,
@@ -328,27 +581,27 @@ class ConsentManager:
     
     def process_consent_response(self, phone, response_id):
         """Process consent response from WhatsApp webhook"""
-        # Find contact by phone
-        search_result = self.hubspot.search_contacts(query=phone)
+        # Find contact by phone - lokaler Index, kein HubSpot-Search
+        contact = PHONE_INDEX.lookup(phone)
         
-        if not search_result.get("results"):
+        if not contact:
             return {"error": "Contact not found"}
             
-        contact = search_result["results"][0]
-        contact_id = contact["id"]
+        contact_id = contact["hubspot_id"]
+        recipient = whatsapp_id(contact["phone"])
         
         # Determine consent status based on response
         if response_id == "consent_yes":
             status = CONSENT_STATUS["OPT_IN"]
             # Send confirmation
             self.whatsapp.send_message(
-                phone.replace("+", ""),
+                recipient,
                 text="✅ Vielen Dank! Sie erhalten ab jetzt WhatsApp-Nachrichten von West Money Bau. Sie können jederzeit 'STOP' schreiben, um sich abzumelden."
             )
         elif response_id == "consent_no":
             status = CONSENT_STATUS["OPT_OUT"]
             self.whatsapp.send_message(
-                phone.replace("+", ""),
+                recipient,
                 text="👍 Verstanden! Wir werden Sie nicht über WhatsApp kontaktieren. Sie können Ihre Meinung jederzeit ändern."
             )
         else:
@@ -356,6 +609,8 @@ class ConsentManager:
             
         # Update HubSpot
         result = self.hubspot.update_whatsapp_consent(contact_id, status)
+        if "error" not in result:
+            CONSENT_SNAPSHOT.mark([(contact_id, status)])
         
         return {
             "success": True,
@@ -364,33 +619,78 @@ class ConsentManager:
             "hubspot_result": result
         }
     
-    def bulk_request_consent(self, contact_ids):
-        """Send consent requests to multiple contacts"""
-        results = []
-        for contact_id in contact_ids:
-            result = self.request_consent(contact_id)
-            results.append(result)
-        return results
-    
-    def sync_consent_from_hubspot(self):
-        """Get all contacts with their consent status from HubSpot"""
-        all_contacts = []
-        
-        for status_name, status_value in CONSENT_STATUS.items():
-            contacts = self.hubspot.get_contacts_by_consent_status(status_value)
-            if contacts.get("results"):
-                for contact in contacts["results"]:
-                    contact["consent_status"] = status_name
-                    all_contacts.append(contact)
-                    
-        # Also get contacts without consent
-        no_consent = self.hubspot.get_contacts_without_consent()
-        if no_consent.get("results"):
-            for contact in no_consent["results"]:
-                contact["consent_status"] = "NOT_SET"
-                all_contacts.append(contact)
-                
-        return all_contacts
+    def bulk_request_consent(self, contact_ids, workers=SEND_WORKERS):
+        """Send consent requests to many contacts - yields a progress dict per chunk
+        
+        Pro Chunk (HubSpotClient.BATCH_LIMIT Kontakte): ein batch/read, die
+        WhatsApp-Anfragen parallel über transport.send_many (höchstens
+        `workers` gleichzeitig, Tier/Rate-Limits im Transport) und ein
+        batch/update für alle erfolgreich angefragten Kontakte auf "pending".
+        Der letzte Eintrag hat done=True und enthält die Gesamtzahlen.
+        """
+        contact_ids = list(dict.fromkeys(str(i) for i in contact_ids))
+        progress = {"total": len(contact_ids), "processed": 0, "sent": 0,
+                    "failed": 0, "skipped": 0, "errors": {}}
+        
+        def count_error(reason):
+            progress["errors"][reason] = progress["errors"].get(reason, 0) + 1
+        
+        for start in range(0, len(contact_ids), HubSpotClient.BATCH_LIMIT):
+            chunk = contact_ids[start:start + HubSpotClient.BATCH_LIMIT]
+            found = self.hubspot.batch_read_contacts(chunk)
+            contacts = {str(c["id"]): c.get("properties", {}) for c in found.get("results", [])}
+            
+            payloads = {}
+            for contact_id in chunk:
+                props = contacts.get(contact_id)
+                if props is None:
+                    progress["failed"] += 1
+                    count_error(found.get("error") or "Contact not found")
+                    continue
+                phone = normalize_e164(
+                    props.get("hs_whatsapp_phone_number") or props.get("mobilephone") or props.get("phone")
+                )
+                if not phone:
+                    progress["skipped"] += 1
+                    count_error("No valid phone number")
+                    continue
+                payloads[contact_id] = (phone, self.whatsapp.consent_request_payload(
+                    whatsapp_id(phone), props.get("firstname", "")
+                ))
+            
+            contact_by_payload = {id(payload): contact_id for contact_id, (_, payload) in payloads.items()}
+            requested = []
+            
+            def on_result(payload, result):
+                if "error" not in result:
+                    requested.append(contact_by_payload[id(payload)])  # list.append ist thread-safe
+            
+            report = self.whatsapp.transport.send_many(
+                (payload for _, payload in payloads.values()), workers=workers, on_result=on_result
+            )
+            progress["sent"] += report["sent"]
+            progress["failed"] += report["failed"]
+            for reason, count in report["errors"].items():
+                progress["errors"][reason] = progress["errors"].get(reason, 0) + count
+            
+            if requested:
+                updates = [{"id": contact_id, "status": CONSENT_STATUS["PENDING"], "phone": payloads[contact_id][0]}
+                           for contact_id in requested]
+                result = self.hubspot.bulk_update_consent(updates)
+                if "error" in result:
+                    count_error(f"HubSpot update: {result['error']}"[:80])
+                else:
+                    CONSENT_SNAPSHOT.mark((contact_id, CONSENT_STATUS["PENDING"]) for contact_id in requested)
+                PHONE_INDEX.remember((contact_id, payloads[contact_id][0]) for contact_id in requested)
+            
+            progress["processed"] += len(chunk)
+            yield dict(progress, errors=dict(progress["errors"]))
+        
+        yield dict(progress, errors=dict(progress["errors"]), done=True)
+    
+    def sync_consent_from_hubspot(self, full=False):
+        """Refresh the local consent snapshot from HubSpot - returns counters"""
+        return CONSENT_SNAPSHOT.refresh(full=full)
 
 # ============================================================================
 # HTML TEMPLATE - CONSENT MANAGEMENT DASHBOARD
@@ -896,7 +1196,9 @@ CONSENT_DASHBOARD_HTML = """
                     headers: {'Content-Type': 'application/json'},
                     body: JSON.stringify({contact_ids: contactIds, target: target})
                 });
-                const data = await response.json();
+                // NDJSON-Fortschritt - die letzte Zeile enthält die Gesamtzahlen
+                const lines = (await response.text()).trim().split('\\n');
+                const data = JSON.parse(lines[lines.length - 1] || '{}');
                 
                 alert(`✅ ${data.sent || 0} Anfragen gesendet!`);
                 closeBulkModal();
@@ -957,26 +1259,15 @@ CONSENT_DASHBOARD_HTML = """
 @whatsapp_consent_bp.route('/')
 def consent_dashboard():
     """WhatsApp Consent Management Dashboard"""
-    manager = ConsentManager()
-    
-    # Get contacts with consent info
-    try:
-        contacts = manager.sync_consent_from_hubspot()
-    except:
-        contacts = []
-    
-    # Calculate stats
-    stats = {
-        "opted_in": len([c for c in contacts if c.get("consent_status") == "OPT_IN"]),
-        "opted_out": len([c for c in contacts if c.get("consent_status") == "OPT_OUT"]),
-        "pending": len([c for c in contacts if c.get("consent_status") == "PENDING"]),
-        "not_set": len([c for c in contacts if c.get("consent_status") == "NOT_SET"])
-    }
+    # Zahlen und Liste aus dem lokalen Snapshot - HubSpot wird nur im
+    # Hintergrund abgefragt, wenn der letzte Abgleich älter als MAX_AGE ist
+    if HUBSPOT_CONFIG["api_key"] and CONSENT_SNAPSHOT.is_stale():
+        CONSENT_SNAPSHOT.refresh_async(current_app._get_current_object())
     
     return render_template_string(
         CONSENT_DASHBOARD_HTML,
-        contacts=contacts[:100],  # Limit for display
-        stats=stats,
+        contacts=CONSENT_SNAPSHOT.recent(100),
+        stats=CONSENT_SNAPSHOT.stats(),
         whatsapp_connected=bool(WHATSAPP_CONFIG["access_token"]),
         hubspot_connected=bool(HUBSPOT_CONFIG["api_key"])
     )
@@ -1006,24 +1297,24 @@ def bulk_request_consent():
     
     if target == 'not_set':
         # Get all contacts without consent
-        contacts = manager.hubspot.get_contacts_without_consent()
-        contact_ids = [c["id"] for c in contacts.get("results", [])]
+        contact_ids = CONSENT_SNAPSHOT.ids("NOT_SET")
     elif target == 'pending':
-        contacts = manager.hubspot.get_contacts_by_consent_status(CONSENT_STATUS["PENDING"])
-        contact_ids = [c["id"] for c in contacts.get("results", [])]
-    
-    results = manager.bulk_request_consent(contact_ids)
-    sent = len([r for r in results if r.get("success")])
+        contact_ids = CONSENT_SNAPSHOT.ids("PENDING")
     
-    return jsonify({"sent": sent, "total": len(contact_ids), "results": results})
+    # NDJSON: eine Fortschrittszeile pro Chunk, die letzte mit done=true
+    lines = (json.dumps(progress) + "\n" for progress in manager.bulk_request_consent(contact_ids))
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
 
 @whatsapp_consent_bp.route('/sync')
 def sync_contacts():
     """Sync contacts from HubSpot"""
     manager = ConsentManager()
-    contacts = manager.sync_consent_from_hubspot()
+    try:
+        stats = manager.sync_consent_from_hubspot(full=request.args.get('full') == '1')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 502
     
-    return jsonify({"contacts": len(contacts), "data": contacts[:20]})
+    return jsonify({"contacts": stats["fetched"], **stats})
 
 @whatsapp_consent_bp.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -1075,6 +1366,8 @@ def update_status():
     
     hubspot = HubSpotClient()
     result = hubspot.update_whatsapp_consent(contact_id, status)
+    if "error" not in result:
+        CONSENT_SNAPSHOT.mark([(contact_id, status)])
     
     return jsonify(result)
 
@@ -1089,27 +1382,31 @@ def bulk_update():
     
     hubspot = HubSpotClient()
     result = hubspot.bulk_update_consent(updates)
+    if "error" not in result:
+        CONSENT_SNAPSHOT.mark((u["id"], u["status"]) for u in updates)
     
     return jsonify(result)
 
 @whatsapp_consent_bp.route('/export')
 def export_consent():
-    """Export consent data as CSV"""
-    manager = ConsentManager()
-    contacts = manager.sync_consent_from_hubspot()
-    
-    # Build CSV
-    csv_lines = ["ID,Vorname,Nachname,Telefon,Status,Datum"]
-    for c in contacts:
-        props = c.get("properties", {})
-        csv_lines.append(f"{c.get('id')},{props.get('firstname','')},{props.get('lastname','')},{props.get('hs_whatsapp_phone_number','')},{c.get('consent_status','')},{props.get('hs_whatsapp_consent_date','')}")
+    """Export consent data as CSV (streamed, ?gzip=1 for .csv.gz)"""
+    def rows():
+        for row in CONSENT_SNAPSHOT.iter_rows():
+            yield [
+                row.hubspot_id,
+                row.first_name or '',
+                row.last_name or '',
+                row.phone or '',
+                row.status,
+                row.consent_date or ''
+            ]
     
-    csv_content = "\n".join(csv_lines)
-    
-    return csv_content, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename=whatsapp_consent_{datetime.now().strftime("%Y%m%d")}.csv'
-    }
+    return csv_response(
+        f'whatsapp_consent_{datetime.now().strftime("%Y%m%d")}.csv',
+        ["ID", "Vorname", "Nachname", "Telefon", "Status", "Datum"],
+        rows(),
+        compress=wants_gzip(request.args)
+    )
 
 @whatsapp_consent_bp.route('/config', methods=['GET', 'POST'])
 def api_config():
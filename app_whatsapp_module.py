@@ -5,18 +5,31 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
-from flask import Blueprint, render_template_string, request, jsonify, session
+from flask import Blueprint, current_app, render_template_string, request, jsonify, session
 from datetime import datetime, timedelta
 import json
 import random
 import hashlib
 import os
+import threading
+import time
+import uuid
+
+from sqlalchemy import select, insert, update
+
+from message_templates import compile_template
+from westmoney_db import get_db, get_table
+from whatsapp_transport import build_message, get_transport
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 
 # Store OTPs temporarily (in production: use Redis)
 otp_store = {}
 
+# Broadcast-Status liegt in whatsapp_broadcasts - jeder Worker kann ihn abfragen
+BROADCAST_BATCH = 1000
+BROADCAST_PROGRESS_SECONDS = 5  # Fortschritt höchstens so oft schreiben
+
 WHATSAPP_HTML = """
 <!DOCTYPE html>
 <html lang="de">
@@ -768,26 +781,142 @@ def send_whatsapp():
 
 @whatsapp_bp.route('/api/whatsapp/broadcast', methods=['POST'])
 def send_broadcast():
-    """Send broadcast message"""
-    data = request.json
+    """Send broadcast message to opted-in contacts (runs in the background)"""
+    data = request.json or {}
     recipients = data.get('recipients', 'all_consent')
-    message = data.get('message')
+    template = data.get('template')
+    parameters = data.get('parameters') or []
     
-    # Get recipient count based on filter
-    counts = {
-        'all_consent': 892,
-        'hot_leads': 34,
-        'customers': 156,
-        'custom': 50
-    }
+    if recipients not in ('all_consent', 'hot_leads', 'customers', 'custom'):
+        return jsonify({'success': False, 'error': 'Unbekannte Empfängergruppe'}), 400
+    # Geschäftsinitiierte Nachrichten außerhalb des 24h-Fensters nimmt Meta nur als Template an
+    if not template or not isinstance(template, str):
+        return jsonify({'success': False, 'error': 'Freigegebenes Template erforderlich'}), 400
+    if not isinstance(parameters, list) or not all(isinstance(p, str) for p in parameters):
+        return jsonify({'success': False, 'error': 'parameters muss eine Liste von Texten sein'}), 400
     
-    count = counts.get(recipients, 0)
+    transport = get_transport()
+    if not transport.configured:
+        return jsonify({'success': False, 'error': 'WhatsApp Token nicht konfiguriert'}), 503
+    
+    broadcast_id = uuid.uuid4().hex[:12]
+    db = get_db()
+    db.session.execute(insert(get_table('whatsapp_broadcasts')).values(
+        id=broadcast_id,
+        user_id=session.get('user_id'),
+        audience=recipients,
+        status='running',
+        sent=0,
+        failed=0,
+        started_at=datetime.utcnow()
+    ))
+    db.session.commit()
+    threading.Thread(
+        target=_run_broadcast, daemon=True, name=f'broadcast-{broadcast_id}',
+        args=(current_app._get_current_object(), broadcast_id, recipients, data.get('contact_ids') or [],
+              template, parameters, data.get('language', 'de'))
+    ).start()
     
     return jsonify({
         'success': True,
-        'message': f'Broadcast an {count} Empfänger gestartet',
-        'count': count
-    })
+        'message': 'Broadcast gestartet',
+        'broadcast_id': broadcast_id
+    }), 202
+
+
+@whatsapp_bp.route('/api/whatsapp/broadcast/<broadcast_id>', methods=['GET'])
+def broadcast_status(broadcast_id):
+    """Progress and result report of a broadcast"""
+    table = get_table('whatsapp_broadcasts')
+    row = get_db().session.execute(select(table).where(table.c.id == broadcast_id)).mappings().first()
+    if row is None:
+        return jsonify({'success': False, 'error': 'Broadcast nicht gefunden'}), 404
+    
+    status = dict(row)
+    status.update(json.loads(status.pop('report') or '{}'))
+    for key in ('started_at', 'updated_at', 'completed_at'):
+        if status[key]:
+            status[key] = status[key].isoformat()
+    return jsonify({'success': True, 'broadcast_id': broadcast_id, **status})
+
+
+def broadcast_recipients(recipients, contact_ids=()):
+    """Keyset-stream of opted-in contacts with a phone number"""
+    contacts = get_table('contacts')
+    leads = get_table('leads')
+    db = get_db()
+    
+    query = select(
+        contacts.c.id, contacts.c.phone, contacts.c.first_name, contacts.c.last_name, contacts.c.company
+    ).where(
+        contacts.c.whatsapp_consent == 'yes',
+        contacts.c.phone.isnot(None),
+        contacts.c.phone != ''
+    ).order_by(contacts.c.id).limit(BROADCAST_BATCH)
+    
+    if recipients == 'hot_leads':
+        query = query.where(contacts.c.id.in_(select(leads.c.contact_id).where(leads.c.temperature == 'hot')))
+    elif recipients == 'customers':
+        query = query.where(contacts.c.id.in_(select(leads.c.contact_id).where(leads.c.stage == 'won')))
+    elif recipients == 'custom':
+        query = query.where(contacts.c.id.in_([int(i) for i in contact_ids]))
+    
+    after_id = 0
+    while True:
+        rows = db.session.execute(query.where(contacts.c.id > after_id)).all()
+        if not rows:
+            return
+        yield from rows
+        after_id = rows[-1].id
+
+
+def _run_broadcast(app, broadcast_id, recipients, contact_ids, template, parameters, language):
+    # parameters füllen {{1}}, {{2}}, ... im Template-Body, je Kontakt gerendert
+    compiled = [compile_template(parameter) for parameter in parameters]
+    counts = {'sent': 0, 'failed': 0}
+    counts_lock = threading.Lock()
+    flushed = [time.monotonic()]
+    
+    def save(**values):
+        with counts_lock:
+            values.update(counts)
+        table = get_table('whatsapp_broadcasts')
+        db = get_db()
+        db.session.execute(
+            update(table).where(table.c.id == broadcast_id).values(updated_at=datetime.utcnow(), **values)
+        )
+        db.session.commit()
+    
+    def payloads():
+        # Läuft im Broadcast-Thread (App-Kontext) - hier auch den Fortschritt schreiben
+        for contact in broadcast_recipients(recipients, contact_ids):
+            if time.monotonic() - flushed[0] > BROADCAST_PROGRESS_SECONDS:
+                flushed[0] = time.monotonic()
+                save()
+            context = {
+                'name': f"{contact.first_name or ''} {contact.last_name or ''}".strip(),
+                'first_name': contact.first_name or '',
+                'last_name': contact.last_name or '',
+                'company': contact.company or ''
+            }
+            components = [{'type': 'body', 'parameters': [
+                {'type': 'text', 'text': parameter.render(context)} for parameter in compiled
+            ]}] if compiled else []
+            yield build_message(contact.phone, 'template', template_name=template, language=language,
+                                components=components)
+    
+    def on_result(payload, result):
+        with counts_lock:
+            counts['failed' if 'error' in result else 'sent'] += 1
+    
+    with app.app_context():
+        try:
+            report = get_transport().send_many(payloads(), on_result=on_result)
+            save(status='completed', total=report.pop('total'), report=json.dumps(report),
+                 completed_at=datetime.utcnow())
+        except Exception as e:
+            get_db().session.rollback()
+            save(status='failed', error=str(e)[:500])
 
 
 @whatsapp_bp.route('/api/whatsapp/consent/<int:contact_id>', methods=['POST'])
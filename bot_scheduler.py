@@ -4,7 +4,7 @@
 Hintergrund-Automatisierung für alle AI Bots
 
 Bots:
-- LeadScoringBot: Alle 30 Minuten
+- LeadScoringBot: Täglich um 03:00 (Scores laufen pro Event mit)
 - FollowUpBot: Alle 60 Minuten  
 - SyncBot: Alle 5 Minuten
 - RecurringBillingBot: Täglich um 00:00
@@ -37,7 +37,8 @@ logger = logging.getLogger('WestMoneyBots')
 def run_lead_scoring():
     """Run Lead Scoring Bot"""
     try:
-        from app import app, LeadScoringBot
+        from app_main import app
+        from app_broly_automation import LeadScoringBot
         with app.app_context():
             logger.info("🎯 Running LeadScoringBot...")
             result = LeadScoringBot.run()
@@ -59,7 +60,8 @@ def run_follow_up():
 def run_sync():
     """Run Sync Bot (HubSpot)"""
     try:
-        from app import app, SyncBot
+        from app_main import app
+        from app_hubspot_crm import SyncBot
         with app.app_context():
             logger.info("🔄 Running SyncBot...")
             result = SyncBot.run()
@@ -82,6 +84,16 @@ def run_recurring_billing():
     except Exception as e:
         logger.error(f"❌ RecurringBilling error: {e}")
 
+def start_automation_executor():
+    """Run due automation steps (waits, follow-ups) in this process"""
+    try:
+        from app_main import app
+        from app_broly_automation import start_action_executor
+        start_action_executor(app)
+        logger.info("⚙️ Automation executor started")
+    except Exception as e:
+        logger.error(f"❌ Automation executor error: {e}")
+
 def run_all_bots():
     """Run all bots immediately"""
     logger.info("🚀 Running ALL BOTS...")
@@ -104,7 +116,7 @@ def start_scheduler():
     # Add jobs
     scheduler.add_job(
         run_lead_scoring,
-        IntervalTrigger(minutes=30),
+        CronTrigger(hour=3, minute=0),  # Zerfall für Sortierung materialisieren
         id='lead_scoring',
         name='Lead Scoring Bot',
         replace_existing=True
@@ -149,7 +161,7 @@ if __name__ == '__main__':
     ║  BROLY ULTRA GODMODE - Background Automation              ║
     ╠═══════════════════════════════════════════════════════════╣
     ║  Bots:                                                    ║
-    ║  • LeadScoringBot    - Every 30 minutes                   ║
+    ║  • LeadScoringBot    - Daily at 03:00                     ║
     ║  • FollowUpBot       - Every 60 minutes                   ║
     ║  • SyncBot           - Every 5 minutes                    ║
     ║  • RecurringBilling  - Daily at 00:00                     ║
@@ -161,6 +173,7 @@ if __name__ == '__main__':
     
     # Start scheduler
     scheduler = start_scheduler()
+    start_automation_executor()
     
     try:
         # Keep running
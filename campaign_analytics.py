@@ -0,0 +1,275 @@
+"""
+West Money OS - Campaign Analytics
+==================================
+Vorberechnete Kampagnen-Kennzahlen aus dem Event-Strom (campaign_events).
+
+- Zähler pro Kampagne, Kanal und Stunde in campaign_rollups
+  (sent, delivered, opened, clicked, replied, bounced, unsubscribed,
+  converted, failed)
+- record() fasst einen Micro-Batch von Events im Speicher zusammen und
+  schreibt pro Bucket genau ein UPDATE/INSERT - in derselben Transaktion
+  wie die Events, damit Rollups und Events nie auseinanderlaufen
+- Auswertungen (Dashboard, /api/broly/analytics, Kampagnen-Statistik) lesen
+  nur die Buckets - nie die Event-Tabelle
+- rebuild() baut die Rollups einmalig aus campaign_events neu auf
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, update, delete, bindparam, func
+from sqlalchemy.exc import IntegrityError
+
+from westmoney_db import get_db, get_table
+
+COUNTERS = ('sent', 'delivered', 'opened', 'clicked', 'replied',
+            'bounced', 'unsubscribed', 'converted', 'failed')
+
+# Event-Typen der Provider/Webhooks -> Zähler
+EVENT_COUNTERS = {
+    'sent': 'sent',
+    'delivered': 'delivered',
+    'delivery': 'delivered',
+    'open': 'opened',
+    'opened': 'opened',
+    'click': 'clicked',
+    'clicked': 'clicked',
+    'reply': 'replied',
+    'replied': 'replied',
+    'bounce': 'bounced',
+    'bounced': 'bounced',
+    'unsubscribe': 'unsubscribed',
+    'unsubscribed': 'unsubscribed',
+    'converted': 'converted',
+    'conversion': 'converted',
+    'failed': 'failed',
+    'dropped': 'failed'
+}
+
+PERIODS = {'24h': timedelta(hours=24), '7d': timedelta(days=7),
+           '30d': timedelta(days=30), '90d': timedelta(days=90)}
+
+KEY_CHUNK = 200  # Bucket-Schlüssel pro Abfrage auf bestehende Zeilen
+REBUILD_BATCH = 5000
+
+
+def hour_bucket(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def parse_period(period):
+    """'7d' / '24h' / '30d' -> timedelta (unknown values fall back to 7 days)"""
+    if period in PERIODS:
+        return PERIODS[period]
+    try:
+        amount, unit = int(period[:-1]), period[-1]
+    except (TypeError, ValueError, IndexError):
+        return PERIODS['7d']
+    if unit == 'h':
+        return timedelta(hours=amount)
+    if unit == 'd':
+        return timedelta(days=amount)
+    return PERIODS['7d']
+
+
+def rates(counters):
+    """Percentages relative to sent messages"""
+    sent = counters.get('sent') or 0
+
+    def rate(name):
+        return round(100.0 * counters.get(name, 0) / sent, 1) if sent else 0.0
+
+    return {
+        'delivery_rate': rate('delivered'),
+        'open_rate': rate('opened'),
+        'click_rate': rate('clicked'),
+        'reply_rate': rate('replied'),
+        'bounce_rate': rate('bounced'),
+        'conversion_rate': rate('converted')
+    }
+
+
+class CampaignRollups:
+    """Hourly counters per campaign and channel"""
+
+    def __init__(self):
+        self._update_stmt = None
+
+    # ------------------------------------------------------------------
+    # Schreiben
+    # ------------------------------------------------------------------
+
+    def record(self, events):
+        """Fold campaign_events rows (dicts) into the rollups - caller commits"""
+        counts = defaultdict(Counter)
+        for event in events:
+            counter = EVENT_COUNTERS.get(event.get('event_type'))
+            if counter is None or not event.get('campaign_id'):
+                continue
+            timestamp = event.get('timestamp') or datetime.utcnow()
+            key = (event['campaign_id'], event.get('channel') or 'email', hour_bucket(timestamp))
+            counts[key][counter] += 1
+        if counts:
+            self.apply(counts)
+        return len(counts)
+
+    def apply(self, counts):
+        """Add {(campaign_id, channel, bucket): Counter} to the table"""
+        table = get_table('campaign_rollups')
+        db = get_db()
+
+        while counts:
+            existing = self._existing_keys(table, list(counts))
+            updates = [self._params(key, delta) for key, delta in counts.items() if key in existing]
+            if updates:
+                db.session.execute(self._update(table), updates)
+
+            new = {key: delta for key, delta in counts.items() if key not in existing}
+            if not new:
+                return
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(table), [
+                        {'campaign_id': key[0], 'channel': key[1], 'bucket': key[2],
+                         **{name: delta.get(name, 0) for name in COUNTERS}}
+                        for key, delta in new.items()
+                    ])
+                return
+            except IntegrityError:
+                # Parallel angelegt - die neuen Buckets erneut als Update versuchen
+                counts = new
+
+    def _existing_keys(self, table, keys):
+        existing = set()
+        for start in range(0, len(keys), KEY_CHUNK):
+            chunk = keys[start:start + KEY_CHUNK]
+            rows = get_db().session.execute(
+                select(table.c.campaign_id, table.c.channel, table.c.bucket).where(
+                    table.c.campaign_id.in_({key[0] for key in chunk}),
+                    table.c.bucket.in_({key[2] for key in chunk})
+                )
+            )
+            existing.update(tuple(row) for row in rows)
+        return existing
+
+    def _update(self, table):
+        if self._update_stmt is None or self._update_stmt.table is not table:
+            self._update_stmt = (
+                update(table)
+                .where(
+                    table.c.campaign_id == bindparam('key_campaign_id'),
+                    table.c.channel == bindparam('key_channel'),
+                    table.c.bucket == bindparam('key_bucket')
+                )
+                .values({name: table.c[name] + bindparam(f'add_{name}') for name in COUNTERS})
+            )
+        return self._update_stmt
+
+    @staticmethod
+    def _params(key, delta):
+        params = {'key_campaign_id': key[0], 'key_channel': key[1], 'key_bucket': key[2]}
+        params.update({f'add_{name}': delta.get(name, 0) for name in COUNTERS})
+        return params
+
+    def rebuild(self, campaign_id=None):
+        """Recompute rollups from campaign_events (backfill) - commits"""
+        table = get_table('campaign_rollups')
+        events = get_table('campaign_events')
+        db = get_db()
+
+        cleanup = delete(table)
+        if campaign_id is not None:
+            cleanup = cleanup.where(table.c.campaign_id == campaign_id)
+        db.session.execute(cleanup)
+
+        counts = defaultdict(Counter)
+        after_id = 0
+        processed = 0
+        while True:
+            query = (
+                select(events.c.id, events.c.campaign_id, events.c.channel,
+                       events.c.event_type, events.c.timestamp)
+                .where(events.c.id > after_id, events.c.campaign_id.isnot(None))
+                .order_by(events.c.id)
+                .limit(REBUILD_BATCH)
+            )
+            if campaign_id is not None:
+                query = query.where(events.c.campaign_id == campaign_id)
+            rows = db.session.execute(query).all()
+            if not rows:
+                break
+            for row in rows:
+                counter = EVENT_COUNTERS.get(row.event_type)
+                if counter and row.timestamp:
+                    counts[(row.campaign_id, row.channel or 'email', hour_bucket(row.timestamp))][counter] += 1
+            after_id = rows[-1].id
+            processed += len(rows)
+
+        if counts:
+            self.apply(counts)
+        db.session.commit()
+        return {'events': processed, 'buckets': len(counts)}
+
+    # ------------------------------------------------------------------
+    # Lesen
+    # ------------------------------------------------------------------
+
+    def summary(self, since=None, campaign_id=None):
+        """Totals, per channel and per campaign from the hourly buckets"""
+        table = get_table('campaign_rollups')
+        query = (
+            select(table.c.campaign_id, table.c.channel,
+                   *[func.sum(table.c[name]).label(name) for name in COUNTERS])
+            .group_by(table.c.campaign_id, table.c.channel)
+        )
+        if since is not None:
+            query = query.where(table.c.bucket >= hour_bucket(since))
+        if campaign_id is not None:
+            query = query.where(table.c.campaign_id == campaign_id)
+
+        total = Counter()
+        channels = defaultdict(Counter)
+        campaigns = defaultdict(Counter)
+        for row in get_db().session.execute(query).mappings():
+            values = {name: int(row[name] or 0) for name in COUNTERS}
+            total.update(values)
+            channels[row['channel']].update(values)
+            campaigns[row['campaign_id']].update(values)
+
+        def complete(counter):
+            return {name: counter.get(name, 0) for name in COUNTERS}
+
+        return {
+            'total': complete(total),
+            'channels': {channel: complete(c) for channel, c in channels.items()},
+            'campaigns': {cid: complete(c) for cid, c in campaigns.items()}
+        }
+
+    def timeline(self, campaign_id, since=None):
+        """Hourly counters of one campaign (all channels)"""
+        table = get_table('campaign_rollups')
+        query = (
+            select(table.c.bucket, *[func.sum(table.c[name]).label(name) for name in COUNTERS])
+            .where(table.c.campaign_id == campaign_id)
+            .group_by(table.c.bucket)
+            .order_by(table.c.bucket)
+        )
+        if since is not None:
+            query = query.where(table.c.bucket >= hour_bucket(since))
+        return [
+            {'bucket': row['bucket'].isoformat(), **{name: int(row[name] or 0) for name in COUNTERS}}
+            for row in get_db().session.execute(query).mappings()
+        ]
+
+
+CAMPAIGN_ROLLUPS = CampaignRollups()
+
+
+__all__ = [
+    'CAMPAIGN_ROLLUPS',
+    'CampaignRollups',
+    'COUNTERS',
+    'EVENT_COUNTERS',
+    'parse_period',
+    'rates'
+]
@@ -0,0 +1,562 @@
+"""
+West Money OS - Campaign Dispatcher
+===================================
+Versand-Pipeline für Kampagnen (E-Mail, WhatsApp, SMS), genutzt von
+app_broly_automation und app_campaigns_module.
+
+- Zielgruppe aus Campaign.audience_filter als Keyset-Abfrage über leads
+  (Batch für Batch ab send_cursor - nie die ganze Liste im Speicher)
+- Personalisierung pro Batch über vorkompilierte Templates (message_templates)
+- Gemeinsamer, begrenzter Worker-Pool; pro Kanal ein Token-Bucket
+  (CAMPAIGN_RATE_EMAIL / _WHATSAPP / _SMS Nachrichten pro Sekunde)
+- Pro Kampagne höchstens ein Batch in Arbeit: Pause/Resume greift nach
+  dem laufenden Batch, der Cursor steht dann auf dem letzten Empfänger
+- Kennzahlen pro Kanal: Sends/s (60s-Fenster), Queue-Tiefe, p50/p99-Latenz
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import select, insert, update, and_, or_, func
+
+from campaign_analytics import CAMPAIGN_ROLLUPS
+from message_templates import compile_template
+from rate_limiter import get_bucket
+from westmoney_db import get_db, get_table
+from whatsapp_transport import get_transport
+
+BATCH_SIZE = int(os.environ.get('CAMPAIGN_BATCH_SIZE', '100'))
+WORKERS = int(os.environ.get('CAMPAIGN_SEND_WORKERS', '16'))
+HEARTBEAT_TIMEOUT = 300  # Sekunden ohne Heartbeat -> Kampagne gilt als verwaist
+HEARTBEAT_INTERVAL = HEARTBEAT_TIMEOUT / 5  # auch während eines langsamen Batches
+
+CHANNEL_RATES = {
+    'email': float(os.environ.get('CAMPAIGN_RATE_EMAIL', '10')),
+    'whatsapp': float(os.environ.get('CAMPAIGN_RATE_WHATSAPP', '20')),
+    'sms': float(os.environ.get('CAMPAIGN_RATE_SMS', '1'))
+}
+
+# Kanal, über den eine Kampagne dieses Typs in erster Linie versendet
+PRIMARY_CHANNELS = {'whatsapp': 'whatsapp', 'sms': 'sms'}
+
+FROM_EMAIL = os.environ.get('CAMPAIGN_FROM_EMAIL', 'info@west-money.com')
+WHATSAPP_TEMPLATE_LANGUAGE = os.environ.get('CAMPAIGN_WHATSAPP_LANGUAGE', 'de')
+
+# Zielgruppen aus den Kampagnen-Formularen (Broly + Kampagnen-Modul)
+AUDIENCES = {
+    'hot': ('temperature', 'hot'),
+    'hot_leads': ('temperature', 'hot'),
+    'warm': ('temperature', 'warm'),
+    'warm_leads': ('temperature', 'warm'),
+    'cold': ('temperature', 'cold'),
+    'cold_leads': ('temperature', 'cold'),
+    'new': ('stage', 'new'),
+    'new_contacts': ('stage', 'new'),
+    'customers': ('stage', 'won')
+}
+
+class ChannelNotConfigured(Exception):
+    """Provider credentials for a channel are missing"""
+
+
+# ============================================================================
+# CHANNEL SENDERS
+# ============================================================================
+
+_http = requests.Session()
+
+
+def missing_configuration(channel):
+    """Error message if a channel's provider credentials are missing, else None"""
+    if channel == 'email' and not os.environ.get('SENDGRID_API_KEY'):
+        return 'SENDGRID_API_KEY nicht gesetzt'
+    if channel == 'whatsapp' and not get_transport().configured:
+        return 'WHATSAPP_TOKEN nicht gesetzt'
+    if channel == 'sms' and not (os.environ.get('TWILIO_ACCOUNT_SID') and os.environ.get('TWILIO_AUTH_TOKEN')):
+        return 'TWILIO_ACCOUNT_SID/TWILIO_AUTH_TOKEN nicht gesetzt'
+    return None
+
+
+def channel_problem(channel, campaign):
+    """Why a campaign cannot send on a channel (credentials, WhatsApp template) - None if it can"""
+    missing = missing_configuration(channel)
+    if missing:
+        return missing
+    if channel == 'whatsapp' and not campaign.get('whatsapp_template'):
+        # Geschäftsinitiierte Nachrichten außerhalb des 24h-Fensters lehnt Meta als Freitext ab
+        return 'WhatsApp-Kampagnen brauchen ein freigegebenes Template (whatsapp_template)'
+    return None
+
+
+def send_email(to, subject, body, custom_args=None):
+    api_key = os.environ.get('SENDGRID_API_KEY', '')
+    if not api_key:
+        raise ChannelNotConfigured(missing_configuration('email'))
+    response = _http.post(
+        'https://api.sendgrid.com/v3/mail/send',
+        headers={'Authorization': f'Bearer {api_key}'},
+        json={
+            # custom_args kommen in jedem Event-Webhook zurück (campaign_id, lead_id)
+            'personalizations': [{'to': [{'email': to}], 'custom_args': custom_args or {}}],
+            'from': {'email': FROM_EMAIL},
+            'subject': subject or '',
+            'content': [{'type': 'text/html', 'value': body}]
+        },
+        timeout=15
+    )
+    if response.status_code >= 300:
+        return {'error': f'SendGrid {response.status_code}: {response.text[:200]}'}
+    return {'id': response.headers.get('X-Message-Id')}
+
+
+def send_whatsapp(to, subject, body, custom_args=None):
+    """Template message - subject is the approved template name, body fills {{1}}"""
+    transport = get_transport()
+    if not transport.configured:
+        raise ChannelNotConfigured(missing_configuration('whatsapp'))
+    if not subject:
+        return {'error': 'Kein WhatsApp-Template'}
+    components = [{'type': 'body', 'parameters': [{'type': 'text', 'text': body}]}] if body else []
+    result = transport.send_message(to, 'template', business_initiated=True, template_name=subject,
+                                    language=WHATSAPP_TEMPLATE_LANGUAGE, components=components)
+    if 'error' in result:
+        return {'error': str(result['error'])}
+    return {'id': (result.get('messages') or [{}])[0].get('id')}
+
+
+def send_sms(to, subject, body, custom_args=None):
+    sid = os.environ.get('TWILIO_ACCOUNT_SID', '')
+    token = os.environ.get('TWILIO_AUTH_TOKEN', '')
+    if not sid or not token:
+        raise ChannelNotConfigured(missing_configuration('sms'))
+    response = _http.post(
+        f'https://api.twilio.com/2010-04-01/Accounts/{sid}/Messages.json',
+        auth=(sid, token),
+        data={'To': to, 'From': os.environ.get('TWILIO_PHONE_NUMBER', ''), 'Body': body},
+        timeout=15
+    )
+    if response.status_code >= 300:
+        return {'error': f'Twilio {response.status_code}: {response.text[:200]}'}
+    return {'id': response.json().get('sid')}
+
+
+SENDERS = {
+    'email': send_email,
+    'whatsapp': send_whatsapp,
+    'sms': send_sms
+}
+
+
+# ============================================================================
+# AUDIENCE + RENDERING
+# ============================================================================
+
+def parse_audience_filter(value):
+    """audience_filter (JSON object or plain audience key) -> dict"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return value
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return {'audience': value}
+    return parsed if isinstance(parsed, dict) else {'audience': str(parsed)}
+
+
+def audience_query(audience_filter, after_id, limit):
+    """One keyset page of recipients (leads + consent of the linked contact)"""
+    leads = get_table('leads')
+    contacts = get_table('contacts')
+
+    stmt = (
+        select(
+            leads.c.id, leads.c.first_name, leads.c.last_name, leads.c.email, leads.c.phone,
+            leads.c.company_name, leads.c.job_title, leads.c.stage, leads.c.score,
+            contacts.c.whatsapp_consent
+        )
+        .select_from(leads.outerjoin(contacts, contacts.c.id == leads.c.contact_id))
+        .where(leads.c.id > after_id)
+        .order_by(leads.c.id)
+        .limit(limit)
+    )
+
+    audience = AUDIENCES.get(audience_filter.get('audience'))
+    if audience:
+        stmt = stmt.where(leads.c[audience[0]] == audience[1])
+    if audience_filter.get('stage'):
+        stages = audience_filter['stage']
+        stmt = stmt.where(leads.c.stage.in_(stages if isinstance(stages, list) else [stages]))
+    if audience_filter.get('min_score') is not None:
+        stmt = stmt.where(leads.c.score >= int(audience_filter['min_score']))
+    if audience_filter.get('source'):
+        stmt = stmt.where(leads.c.source == audience_filter['source'])
+    return stmt
+
+
+def recipient_variables(lead):
+    return {
+        'first_name': lead['first_name'] or '',
+        'last_name': lead['last_name'] or '',
+        'name': f"{lead['first_name'] or ''} {lead['last_name'] or ''}".strip(),
+        'email': lead['email'] or '',
+        'phone': lead['phone'] or '',
+        'company': lead['company_name'] or '',
+        'company_name': lead['company_name'] or '',
+        'job_title': lead['job_title'] or ''
+    }
+
+
+def campaign_templates(campaign):
+    """Compiled (subject, content) - from the linked template if there is one"""
+    if campaign['template_id']:
+        templates = get_table('templates')
+        template = get_db().session.execute(
+            select(templates.c.id, templates.c.version, templates.c.subject, templates.c.content)
+            .where(templates.c.id == campaign['template_id'])
+        ).first()
+        if template is not None:
+            return (
+                compile_template(template.subject, template.id, template.version, 'subject'),
+                compile_template(template.content, template.id, template.version, 'content')
+            )
+    return compile_template(campaign['subject']), compile_template(campaign['content'])
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+class ChannelStats:
+    """Counters, 60s send rate and latency percentiles for one channel"""
+
+    WINDOW_SECONDS = 60
+    LATENCY_SAMPLES = 2000
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.queued = 0
+        self._completed = deque()
+        self._latencies = deque(maxlen=self.LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def enqueue(self, n=1):
+        with self._lock:
+            self.queued += n
+
+    def record(self, ok, latency):
+        now = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._completed.append(now)
+            self._latencies.append(latency)
+            self._prune(now)
+
+    def _prune(self, now):
+        # Auch ohne snapshot()-Aufrufe nie mehr als ein Fenster an Zeitstempeln halten
+        while self._completed and now - self._completed[0] > self.WINDOW_SECONDS:
+            self._completed.popleft()
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            latencies = sorted(self._latencies)
+            rate = len(self._completed) / self.WINDOW_SECONDS
+
+            def percentile(p):
+                if not latencies:
+                    return 0.0
+                return round(1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'queue_depth': self.queued,
+                'sends_per_second': round(rate, 2),
+                'latency_p50_ms': percentile(0.50),
+                'latency_p99_ms': percentile(0.99)
+            }
+
+
+# ============================================================================
+# DISPATCHER
+# ============================================================================
+
+class CampaignDispatcher:
+    """Background sending for campaigns with per-channel rate limits"""
+
+    def __init__(self):
+        self.pool = None
+        self._pid = None
+        self._running = {}  # campaign_id -> (Stop-Signal, Thread)
+        self._lock = threading.Lock()
+        self.stats = {channel: ChannelStats() for channel in SENDERS}
+        self.last_error = None
+
+    def _ensure_pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self.pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='campaign-send')
+                    self._running = {}
+                    self._pid = os.getpid()
+
+    def start(self, campaign_id, app):
+        """Start or resume a campaign - returns (ok, message)"""
+        campaigns = get_table('campaigns')
+        db = get_db()
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        token = uuid.uuid4().hex
+
+        result = db.session.execute(
+            update(campaigns)
+            .where(
+                campaigns.c.id == campaign_id,
+                or_(
+                    campaigns.c.status.in_(('draft', 'scheduled', 'paused')),
+                    and_(campaigns.c.status == 'running',
+                         or_(campaigns.c.heartbeat_at.is_(None), campaigns.c.heartbeat_at < stale))
+                )
+            )
+            .values(status='running', dispatch_owner=token, heartbeat_at=now, completed_at=None, last_error=None,
+                    started_at=func.coalesce(campaigns.c.started_at, now))
+        )
+        if result.rowcount == 0:
+            db.session.rollback()
+            status = db.session.execute(
+                select(campaigns.c.status).where(campaigns.c.id == campaign_id)
+            ).scalar()
+            if status is None:
+                return False, 'Kampagne nicht gefunden'
+            return False, f'Kampagne ist bereits {status}'
+        db.session.commit()
+
+        self._ensure_pool()
+        stop = threading.Event()
+        with self._lock:
+            previous = self._running.get(campaign_id)
+            thread = threading.Thread(
+                target=self._run, args=(app, campaign_id, token, stop, previous), daemon=True,
+                name=f'campaign-{campaign_id}'
+            )
+            self._running[campaign_id] = (stop, thread)
+        thread.start()
+        return True, 'Kampagne gestartet'
+
+    def pause(self, campaign_id):
+        """Pause after the batch in progress - returns False if not running"""
+        campaigns = get_table('campaigns')
+        db = get_db()
+        result = db.session.execute(
+            update(campaigns)
+            .where(campaigns.c.id == campaign_id, campaigns.c.status == 'running')
+            .values(status='paused')
+        )
+        db.session.commit()
+        running = self._running.get(campaign_id)
+        if running:
+            running[0].set()
+        return result.rowcount > 0
+
+    def metrics(self):
+        return {
+            'workers': WORKERS,
+            'batch_size': BATCH_SIZE,
+            'rates': CHANNEL_RATES,
+            'running': sorted(self._running),
+            'channels': {channel: stats.snapshot() for channel, stats in self.stats.items()},
+            'last_error': self.last_error
+        }
+
+    def _run(self, app, campaign_id, token, stop, previous):
+        # Resume direkt nach Pause: erst den laufenden Batch des alten Threads abwarten
+        if previous is not None:
+            previous[1].join()
+        with app.app_context():
+            try:
+                self._dispatch(campaign_id, token, stop)
+            except Exception as e:
+                get_db().session.rollback()
+                self.last_error = f'Kampagne {campaign_id}: {e}'
+            finally:
+                with self._lock:
+                    if self._running.get(campaign_id, (None,))[0] is stop:
+                        del self._running[campaign_id]
+
+    def _dispatch(self, campaign_id, token, stop):
+        db = get_db()
+        campaigns = get_table('campaigns')
+        events = get_table('campaign_events')
+
+        campaign = db.session.execute(
+            select(campaigns).where(campaigns.c.id == campaign_id)
+        ).mappings().first()
+        audience_filter = parse_audience_filter(campaign['audience_filter'])
+        subject_template, content_template = campaign_templates(campaign)
+        cursor = campaign['send_cursor'] or 0
+
+        # Fehlende Zugangsdaten/Templates: pausieren statt die Zielgruppe als "failed" zu verbrauchen
+        missing = channel_problem(PRIMARY_CHANNELS.get(campaign['type'], 'email'), campaign)
+        if missing:
+            self._halt(campaign_id, token, missing)
+            return
+
+        while not stop.is_set():
+            recipients = db.session.execute(audience_query(audience_filter, cursor, BATCH_SIZE)).mappings().all()
+            if not recipients:
+                db.session.execute(
+                    update(campaigns)
+                    .where(campaigns.c.id == campaign_id, campaigns.c.status == 'running')
+                    .values(status='completed', completed_at=datetime.utcnow())
+                )
+                db.session.commit()
+                return
+
+            targets = []
+            for lead in recipients:
+                channel, address = self._resolve_channel(campaign['type'], lead)
+                if address:
+                    targets.append((lead, channel, address))
+            variables = [recipient_variables(lead) for lead, _, _ in targets]
+            subjects = subject_template.render_many(variables)
+            bodies = content_template.render_many(variables)
+            # WhatsApp hat keinen Betreff - an seiner Stelle geht der Template-Name an send_whatsapp
+            jobs = [(lead['id'], channel, address,
+                     campaign['whatsapp_template'] if channel == 'whatsapp' else subject, body)
+                    for (lead, channel, address), subject, body in zip(targets, subjects, bodies)]
+
+            # Fallback-Kanal (z.B. WhatsApp in multi_channel) vor dem Versand prüfen -
+            # der Batch geht ganz oder gar nicht raus, der Cursor bleibt stehen
+            for channel in sorted({channel for _, channel, *_ in jobs}):
+                missing = channel_problem(channel, campaign)
+                if missing:
+                    self._halt(campaign_id, token, missing)
+                    return
+
+            for _, channel, *_ in jobs:
+                self.stats[channel].enqueue()
+            futures = [
+                self.pool.submit(self._send, channel, address, subject, body,
+                                 {'campaign_id': str(campaign_id), 'lead_id': str(lead_id)})
+                for lead_id, channel, address, subject, body in jobs
+            ]
+            # Ein Batch mit SMS zu 1/s dauert länger als HEARTBEAT_TIMEOUT - ohne
+            # Heartbeat zwischendurch würde ein anderer Prozess übernehmen und doppelt senden
+            pending = futures
+            while pending:
+                pending = wait(pending, timeout=HEARTBEAT_INTERVAL).not_done
+                if pending:
+                    self._heartbeat(campaign_id, token)
+
+            now = datetime.utcnow()
+            rows = []
+            for (lead_id, channel, *_), future in zip(jobs, futures):
+                try:
+                    error = future.result()
+                except Exception as e:  # nie Ergebnisse bereits versendeter Nachrichten verwerfen
+                    error = str(e) or type(e).__name__
+                rows.append({
+                    'campaign_id': campaign_id,
+                    'lead_id': lead_id,
+                    'event_type': 'failed' if error else 'sent',
+                    'channel': channel,
+                    'metadata': json.dumps({'error': error}) if error else None,
+                    'timestamp': now
+                })
+
+            cursor = recipients[-1]['id']
+            sent = sum(1 for row in rows if row['event_type'] == 'sent')
+            if rows:
+                db.session.execute(insert(events), rows)
+                CAMPAIGN_ROLLUPS.record(rows)
+            db.session.execute(
+                update(campaigns).where(campaigns.c.id == campaign_id).values(
+                    sent_count=func.coalesce(campaigns.c.sent_count, 0) + sent,
+                    failed_count=func.coalesce(campaigns.c.failed_count, 0) + len(rows) - sent,
+                    send_cursor=cursor,
+                    heartbeat_at=now
+                )
+            )
+            # In einem anderen Prozess pausiert oder neu gestartet?
+            status, owner = db.session.execute(
+                select(campaigns.c.status, campaigns.c.dispatch_owner).where(campaigns.c.id == campaign_id)
+            ).one()
+            db.session.commit()
+            if status != 'running' or owner != token:
+                return
+
+    def _heartbeat(self, campaign_id, token):
+        campaigns = get_table('campaigns')
+        db = get_db()
+        db.session.execute(
+            update(campaigns)
+            .where(campaigns.c.id == campaign_id, campaigns.c.dispatch_owner == token)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _halt(self, campaign_id, token, error):
+        """Pause a campaign this thread owns and keep the reason"""
+        campaigns = get_table('campaigns')
+        db = get_db()
+        db.session.execute(
+            update(campaigns)
+            .where(campaigns.c.id == campaign_id, campaigns.c.status == 'running',
+                   campaigns.c.dispatch_owner == token)
+            .values(status='paused', last_error=error[:500])
+        )
+        db.session.commit()
+        self.last_error = f'Kampagne {campaign_id}: {error}'
+
+    @staticmethod
+    def _resolve_channel(campaign_type, lead):
+        """(channel, address) - WhatsApp only with consent of the linked contact"""
+        whatsapp_ok = lead['phone'] and lead['whatsapp_consent'] == 'yes'
+        if campaign_type == 'whatsapp':
+            return 'whatsapp', lead['phone'] if whatsapp_ok else None
+        if campaign_type == 'sms':
+            return 'sms', lead['phone']
+        if campaign_type in ('multi_channel', 'sequence') and not lead['email'] and whatsapp_ok:
+            return 'whatsapp', lead['phone']
+        return 'email', lead['email']
+
+    def _send(self, channel, address, subject, body, custom_args):
+        """Rate-limited send - returns error message or None"""
+        get_bucket('campaign', channel, CHANNEL_RATES[channel], max(1, CHANNEL_RATES[channel])).acquire()
+        started = time.monotonic()
+        try:
+            result = SENDERS[channel](address, subject, body, custom_args)
+            error = result.get('error')
+        except Exception as e:
+            # Auch Parse-Fehler der Provider-Antwort: die Nachricht ist evtl. schon raus,
+            # der Batch muss trotzdem protokolliert und der Cursor weitergesetzt werden
+            error = str(e) or type(e).__name__
+        self.stats[channel].record(error is None, time.monotonic() - started)
+        return error
+
+
+CAMPAIGN_DISPATCHER = CampaignDispatcher()
+
+
+__all__ = [
+    'CAMPAIGN_DISPATCHER',
+    'CampaignDispatcher',
+    'ChannelNotConfigured',
+    'SENDERS',
+    'campaign_templates',
+    'parse_audience_filter'
+]
@@ -21,6 +21,8 @@ sudo chown -R $USER:$USER $APP_DIR
 echo ""
 echo "📋 Copying files..."
 cp app.py $APP_DIR/
+cp hubspot_transport.py $APP_DIR/
+cp rate_limiter.py $APP_DIR/
 cp requirements.txt $APP_DIR/
 cp .env $APP_DIR/ 2>/dev/null || cp .env.example $APP_DIR/.env
 
@@ -0,0 +1,211 @@
+"""
+West Money OS - HubSpot Transport
+=================================
+Gemeinsame HTTP-Schicht für alle HubSpot-Clients:
+- Ein requests.Session pro Prozess (Keep-Alive, TLS-Handshake nur einmal)
+- HTTPAdapter mit festem Pool pro Host (pool_block = harte Obergrenze)
+- Retry mit exponentiellem Backoff auf 5xx (nur idempotente Methoden)
+- Token-Bucket pro API-Key (rate_limiter): 429 + Retry-After pausiert den
+  Bucket für alle Threads, Remaining-Header kalibrieren den Bucket nach
+
+Genutzt von app_hubspot_crm.HubSpotClient, app_whatsapp_consent.HubSpotClient
+sowie HubSpotAPI in app.py und westmoney_ultimate.py.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limiter import get_bucket, key_fingerprint
+
+HUBSPOT_BASE_URL = 'https://api.hubapi.com'
+
+# Verbindungen pro Host - HubSpot erlaubt ~10-19 parallele Requests pro App
+POOL_MAXSIZE = int(os.environ.get('HUBSPOT_POOL_SIZE', '10'))
+POOL_CONNECTIONS = 4  # Anzahl Host-Pools (api.hubapi.com + Redirect-Ziele)
+
+MAX_RETRIES = int(os.environ.get('HUBSPOT_MAX_RETRIES', '4'))
+BACKOFF_FACTOR = 0.5  # 0.5s, 1s, 2s, 4s
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+# HubSpot Private Apps: 100 Requests / 10 Sekunden (Pro/Enterprise: 190).
+# Ein Token-Bucket lässt in einem Fenster BURST + RATE * Fenster Requests
+# durch - die Rate wird so gewählt, dass das Fensterlimit nie überschritten wird
+WINDOW_LIMIT = int(os.environ.get('HUBSPOT_RATE_LIMIT', '100'))
+WINDOW_SECONDS = 10
+BURST = int(os.environ.get('HUBSPOT_RATE_BURST', '10'))
+RATE_PER_SECOND = max(1.0, (WINDOW_LIMIT - BURST) / WINDOW_SECONDS)
+DEFAULT_RETRY_AFTER = 10.0  # Sekunden, falls HubSpot keinen Header schickt
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read)
+
+
+class HubSpotRateLimitError(requests.exceptions.RequestException):
+    """Daily API limit exhausted - no request was sent"""
+
+
+def _build_session():
+    # 429 wird nicht hier, sondern über den Rate Limiter behandelt (siehe
+    # hubspot_request), damit alle Threads pausieren statt nur der eine
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,  # Read-Timeouts nicht blind wiederholen
+        status=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=IDEMPOTENT_METHODS,  # 5xx auf POST (create) könnte schon angelegt haben
+        respect_retry_after_header=False,  # sonst wiederholt urllib3 429 selbst
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=True,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Content-Type': 'application/json',
+        'Connection': 'keep-alive'
+    })
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session (recreated after fork, e.g. gunicorn)"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+class HubSpotRateLimiter:
+    """Per-API-key limiter: token bucket + daily quota from response headers"""
+
+    def __init__(self, api_key):
+        self.key_id = key_fingerprint(api_key)
+        self.bucket = get_bucket('hubspot', self.key_id, RATE_PER_SECOND, BURST)
+        self.daily_remaining = None
+        self.daily_date = None
+        self.rate_limited = 0
+
+    def acquire(self):
+        if self.daily_remaining == 0 and self.daily_date == _utc_today():
+            raise HubSpotRateLimitError('HubSpot Tageslimit erreicht')
+        self.bucket.acquire()
+
+    def observe(self, response):
+        """Calibrate from X-HubSpot-RateLimit-* headers"""
+        headers = response.headers
+        remaining = headers.get('X-HubSpot-RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            self.bucket.limit_tokens(int(remaining))
+
+        daily = headers.get('X-HubSpot-RateLimit-Daily-Remaining')
+        if daily is not None and daily.isdigit():
+            self.daily_remaining = int(daily)
+            self.daily_date = _utc_today()
+
+        if response.status_code == 429:
+            self.rate_limited += 1
+            self.bucket.pause(_retry_after_seconds(response))
+
+    def metrics(self):
+        metrics = self.bucket.metrics()
+        metrics.update({
+            'key': self.key_id,
+            'daily_remaining': self.daily_remaining,
+            'rate_limited_responses': self.rate_limited
+        })
+        return metrics
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key):
+    """Process-wide limiter for an API key"""
+    limiter = _limiters.get(api_key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(api_key, HubSpotRateLimiter(api_key))
+    return limiter
+
+
+def rate_limit_metrics():
+    """Metrics of all HubSpot limiters in this process"""
+    with _limiters_lock:
+        return [limiter.metrics() for limiter in _limiters.values()]
+
+
+def _utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def _retry_after_seconds(response):
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    # HubSpot liefert bei 10-Sekunden-Limits oft kein Retry-After
+    interval = response.headers.get('X-HubSpot-RateLimit-Interval-Milliseconds')
+    if interval and interval.isdigit():
+        return int(interval) / 1000
+    return DEFAULT_RETRY_AFTER
+
+
+def hubspot_request(method, path, api_key, params=None, json=None, timeout=DEFAULT_TIMEOUT):
+    """Send a rate-limited request to the HubSpot API - returns requests.Response
+
+    Bei 429 wird der Bucket für alle Threads pausiert und der Request
+    nach Ablauf von Retry-After erneut gesendet (max. MAX_RETRIES mal).
+    """
+    url = path if path.startswith('http') else f'{HUBSPOT_BASE_URL}{path}'
+    limiter = get_rate_limiter(api_key)
+
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        response = get_session().request(
+            method=method,
+            url=url,
+            headers={'Authorization': f'Bearer {api_key}'},
+            params=params,
+            json=json,
+            timeout=timeout
+        )
+        limiter.observe(response)
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            return response
+
+    return response
+
+
+__all__ = [
+    'HUBSPOT_BASE_URL',
+    'HubSpotRateLimitError',
+    'get_session',
+    'get_rate_limiter',
+    'rate_limit_metrics',
+    'hubspot_request'
+]
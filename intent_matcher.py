@@ -0,0 +1,131 @@
+"""
+West Money OS - Intent Matcher
+==============================
+Schlüsselwort-Erkennung für Auto-Replies (whatsapp_webhook) und den AI-Chat
+(app_ai_chat_module) - ein Aho-Corasick-Automat, einmal beim Import gebaut.
+
+- Ein Durchlauf über den Text findet alle Keywords aller Intents gleichzeitig,
+  unabhängig davon, wie viele Keywords registriert sind
+- Wortgrenzen pro Keyword: 'word' (ganzes Wort), 'prefix' (Wortanfang -
+  erfasst deutsche Komposita und Endungen: "preis" -> "Preisanfrage"),
+  'any' (beliebige Teilzeichenkette)
+- Bester Treffer: Keyword deckt den ganzen Text ab > Priorität des Intents >
+  früheste Position > längstes Keyword
+- Groß-/Kleinschreibung über casefold(), Wortzeichen über isalnum()
+  (Umlaute, nicht-lateinische Schriften)
+"""
+
+from collections import deque, namedtuple
+
+BOUNDARIES = ('word', 'prefix', 'any')
+
+Match = namedtuple('Match', 'intent keyword start end priority')
+
+
+class IntentMatcher:
+    """Multi-keyword intent matcher (Aho-Corasick automaton)"""
+
+    def __init__(self):
+        self._keywords = []  # (keyword, intent, priority, boundary)
+        self._goto = None
+        self._fail = None
+        self._output = None
+
+    def add(self, intent, keywords, priority=0, boundary='prefix'):
+        """Register keywords for an intent - higher priority wins"""
+        if boundary not in BOUNDARIES:
+            raise ValueError(f'Unbekannte Wortgrenze: {boundary}')
+        for keyword in keywords:
+            keyword = keyword.casefold().strip()
+            if keyword:
+                self._keywords.append((keyword, intent, priority, boundary))
+        self._goto = None  # neu kompilieren
+        return self
+
+    def compile(self):
+        """Build the automaton (trie + failure links + merged outputs)"""
+        goto = [{}]
+        output = [[]]
+        for index, (keyword, _, _, _) in enumerate(self._keywords):
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append(index)
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())  # Tiefe 1: Failure-Link auf die Wurzel
+        while queue:
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(char, 0)
+                # Treffer des längsten echten Suffixes erben
+                output[child] = output[child] + output[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = [tuple(self._keywords[i] for i in indices) for indices in output]
+        return self
+
+    def matches(self, text):
+        """All keyword hits that respect their word boundaries"""
+        return self._scan(text.casefold())
+
+    def _scan(self, text):
+        if self._goto is None:
+            self.compile()
+        goto, fail, output = self._goto, self._fail, self._output
+        length = len(text)
+
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if not output[state]:
+                continue
+
+            end = position + 1
+            for keyword, intent, priority, boundary in output[state]:
+                start = end - len(keyword)
+                if boundary != 'any':
+                    if start > 0 and text[start - 1].isalnum() and keyword[0].isalnum():
+                        continue
+                    if (boundary == 'word' and end < length and text[end].isalnum()
+                            and keyword[-1].isalnum()):
+                        continue
+                yield Match(intent, keyword, start, end, priority)
+
+    def match(self, text):
+        """Best match for the text or None"""
+        text = text.casefold()
+        stripped = text.strip()
+        offset = len(text) - len(text.lstrip())
+        best = None
+        best_rank = None
+        for hit in self._scan(text):
+            whole = hit.start == offset and hit.end == offset + len(stripped)
+            rank = (whole, hit.priority, -hit.start, hit.end - hit.start)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = hit, rank
+        return best
+
+    def best(self, text, default=None):
+        """Intent of the best match (or default)"""
+        hit = self.match(text)
+        return hit.intent if hit else default
+
+    def __len__(self):
+        return len(self._keywords)
+
+
+__all__ = ['IntentMatcher', 'Match']
@@ -0,0 +1,151 @@
+"""
+West Money OS - Message Templates
+=================================
+Vorkompilierte {{variable}}-Templates für die Personalisierung von
+Kampagnen, Automationen und Vorlagen (app_broly_automation, campaign_dispatcher).
+
+- Jeder Text wird genau einmal in Literal- und Slot-Segmente zerlegt
+- LRU-Cache pro (Template-ID, Version, Feld) - eine neue Version ersetzt den
+  alten Eintrag, ohne dass ein Invalidieren nötig ist
+- Rendern ist ein einzelnes ''.join über die vorbereitete Segmentliste
+- render_many() personalisiert einen ganzen Versand-Batch in einer Schleife
+- Unbekannte Variablen werden zu einem leeren String
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+TEMPLATE_CACHE_SIZE = int(os.environ.get('TEMPLATE_CACHE_SIZE', '512'))
+
+_VARIABLE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+
+class CompiledTemplate:
+    """Template text split into literals and variable slots"""
+
+    __slots__ = ('source', 'variables', '_parts', '_slots')
+
+    def __init__(self, source):
+        self.source = source or ''
+        parts = []
+        slots = []
+        position = 0
+        for match in _VARIABLE.finditer(self.source):
+            if match.start() > position:
+                parts.append(self.source[position:match.start()])
+            slots.append((len(parts), match.group(1)))
+            parts.append('')
+            position = match.end()
+        if position < len(self.source):
+            parts.append(self.source[position:])
+
+        self._parts = parts
+        self._slots = tuple(slots)
+        # Reihenfolge des ersten Auftretens, ohne Duplikate
+        self.variables = list(dict.fromkeys(name for _, name in slots))
+
+    def render(self, variables):
+        if not self._slots:
+            return self.source
+        parts = self._parts.copy()
+        get = variables.get
+        for index, name in self._slots:
+            value = get(name)
+            parts[index] = '' if value is None else str(value)
+        return ''.join(parts)
+
+    def render_many(self, rows):
+        """Render once per variables mapping - returns a list of strings"""
+        if not self._slots:
+            return [self.source for _ in rows]
+        template_parts = self._parts
+        slots = self._slots
+        rendered = []
+        append = rendered.append
+        for variables in rows:
+            parts = template_parts.copy()
+            get = variables.get
+            for index, name in slots:
+                value = get(name)
+                parts[index] = '' if value is None else str(value)
+            append(''.join(parts))
+        return rendered
+
+    def __repr__(self):
+        return f'<CompiledTemplate {len(self._parts)} segments, variables={self.variables}>'
+
+
+class TemplateCache:
+    """Thread-safe LRU of compiled templates"""
+
+    def __init__(self, maxsize=TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_id, version, field, text):
+        """Compiled template for (id, version, field) - id None caches by the text itself"""
+        key = (template_id, version, field) if template_id is not None else (None, None, text or '')
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None and compiled.source == (text or ''):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+
+        # Kompilieren außerhalb des Locks - doppelt kompilieren ist harmlos
+        compiled = CompiledTemplate(text)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+def compile_template(text, template_id=None, version=None, field='content'):
+    """Cached CompiledTemplate for a text (optionally keyed by template id/version)"""
+    return TEMPLATE_CACHE.get(template_id, version, field, text)
+
+
+def render(text, variables):
+    """Render a {{variable}} text once (compiled form is cached)"""
+    return compile_template(text).render(variables)
+
+
+def render_many(template, rows):
+    """Render a template (text or CompiledTemplate) for many variable mappings"""
+    if not isinstance(template, CompiledTemplate):
+        template = compile_template(template)
+    return template.render_many(rows)
+
+
+__all__ = [
+    'CompiledTemplate',
+    'TemplateCache',
+    'TEMPLATE_CACHE',
+    'compile_template',
+    'render',
+    'render_many'
+]
@@ -0,0 +1,170 @@
+"""
+West Money OS - Phone Index
+===========================
+Einheitliche Telefonnummern (E.164) und ein lokaler Index
+phone_e164 -> HubSpot-Kontakt für Consent-Antworten aus WhatsApp-Webhooks.
+
+- normalize_e164() ersetzt die verstreuten "+49"-Formatierungen
+  (Consent-Anfragen, HubSpot-Updates, ausgehende Anrufe)
+- Ein Eintrag pro (hubspot_id, Property) - phone, mobilephone und
+  hs_whatsapp_phone_number werden einzeln gepflegt, damit Webhook-
+  Teilupdates genau ihre Nummer ersetzen
+- Gepflegt vom HubSpot-Sync (IncrementalSyncEngine, Webhook-Processor) und
+  beim Versand einer Consent-Anfrage
+- lookup() ist eine einzelne Abfrage über ix_phone_index_phone_e164 -
+  kein Remote-Search bei HubSpot
+"""
+
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import select, insert, delete, bindparam
+
+from westmoney_db import get_db, get_table
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY_CODE = os.environ.get('PHONE_DEFAULT_COUNTRY_CODE', '49')
+
+# HubSpot-Properties mit Telefonnummern - Reihenfolge = Vorrang beim Lookup
+PHONE_PROPERTIES = ('hs_whatsapp_phone_number', 'mobilephone', 'phone')
+
+_SEPARATORS = re.compile(r'[\s\-./()]')
+
+
+def normalize_e164(phone, country_code=DEFAULT_COUNTRY_CODE):
+    """'0170 123-4567' / '0049 170…' / '49170…' -> '+49170…' (None if invalid)
+
+    Nationale Nummern (führende 0) und Nummern ohne Vorwahl bekommen die
+    Standard-Ländervorwahl; WhatsApp-IDs (Ländervorwahl ohne '+') bleiben
+    international.
+    """
+    if not phone:
+        return None
+    number = _SEPARATORS.sub('', str(phone).replace('(0)', ''))
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0'):
+        digits = country_code + number.lstrip('0')
+    elif number.startswith(country_code) and len(number) >= 11:
+        digits = number
+    else:
+        digits = country_code + number
+
+    # "+49 0170…" - nationale 0 hinter der Ländervorwahl
+    if digits.startswith(country_code + '0'):
+        digits = country_code + digits[len(country_code):].lstrip('0')
+
+    if not digits.isdigit() or digits[0] == '0' or not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def whatsapp_id(phone):
+    """E.164 number as WhatsApp Cloud API recipient (digits only)"""
+    normalized = normalize_e164(phone)
+    return normalized[1:] if normalized else None
+
+
+class PhoneIndex:
+    """phone_e164 -> hubspot_id / contacts.id"""
+
+    def update(self, records, full=False):
+        """Index HubSpot contacts [(hubspot_id, properties)] - caller commits
+
+        full=True: fehlende Telefon-Properties gelten als gelöscht (vollständig
+        gelesene Objekte); sonst werden nur die übergebenen Properties ersetzt.
+        """
+        changes = {}
+        for hubspot_id, properties in records:
+            for prop in PHONE_PROPERTIES:
+                if full or prop in properties:
+                    changes[(str(hubspot_id), prop)] = normalize_e164(properties.get(prop))
+        if not changes:
+            return 0
+
+        table = get_table('phone_index')
+        session = get_db().session
+        ids = list({hubspot_id for hubspot_id, _ in changes})
+        contacts = get_table('contacts')
+        local = dict(session.execute(
+            select(contacts.c.hubspot_id, contacts.c.id).where(contacts.c.hubspot_id.in_(ids))
+        ).all())
+
+        session.execute(
+            delete(table).where(
+                table.c.hubspot_id == bindparam('key_hubspot_id'),
+                table.c.property == bindparam('key_property')
+            ),
+            [{'key_hubspot_id': hubspot_id, 'key_property': prop} for hubspot_id, prop in changes]
+        )
+        now = datetime.utcnow()
+        rows = [
+            {'hubspot_id': hubspot_id, 'property': prop, 'phone_e164': phone,
+             'contact_id': local.get(hubspot_id), 'updated_at': now}
+            for (hubspot_id, prop), phone in changes.items() if phone
+        ]
+        if rows:
+            session.execute(insert(table), rows)
+        return len(rows)
+
+    def remove(self, hubspot_ids):
+        """Drop all numbers of deleted HubSpot contacts - caller commits"""
+        if hubspot_ids:
+            table = get_table('phone_index')
+            get_db().session.execute(
+                delete(table).where(table.c.hubspot_id.in_([str(i) for i in hubspot_ids]))
+            )
+
+    def remember(self, numbers, prop='hs_whatsapp_phone_number'):
+        """Index [(hubspot_id, phone)] right away (e.g. after consent requests) - commits
+
+        Nie fatal: die Nachrichten sind zu diesem Zeitpunkt schon raus, ein
+        Fehler im Index darf den Request nicht scheitern lassen. Ungültige
+        Nummern werden übersprungen statt einen vorhandenen Eintrag zu löschen.
+        """
+        session = get_db().session
+        try:
+            records = [(hubspot_id, {prop: phone}) for hubspot_id, phone in numbers
+                       if hubspot_id and normalize_e164(phone)]
+            self.update(records)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.warning('Telefon-Index nicht aktualisiert: %s', e)
+
+    def lookup(self, phone):
+        """Contact for a phone number: {'hubspot_id', 'contact_id', 'phone', 'property'} or None"""
+        normalized = normalize_e164(phone)
+        if normalized is None:
+            return None
+        table = get_table('phone_index')
+        rows = get_db().session.execute(
+            select(table.c.hubspot_id, table.c.contact_id, table.c.property, table.c.updated_at)
+            .where(table.c.phone_e164 == normalized)
+        ).all()
+        if not rows:
+            return None
+
+        # WhatsApp-Nummer vor Mobil- vor Festnetznummer, bei Gleichstand die jüngste
+        rows.sort(key=lambda row: row.updated_at or datetime.min, reverse=True)
+        best = min(rows, key=lambda row: PHONE_PROPERTIES.index(row.property)
+                   if row.property in PHONE_PROPERTIES else len(PHONE_PROPERTIES))
+        return {'hubspot_id': best.hubspot_id, 'contact_id': best.contact_id,
+                'phone': normalized, 'property': best.property}
+
+
+PHONE_INDEX = PhoneIndex()
+
+
+__all__ = [
+    'PHONE_INDEX',
+    'PHONE_PROPERTIES',
+    'PhoneIndex',
+    'normalize_e164',
+    'whatsapp_id'
+]
@@ -0,0 +1,145 @@
+"""
+West Money OS - Rate Limiter
+============================
+Prozessweite Token-Buckets für ausgehende API-Calls (HubSpot, WhatsApp,
+E-Mail/SMS-Versand). Ein Bucket pro Schlüssel (API-Key, Telefonnummer,
+Kanal) - alle Threads eines Workers teilen sich denselben Bucket.
+
+- acquire() blockiert, bis ein Token frei ist (optional mit Timeout)
+- pause() sperrt den Bucket z.B. für die Dauer eines Retry-After
+- metrics() liefert Tokens, wartende Threads (Queue-Tiefe) und Zähler
+"""
+
+import hashlib
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket with pause support"""
+
+    def __init__(self, rate, capacity, name=''):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+        self.waiting = 0
+        self.acquired = 0
+        self.throttled = 0
+        self.paused = 0
+        self.wait_seconds = 0.0
+
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        # Während einer Pause sammeln sich keine Tokens an
+        since = max(self.updated, self.blocked_until)
+        if now > since:
+            self.tokens = min(self.capacity, self.tokens + (now - since) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def acquire(self, tokens=1, timeout=None):
+        """Take tokens, waiting as needed - False if timeout expires first"""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+
+        with self._cond:
+            self.waiting += 1
+            throttled = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+
+                    if now >= self.blocked_until and self.tokens >= tokens:
+                        self.tokens -= tokens
+                        self.acquired += 1
+                        self.wait_seconds += now - start
+                        return True
+
+                    wait = max(self.blocked_until - now, (tokens - self.tokens) / self.rate)
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+
+                    if not throttled:
+                        self.throttled += 1
+                        throttled = True
+                    self._cond.wait(wait)
+            finally:
+                self.waiting -= 1
+
+    def pause(self, seconds):
+        """Block all callers for `seconds` (e.g. Retry-After) and drain the bucket"""
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.paused += 1
+
+    def limit_tokens(self, available):
+        """Lower the local token count to what the server reports as remaining"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, float(available))
+
+    def set_rate(self, rate, capacity=None):
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+            if capacity is not None:
+                self.capacity = float(capacity)
+                self.tokens = min(self.tokens, self.capacity)
+            self._cond.notify_all()
+
+    def metrics(self):
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                'name': self.name,
+                'rate_per_second': self.rate,
+                'capacity': self.capacity,
+                'tokens': round(self.tokens, 2),
+                'queue_depth': self.waiting,
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'paused': self.paused,
+                'paused_for_seconds': round(max(0.0, self.blocked_until - now), 2),
+                'avg_wait_ms': round(1000 * self.wait_seconds / self.acquired, 2) if self.acquired else 0.0
+            }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def key_fingerprint(secret):
+    """Short, non-reversible label for an API key (safe for metrics/logs)"""
+    return hashlib.sha256((secret or '').encode('utf-8')).hexdigest()[:12]
+
+
+def get_bucket(namespace, key, rate, capacity):
+    """Process-wide bucket for (namespace, key) - created on first use"""
+    bucket_key = (namespace, key)
+    bucket = _buckets.get(bucket_key)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(bucket_key)
+            if bucket is None:
+                bucket = TokenBucket(rate, capacity, name=f'{namespace}:{key}')
+                _buckets[bucket_key] = bucket
+    return bucket
+
+
+def bucket_metrics(namespace=None):
+    """Metrics for all buckets (optionally of one namespace)"""
+    with _buckets_lock:
+        items = list(_buckets.items())
+    return [b.metrics() for (ns, _), b in items if namespace is None or ns == namespace]
+
+
+__all__ = ['TokenBucket', 'get_bucket', 'bucket_metrics', 'key_fingerprint']
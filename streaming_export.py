@@ -0,0 +1,89 @@
+"""
+West Money OS - Streaming Export
+================================
+Gemeinsame Export-Schicht für CSV-Downloads (Kontakte, Leads, Consent).
+
+Zeilen werden direkt aus der Quelle (DB mit serverseitigem Cursor oder
+beliebigem Iterator) in kleine CSV-Chunks geschrieben und per
+Response(generator) ausgeliefert - optional gzip-komprimiert. Der erste
+Chunk geht raus, sobald die ersten Zeilen gelesen sind; der Speicherbedarf
+hängt nicht von der Anzahl der Zeilen ab.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime
+
+from flask import Response, stream_with_context
+
+from westmoney_db import get_db
+
+# Zeilen pro Chunk - klein genug für schnellen ersten Byte, groß genug
+# gegen tausende Mini-Writes
+ROWS_PER_CHUNK = 500
+DB_FETCH_SIZE = 1000
+
+
+def iter_query(stmt, fetch_size=DB_FETCH_SIZE):
+    """Iterate a SELECT with a server-side cursor (yield_per)"""
+    result = get_db().session.execute(stmt.execution_options(yield_per=fetch_size))
+    try:
+        for row in result:
+            yield row
+    finally:
+        result.close()
+
+
+def iter_csv(header, rows, rows_per_chunk=ROWS_PER_CHUNK):
+    """Encode header + rows as UTF-8 CSV chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(['' if v is None else v.isoformat() if isinstance(v, datetime) else v for v in row])
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(chunks, level=6):
+    """Compress a byte-chunk stream into a gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip-Header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_response(filename, header, rows, compress=False):
+    """Streaming CSV download - rows may be any iterator of sequences"""
+    chunks = iter_csv(header, rows)
+
+    if compress:
+        chunks = iter_gzip(chunks)
+        filename = f'{filename}.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx soll nicht puffern
+    return response
+
+
+def wants_gzip(args):
+    """True for ?gzip=1 / ?gzip=true"""
+    return str(args.get('gzip', '')).lower() in ('1', 'true', 'yes')
+
+
+__all__ = ['iter_query', 'iter_csv', 'iter_gzip', 'csv_response', 'wants_gzip']
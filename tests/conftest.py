@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Modul-Singletons lesen den Pfad beim Import - nie die echte Queue-Datei anfassen
+os.environ.setdefault('WEBHOOK_QUEUE_DB', os.path.join(tempfile.mkdtemp(), 'webhook_queue.db'))
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app_broly_automation import ActionExecutor, AutomationEngine
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def _row(step_index=0, attempts=0):
+    return {'step_index': step_index, 'due_at': None, 'attempts': attempts}
+
+
+def _automation(*actions, active=True):
+    return {'is_active': active, 'actions': list(actions)}
+
+
+@pytest.fixture
+def executor():
+    return ActionExecutor()
+
+
+class _Calls(list):
+    """Executed action types - results[type] overrides the default success"""
+
+    def __init__(self):
+        super().__init__()
+        self.results = {}
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = _Calls()
+
+    def execute_action(action_type, config, lead):
+        calls.append(action_type)
+        return calls.results.get(action_type, {'success': True})
+
+    monkeypatch.setattr(AutomationEngine, 'execute_action', staticmethod(execute_action))
+    return calls
+
+
+def test_runs_until_wait(executor, calls):
+    automation = _automation(
+        {'type': 'add_tag', 'config': {'tag': 'x'}},
+        {'type': 'wait', 'config': {'delay': '2h'}},
+        {'type': 'change_stage', 'config': {'stage': 'won'}},
+    )
+    state, executed = executor._advance(_row(), automation, {}, NOW)
+
+    assert calls == ['add_tag']
+    assert executed == 1
+    assert state['status'] == 'waiting'
+    assert state['step_index'] == 2
+    assert state['due_at'] == NOW + timedelta(hours=2)
+
+    state, executed = executor._advance(_row(step_index=2), automation, {}, NOW)
+    assert calls == ['add_tag', 'change_stage']
+    assert state['status'] == 'completed'
+    assert state['step_index'] == 3
+
+
+def test_failure_schedules_retry_with_backoff(executor, calls):
+    calls.results['send_email'] = {'success': False, 'message': 'SMTP down'}
+    automation = _automation({'type': 'send_email', 'config': {}})
+
+    state, executed = executor._advance(_row(attempts=2), automation, {}, NOW)
+
+    assert executed == 1
+    assert state['status'] == 'waiting'
+    assert state['step_index'] == 0  # dieselbe Aktion erneut
+    assert state['attempts'] == 3
+    assert state['last_error'] == 'SMTP down'
+    assert state['due_at'] == NOW + timedelta(seconds=ActionExecutor.RETRY_BACKOFF_SECONDS * 4)
+
+
+def test_exception_counts_as_failure(executor, monkeypatch):
+    def execute_action(action_type, config, lead):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(AutomationEngine, 'execute_action', staticmethod(execute_action))
+    state, _ = executor._advance(_row(), _automation({'type': 'add_tag'}), {}, NOW)
+
+    assert state['status'] == 'waiting'
+    assert state['attempts'] == 1
+    assert state['last_error'] == 'boom'
+
+
+def test_fails_after_max_attempts(executor, calls):
+    calls.results['send_email'] = {'success': False}
+    automation = _automation({'type': 'send_email', 'config': {}})
+
+    state, _ = executor._advance(_row(attempts=ActionExecutor.MAX_ATTEMPTS - 1), automation, {}, NOW)
+
+    assert state['status'] == 'failed'
+    assert state['attempts'] == ActionExecutor.MAX_ATTEMPTS
+    assert state['last_error'] == 'Aktion send_email fehlgeschlagen'
+
+
+def test_success_resets_attempts(executor, calls):
+    automation = _automation({'type': 'add_tag'}, {'type': 'update_score'})
+    state, executed = executor._advance(_row(attempts=3), automation, {}, NOW)
+
+    assert executed == 2
+    assert state['status'] == 'completed'
+    assert state['attempts'] == 0
+
+
+def test_unsupported_action_fails_without_retry(executor, calls):
+    automation = _automation({'type': 'add_tag'}, {'type': 'webhook'})
+    state, executed = executor._advance(_row(), automation, {}, NOW)
+
+    assert calls == ['add_tag']
+    assert executed == 1
+    assert state['status'] == 'failed'
+    assert state['step_index'] == 1
+    assert state['attempts'] == 0
+    assert 'webhook' in state['last_error']
+
+
+@pytest.mark.parametrize('automation', [None, _automation({'type': 'add_tag'}, active=False)])
+def test_inactive_automation_cancels_run(executor, calls, automation):
+    state, executed = executor._advance(_row(), automation, {}, NOW)
+
+    assert state['status'] == 'cancelled'
+    assert executed == 0
+    assert calls == []
@@ -0,0 +1,59 @@
+from timing_wheel import TimingWheel
+
+
+def test_items_become_due_in_order():
+    wheel = TimingWheel(start=0)
+    wheel.add(5, 'c')
+    wheel.add(2, 'a')
+    wheel.add(2, 'b')
+    wheel.add(3, 'x')
+
+    assert wheel.advance(1) == []
+    assert wheel.advance(2) == ['a', 'b']
+    assert wheel.advance(10) == ['x', 'c']
+    assert len(wheel) == 0
+
+
+def test_past_due_item_fires_on_next_advance():
+    wheel = TimingWheel(start=100)
+    wheel.advance(100)
+    wheel.add(50, 'late')
+    assert wheel.advance(101) == ['late']
+
+
+def test_cascade_from_minute_level():
+    wheel = TimingWheel(start=0)
+    wheel.add(125, 'later')
+    wheel.add(61, 'soon')
+
+    assert wheel.advance(60) == []
+    assert wheel.advance(61) == ['soon']
+    assert wheel.advance(124) == []
+    assert wheel.advance(125) == ['later']
+
+
+def test_cascade_keeps_order_across_levels():
+    wheel = TimingWheel(start=30)
+    wheel.add(95, 'b')  # Stufe 1, rutscht bei 60 nach Stufe 0
+    wheel.add(85, 'a')  # direkt Stufe 0
+    wheel.add(3000, 'c')
+
+    assert wheel.advance(3000) == ['a', 'b', 'c']
+
+
+def test_overflow_beyond_horizon():
+    wheel = TimingWheel(start=0, slots=(10, 10))  # Horizont 100 Ticks
+    wheel.add(250, 'far')
+    wheel.add(99, 'near')
+
+    assert len(wheel) == 2
+    assert wheel.advance(249) == ['near']
+    assert wheel.advance(250) == ['far']
+    assert len(wheel) == 0
+
+
+def test_tick_resolution():
+    wheel = TimingWheel(start=0, tick=0.5)
+    wheel.add(1.2, 'a')
+    assert wheel.advance(0.9) == []
+    assert wheel.advance(1.0) == ['a']
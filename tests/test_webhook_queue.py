@@ -0,0 +1,131 @@
+import contextlib
+import time
+
+import pytest
+
+import webhook_queue
+from webhook_queue import MAX_ATTEMPTS, SeenSet, WebhookQueue, WebhookWorkerPool
+
+
+class _App:
+    def app_context(self):
+        return contextlib.nullcontext()
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WebhookQueue('test', path=str(tmp_path / 'queue.db'))
+
+
+def test_claim_leases_in_arrival_order(queue):
+    for n in range(3):
+        queue.append(f'p{n}')
+
+    first = queue.claim(limit=2)
+    assert [payload for _, payload, _ in first] == ['p0', 'p1']
+    assert [attempts for _, _, attempts in first] == [0, 0]
+
+    # Geleaste Einträge werden nicht doppelt vergeben
+    second = queue.claim()
+    assert [payload for _, payload, _ in second] == ['p2']
+    assert queue.claim() == []
+
+
+def test_expired_lease_is_claimed_again(queue):
+    queue.append('p')
+    (entry_id, _, _), = queue.claim(lease_seconds=0)
+    time.sleep(0.01)
+
+    again = queue.claim()
+    assert [row[0] for row in again] == [entry_id]
+
+
+def test_ack_removes_entries(queue):
+    queue.append('p')
+    ids = [row[0] for row in queue.claim()]
+    queue.ack(ids)
+    assert queue.stats()['depth'] == 0
+    assert queue.claim(lease_seconds=0) == []
+
+
+def test_release_counts_attempts_until_dead(queue):
+    queue.append('p')
+    for attempt in range(MAX_ATTEMPTS):
+        (entry_id, _, attempts), = queue.claim()
+        assert attempts == attempt
+        queue.release([entry_id], 'kaputt')
+
+    assert queue.claim() == []
+    assert queue.stats()['dead'] == 1
+    dead, = queue.dead()
+    assert dead['id'] == entry_id
+    assert dead['attempts'] == MAX_ATTEMPTS
+    assert dead['last_error'] == 'kaputt'
+
+
+def test_prune_dead_respects_retention(queue):
+    queue.append('p')
+    for _ in range(MAX_ATTEMPTS):
+        queue.release([row[0] for row in queue.claim()])
+
+    assert queue.prune_dead() == 0
+    assert queue.prune_dead(time.time() + webhook_queue.DEAD_RETENTION_SECONDS + 1) == 1
+    assert queue.stats()['dead'] == 0
+
+
+def test_failing_payload_is_isolated_on_retry(queue, monkeypatch):
+    monkeypatch.setattr(webhook_queue, 'IDLE_SLEEP', 0)
+    handled = []
+
+    def handler(payloads):
+        if 'bad' in payloads:
+            raise ValueError('bad payload')
+        handled.extend(payloads)
+
+    for payload in ('a', 'bad', 'b'):
+        queue.append(payload)
+    pool = WebhookWorkerPool(queue, handler)
+
+    pool._step(_App())  # ganzer Batch scheitert, alle Einträge zurück
+    assert handled == []
+    pool._step(_App())  # zweiter Fehlschlag: einzeln verarbeiten
+    assert handled == ['a', 'b']
+
+    (_, payload, attempts), = queue.claim()
+    assert (payload, attempts) == ('bad', 2)
+
+
+@pytest.fixture
+def seen(tmp_path):
+    return SeenSet('test', ttl=3600, path=str(tmp_path / 'seen.db'))
+
+
+def test_add_new_drops_duplicates(seen):
+    assert seen.add_new(['a', 'b', 'a']) == ['a', 'b']
+    assert seen.add_new(['a', 'c']) == ['c']
+    assert seen.duplicates == 2
+
+
+def test_held_key_expires_without_confirm(seen):
+    assert seen.add_new(['m1'], hold=0) == ['m1']
+    time.sleep(0.01)
+    # Prozess starb vor confirm(): die erneute Zustellung ist wieder neu
+    assert seen.add_new(['m1']) == ['m1']
+
+
+def test_held_key_is_duplicate_while_held(seen):
+    assert seen.add_new(['m1'], hold=60) == ['m1']
+    assert seen.add_new(['m1']) == []
+
+
+def test_confirm_keeps_key_for_full_ttl(seen):
+    seen.add_new(['m1'], hold=0)
+    seen.confirm(['m1'])
+    time.sleep(0.01)
+    assert seen.add_new(['m1']) == []
+
+
+def test_forget_allows_redelivery(seen):
+    seen.add_new(['m1'], hold=60)
+    seen.forget(['m1'])
+    assert seen.add_new(['m1']) == ['m1']
@@ -0,0 +1,88 @@
+"""
+West Money OS - Timing Wheel
+============================
+Hierarchisches Timing Wheel für verzögerte Jobs (Automation-Wartezeiten).
+
+Stufe 0 hat SLOTS[0] Slots à TICK Sekunden, jede weitere Stufe deckt die
+gesamte vorherige mit einem Slot ab (Standard: 60 x 1s, 60 x 1min = 1h).
+Einfügen und Fälligwerden kosten O(1) pro Eintrag - beim Übergang einer
+höheren Stufe werden deren Einträge eine Stufe tiefer einsortiert.
+Alles jenseits des Horizonts liegt in einem Heap und rückt nach.
+
+Das Wheel ist nur der Kurzzeit-Speicher: dauerhafte Wartezeiten liegen in
+der Datenbank (Index auf due_at) und werden kurz vor Fälligkeit geladen.
+"""
+
+import heapq
+import itertools
+import threading
+
+
+class TimingWheel:
+    """Thread-safe hierarchical hashed timing wheel"""
+
+    def __init__(self, start, tick=1.0, slots=(60, 60)):
+        self.tick = tick
+        self.sizes = list(slots)
+        self.spans = [1]  # Ticks pro Slot je Stufe
+        for size in self.sizes[:-1]:
+            self.spans.append(self.spans[-1] * size)
+        self.horizon = self.spans[-1] * self.sizes[-1]  # in Ticks
+
+        self.levels = [[[] for _ in range(size)] for size in self.sizes]
+        self.overflow = []
+        self.current = int(start / tick)
+        self.count = 0
+
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, due, item):
+        """Schedule `item` for timestamp `due` (seconds, same clock as advance)"""
+        with self._lock:
+            self._place(max(int(due / self.tick), self.current), item)
+            self.count += 1
+
+    def _place(self, due_tick, item):
+        delta = due_tick - self.current
+        for level, (size, span) in enumerate(zip(self.sizes, self.spans)):
+            if delta < span * size:
+                self.levels[level][(due_tick // span) % size].append((due_tick, item))
+                return
+        heapq.heappush(self.overflow, (due_tick, next(self._seq), item))
+
+    def advance(self, now):
+        """Move the wheel to `now` - returns all items that became due"""
+        target = int(now / self.tick)
+        due = []
+        with self._lock:
+            while self.current <= target:
+                self._cascade()
+                slot = self.levels[0][self.current % self.sizes[0]]
+                if slot:
+                    due.extend(item for _, item in slot)
+                    slot.clear()
+                self.current += 1
+            self.count -= len(due)
+        return due
+
+    def _cascade(self):
+        # Höhere Stufen beim Erreichen ihrer Slot-Grenze eine Stufe tiefer einsortieren
+        for level in range(len(self.sizes) - 1, 0, -1):
+            span = self.spans[level]
+            if self.current % span == 0:
+                slot_index = (self.current // span) % self.sizes[level]
+                entries = self.levels[level][slot_index]
+                self.levels[level][slot_index] = []
+                for due_tick, item in entries:
+                    self._place(due_tick, item)
+
+        while self.overflow and self.overflow[0][0] - self.current < self.horizon:
+            due_tick, _, item = heapq.heappop(self.overflow)
+            self._place(due_tick, item)
+
+    def __len__(self):
+        return self.count
+
+
+__all__ = ['TimingWheel']
@@ -20,6 +20,8 @@ from typing import Dict, Optional
 from flask import Blueprint, request, jsonify, Response
 import requests
 
+from phone_index import normalize_e164
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('VoiceAgent')
@@ -413,11 +415,9 @@ def initiate_outbound_call():
     if not to_number:
         return jsonify({'success': False, 'error': 'Telefonnummer erforderlich'}), 400
     
-    # Nummer formatieren
-    if to_number.startswith('0'):
-        to_number = '+49' + to_number[1:]
-    elif not to_number.startswith('+'):
-        to_number = '+49' + to_number
+    to_number = normalize_e164(to_number)
+    if not to_number:
+        return jsonify({'success': False, 'error': 'Ungültige Telefonnummer'}), 400
     
     result = TwilioService.make_call(to_number, agent_type)
     
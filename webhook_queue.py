@@ -0,0 +1,360 @@
+"""
+West Money OS - Webhook Queue
+=============================
+Dauerhafte lokale Warteschlange für eingehende Webhooks (HubSpot, E-Mail-
+Provider, WhatsApp). Der HTTP-Handler hängt nur die rohe Payload an eine
+SQLite-Tabelle im WAL-Modus an und antwortet sofort; ein Worker-Pool holt
+die Einträge in Batches ab und verarbeitet sie im App-Kontext.
+
+- append() ist ein einzelnes INSERT (kein Parsen, kein Netzwerk)
+- claim() vergibt Einträge per Lease - stirbt ein Worker, werden sie nach
+  LEASE_SECONDS erneut vergeben (at-least-once, Handler müssen idempotent sein)
+- ack() löscht verarbeitete Einträge, release() gibt sie für einen Retry frei
+- Scheitert ein Batch mit bereits einmal gescheiterten Einträgen erneut,
+  werden seine Einträge einzeln verarbeitet - ein kaputter Eintrag zieht
+  die übrigen nicht mit nach "dead"
+- Einträge mit mehr als MAX_ATTEMPTS Fehlversuchen bleiben als "dead" liegen
+  (dead() listet sie) und werden nach DEAD_RETENTION_SECONDS gelöscht
+- SeenSet: zeitlich begrenzte Menge bereits verarbeiteter IDs (Provider-
+  Event-IDs, WhatsApp message.id) in derselben Datei - prozessübergreifend
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+QUEUE_DB_PATH = os.environ.get('WEBHOOK_QUEUE_DB', 'webhook_queue.db')
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+DEAD_RETENTION_SECONDS = int(os.environ.get('WEBHOOK_DEAD_RETENTION_DAYS', '7')) * 86400
+DEAD_PRUNE_INTERVAL = 3600  # Sekunden zwischen zwei Aufräumläufen
+CLAIM_BATCH = 50  # Webhook-Requests pro Worker-Durchlauf
+IDLE_SLEEP = 0.5  # Sekunden, wenn die Queue leer ist
+MAX_BACKOFF = 30  # Sekunden Pause nach wiederholten Queue-Fehlern (z.B. 'database is locked')
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    received_at REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_webhook_queue_source_lease
+    ON webhook_queue (source, lease_until, id);
+CREATE TABLE IF NOT EXISTS webhook_seen (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (source, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_webhook_seen_time ON webhook_seen (seen_at);
+"""
+
+SEEN_PRUNE_INTERVAL = 60  # Sekunden zwischen zwei Aufräumläufen
+
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')  # WAL: dauerhaft bis auf Stromausfall
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class WebhookQueue:
+    """Append-only SQLite queue for one webhook source"""
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or QUEUE_DB_PATH
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._connect()  # Schema sofort anlegen
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _open(self.path)
+        return conn
+
+    def append(self, payload):
+        """Store one raw webhook body (bytes or str)"""
+        self._connect().execute(
+            'INSERT INTO webhook_queue (source, payload, received_at) VALUES (?, ?, ?)',
+            (self.source, payload, time.time())
+        )
+
+    def claim(self, limit=CLAIM_BATCH, lease_seconds=LEASE_SECONDS):
+        """Lease up to `limit` entries - returns [(id, payload, attempts)] in arrival order"""
+        conn = self._connect()
+        now = time.time()
+        with self._claim_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = conn.execute(
+                    'SELECT id, payload, attempts FROM webhook_queue '
+                    'WHERE source = ? AND lease_until < ? AND attempts < ? '
+                    'ORDER BY id LIMIT ?',
+                    (self.source, now, MAX_ATTEMPTS, limit)
+                ).fetchall()
+                if rows:
+                    conn.executemany(
+                        'UPDATE webhook_queue SET lease_until = ? WHERE id = ?',
+                        [(now + lease_seconds, row[0]) for row in rows]
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return rows
+
+    def ack(self, ids):
+        """Remove processed entries"""
+        if ids:
+            self._connect().executemany('DELETE FROM webhook_queue WHERE id = ?', [(i,) for i in ids])
+
+    def release(self, ids, error=None):
+        """Return entries to the queue after a failure (counts an attempt)"""
+        if ids:
+            conn = self._connect()
+            conn.executemany(
+                'UPDATE webhook_queue SET lease_until = 0, attempts = attempts + 1, last_error = ? '
+                'WHERE id = ?',
+                [(error, i) for i in ids]
+            )
+            now = time.time()
+            if now - self._pruned_at > DEAD_PRUNE_INTERVAL:
+                self._pruned_at = now
+                self.prune_dead(now)
+
+    def prune_dead(self, now=None):
+        """Delete dead entries older than DEAD_RETENTION_SECONDS - returns the count"""
+        cutoff = (now or time.time()) - DEAD_RETENTION_SECONDS
+        return self._connect().execute(
+            'DELETE FROM webhook_queue WHERE source = ? AND attempts >= ? AND received_at < ?',
+            (self.source, MAX_ATTEMPTS, cutoff)
+        ).rowcount
+
+    def dead(self, limit=20):
+        """Newest dead entries: [{'id', 'received_at', 'attempts', 'last_error', 'size'}]"""
+        rows = self._connect().execute(
+            'SELECT id, received_at, attempts, last_error, LENGTH(payload) FROM webhook_queue '
+            'WHERE source = ? AND attempts >= ? ORDER BY id DESC LIMIT ?',
+            (self.source, MAX_ATTEMPTS, limit)
+        ).fetchall()
+        return [
+            {'id': row[0], 'received_at': row[1], 'attempts': row[2], 'last_error': row[3], 'size': row[4]}
+            for row in rows
+        ]
+
+    def stats(self):
+        row = self._connect().execute(
+            'SELECT COUNT(*), SUM(attempts >= ?), MIN(received_at) FROM webhook_queue WHERE source = ?',
+            (MAX_ATTEMPTS, self.source)
+        ).fetchone()
+        depth, dead, oldest = row
+        return {
+            'source': self.source,
+            'depth': depth - (dead or 0),
+            'dead': dead or 0,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else 0.0
+        }
+
+
+class SeenSet:
+    """Time-bounded set of processed ids, shared by all processes on the host
+
+    add_new() trägt IDs atomar ein und liefert nur die erstmals gesehenen
+    zurück (auch Duplikate innerhalb desselben Aufrufs fallen weg). Nach
+    `ttl` Sekunden gilt eine ID wieder als neu. Mit `hold` gilt die ID nur
+    so lange als gesehen, bis confirm() sie nach dem Commit festschreibt -
+    stirbt der Prozess dazwischen, wird die erneut zugestellte Payload
+    nicht als Duplikat verworfen.
+    """
+
+    def __init__(self, source, ttl, path=None):
+        self.source = source
+        self.ttl = ttl
+        self.path = path or QUEUE_DB_PATH
+        self.duplicates = 0
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _open(self.path)
+        return conn
+
+    def add_new(self, keys, hold=None):
+        """Record keys - returns those not seen within ttl (in input order)"""
+        conn = self._connect()
+        now = time.time()
+        seen_at = now if hold is None else now - self.ttl + hold
+        new = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key in keys:
+                cursor = conn.execute(
+                    'INSERT INTO webhook_seen (source, key, seen_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT (source, key) DO UPDATE SET seen_at = excluded.seen_at '
+                    'WHERE webhook_seen.seen_at < ?',
+                    (self.source, key, seen_at, now - self.ttl)
+                )
+                if cursor.rowcount:
+                    new.append(key)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self.duplicates += len(keys) - len(new)
+
+        if now - self._pruned_at > SEEN_PRUNE_INTERVAL:
+            self._pruned_at = now
+            conn.execute(
+                'DELETE FROM webhook_seen WHERE source = ? AND seen_at < ?',
+                (self.source, now - self.ttl)
+            )
+        return new
+
+    def confirm(self, keys):
+        """Make keys recorded with add_new(hold=...) count as seen for the full ttl"""
+        if keys:
+            now = time.time()
+            self._connect().executemany(
+                'UPDATE webhook_seen SET seen_at = ? WHERE source = ? AND key = ?',
+                [(now, self.source, key) for key in keys]
+            )
+
+    def forget(self, keys):
+        """Remove keys again (processing failed, the retry must not be dropped)"""
+        if keys:
+            self._connect().executemany(
+                'DELETE FROM webhook_seen WHERE source = ? AND key = ?',
+                [(self.source, key) for key in keys]
+            )
+
+    def metrics(self):
+        size = self._connect().execute(
+            'SELECT COUNT(*) FROM webhook_seen WHERE source = ?', (self.source,)
+        ).fetchone()[0]
+        return {'size': size, 'ttl_seconds': self.ttl, 'duplicates': self.duplicates}
+
+
+class WebhookWorkerPool:
+    """Background threads draining a WebhookQueue into a batch handler
+
+    handler(payloads) bekommt die rohen Payloads eines claim() und läuft im
+    App-Kontext. Wirft er, werden alle Einträge des Batches freigegeben.
+    """
+
+    def __init__(self, queue, handler, workers=2, batch_size=CLAIM_BATCH):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processed = 0
+        self.failed_batches = 0
+        self.last_error = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def ensure_started(self, app):
+        """Start the worker threads once per process"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(
+                    target=self._run, args=(app,), daemon=True,
+                    name=f'webhook-{self.queue.source}-{n}'
+                )
+                for n in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self):
+        """Wake idle workers after an append"""
+        self._wake.set()
+
+    def _run(self, app):
+        # Kein Fehler darf den Worker-Thread beenden - auch claim()/ack() können
+        # an der SQLite-Datei scheitern; dann mit wachsender Pause weiter
+        backoff = IDLE_SLEEP
+        while True:
+            try:
+                self._step(app)
+                backoff = IDLE_SLEEP
+            except Exception as e:
+                logger.exception('Webhook-Worker: Queue-Fehler')
+                with self._lock:
+                    self.last_error = str(e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _step(self, app):
+        entries = self.queue.claim(self.batch_size)
+        if not entries:
+            self._wake.wait(IDLE_SLEEP)
+            self._wake.clear()
+            return
+
+        ids = [entry_id for entry_id, _, _ in entries]
+        try:
+            with app.app_context():
+                self.handler([payload for _, payload, _ in entries])
+        except Exception as e:
+            with self._lock:
+                self.failed_batches += 1
+                self.last_error = str(e)
+            if len(entries) > 1 and any(attempts for _, _, attempts in entries):
+                # Zweiter Fehlschlag: den Schuldigen isolieren statt alle Einträge zu verbrauchen
+                self._one_by_one(app, entries)
+            else:
+                self.queue.release(ids, str(e))
+            time.sleep(IDLE_SLEEP)
+            return
+
+        self.queue.ack(ids)
+        with self._lock:
+            self.processed += len(ids)
+
+    def _one_by_one(self, app, entries):
+        for entry_id, payload, _ in entries:
+            try:
+                with app.app_context():
+                    self.handler([payload])
+            except Exception as e:
+                self.queue.release([entry_id], str(e))
+                continue
+            self.queue.ack([entry_id])
+            with self._lock:
+                self.processed += 1
+
+    def metrics(self):
+        metrics = self.queue.stats()
+        metrics.update({
+            'workers': sum(1 for t in self._threads if t.is_alive()),
+            'processed': self.processed,
+            'failed_batches': self.failed_batches,
+            'last_error': self.last_error,
+            'dead_entries': self.queue.dead(5) if metrics['dead'] else []
+        })
+        return metrics
+
+
+__all__ = ['SeenSet', 'WebhookQueue', 'WebhookWorkerPool']
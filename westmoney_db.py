@@ -0,0 +1,24 @@
+"""
+West Money OS - Datenbank-Zugriff für Module
+============================================
+Die Blueprints werden von app_main.register_all_blueprints() per __import__
+geladen, während app_main selbst als __main__ läuft. Ein `from app_main import db`
+würde app_main ein zweites Mal ausführen (zweite Flask-App, zweite SQLAlchemy-
+Instanz, Models nicht an die laufende App gebunden). Module holen sich deshalb
+die registrierte Instanz und ihre Tabellen über die laufende App.
+"""
+
+from flask import current_app
+
+
+def get_db():
+    """SQLAlchemy instance registered on the running app"""
+    return current_app.extensions['sqlalchemy']
+
+
+def get_table(name):
+    """Core Table for a model defined in app_main (e.g. 'contacts')"""
+    return get_db().metadata.tables[name]
+
+
+__all__ = ['get_db', 'get_table']
@@ -18,6 +18,7 @@ from functools import wraps
 from datetime import datetime
 from dotenv import load_dotenv
 import hashlib, sqlite3, requests, os
+from hubspot_transport import hubspot_request
 
 load_dotenv()
 app = Flask(__name__)
@@ -91,19 +92,18 @@ def init_db():
 class HubSpotAPI:
     def __init__(self):
         self.key = CONFIG['HUBSPOT_API_KEY']
-        self.headers = {'Authorization':f'Bearer {self.key}','Content-Type':'application/json'}
     
     def get_contacts(self, limit=100):
         if not self.key: return []
         try:
-            r = requests.get('https://api.hubapi.com/crm/v3/objects/contacts',headers=self.headers,params={'limit':limit,'properties':'firstname,lastname,email,phone,company,hs_whatsapp_consent'},timeout=15)
+            r = hubspot_request('GET','/crm/v3/objects/contacts',self.key,params={'limit':limit,'properties':'firstname,lastname,email,phone,company,hs_whatsapp_consent'},timeout=15)
             return r.json().get('results',[]) if r.ok else []
         except: return []
     
     def update_contact(self, cid, props):
         if not self.key: return False
         try:
-            r = requests.patch(f'https://api.hubapi.com/crm/v3/objects/contacts/{cid}',headers=self.headers,json={'properties':props},timeout=15)
+            r = hubspot_request('PATCH',f'/crm/v3/objects/contacts/{cid}',self.key,json={'properties':props},timeout=15)
             return r.ok
         except: return False
     
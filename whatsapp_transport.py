@@ -0,0 +1,410 @@
+"""
+West Money OS - WhatsApp Transport
+==================================
+Gemeinsame HTTP-Schicht für alle ausgehenden WhatsApp-Nachrichten
+(whatsapp_webhook.send_reply, app_whatsapp_consent.WhatsAppClient,
+app_whatsapp_module Broadcast, campaign_dispatcher):
+
+- Ein requests.Session pro Prozess mit festem Verbindungspool zur Graph API
+- Token-Bucket pro Telefonnummer (rate_limiter) auf Metas Durchsatz-Limit
+  (80 Nachrichten/s Standard, 1000/s bei throughput level HIGH)
+- Messaging-Tier (TIER_250 ... TIER_UNLIMITED): Obergrenze für neue
+  geschäftsinitiierte Empfänger pro 24h - darüber wird nicht gesendet.
+  Gezählt in einer SQLite-Datei (WHATSAPP_TIER_DB), die sich alle
+  gunicorn-Worker eines Hosts teilen
+- Fehlerklassifizierung nach Meta-Fehlercodes: Durchsatz-Limits pausieren
+  den Bucket, vorübergehende Fehler werden mit Backoff wiederholt, alles
+  andere (Token, Opt-in, 24h-Fenster, ungültige Nummer) ist endgültig
+- send_many(): begrenzt parallele Massen-Sends mit Ergebnis-Report
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limiter import get_bucket
+
+GRAPH_BASE_URL = 'https://graph.facebook.com'
+API_VERSION = os.environ.get('WHATSAPP_API_VERSION', 'v21.0')
+
+POOL_MAXSIZE = int(os.environ.get('WHATSAPP_POOL_SIZE', '32'))
+SEND_WORKERS = int(os.environ.get('WHATSAPP_SEND_WORKERS', '16'))
+MAX_RETRIES = int(os.environ.get('WHATSAPP_MAX_RETRIES', '3'))
+BACKOFF_SECONDS = 1.0  # 1s, 2s, 4s
+DEFAULT_TIMEOUT = (5, 20)  # (connect, read)
+
+# Durchsatz pro Telefonnummer (Nachrichten/Sekunde) nach throughput.level
+THROUGHPUT = {'STANDARD': 80, 'HIGH': 1000}
+MESSAGES_PER_SECOND = float(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND', THROUGHPUT['STANDARD']))
+
+# Neue geschäftsinitiierte Empfänger pro 24h
+TIERS = {
+    'TIER_50': 50,
+    'TIER_250': 250,
+    'TIER_1K': 1000,
+    'TIER_10K': 10000,
+    'TIER_100K': 100000,
+    'TIER_UNLIMITED': None
+}
+MESSAGING_TIER = os.environ.get('WHATSAPP_MESSAGING_TIER', 'TIER_1K')
+TIER_WINDOW_SECONDS = 24 * 3600
+TIER_DB_PATH = os.environ.get('WHATSAPP_TIER_DB', 'whatsapp_tier.db')
+TIER_PRUNE_INTERVAL = 300  # Sekunden zwischen zwei Aufräumläufen
+LIMITS_REFRESH_SECONDS = 3600
+
+# Meta-Fehlercodes
+THROTTLE_CODES = frozenset({4, 80007, 130429, 131048})  # Durchsatz/Spam-Limit -> Bucket pausieren
+PAIR_RATE_CODE = 131056  # zu viele Nachrichten an denselben Empfänger
+PAIR_RATE_SECONDS = 6.0
+TRANSIENT_CODES = frozenset({1, 2, 131000, 131016, 133004})  # Meta-seitig, später erneut
+THROTTLE_PAUSE_SECONDS = 5.0
+
+
+def _build_session():
+    # Keine urllib3-Retries: POST /messages ist nicht idempotent, Retries
+    # entscheidet classify() anhand des Meta-Fehlercodes
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_MAXSIZE, pool_block=True, max_retries=0)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session (recreated after fork)"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def build_message(to, message_type='text', **kwargs):
+    """Graph API payload for POST /{phone_id}/messages"""
+    payload = {
+        'messaging_product': 'whatsapp',
+        'recipient_type': 'individual',
+        'to': to,
+        'type': message_type
+    }
+    if message_type == 'text':
+        payload['text'] = {'body': kwargs.get('text', '')}
+    elif message_type == 'template':
+        payload['template'] = {
+            'name': kwargs.get('template_name'),
+            'language': {'code': kwargs.get('language', 'de')},
+            'components': kwargs.get('components', [])
+        }
+    elif message_type == 'interactive':
+        payload['interactive'] = kwargs.get('interactive', {})
+    return payload
+
+
+def classify(status_code, code):
+    """'ok', 'throttled', 'pair_rate', 'transient' or 'permanent'"""
+    if status_code == 200:
+        return 'ok'
+    if code in THROTTLE_CODES or status_code == 429:
+        return 'throttled'
+    if code == PAIR_RATE_CODE:
+        return 'pair_rate'
+    if code in TRANSIENT_CODES or status_code >= 500:
+        return 'transient'
+    return 'permanent'
+
+
+_TIER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tier_recipients (
+    phone_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    first_at REAL NOT NULL,
+    PRIMARY KEY (phone_id, recipient)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_tier_recipients_first ON tier_recipients (phone_id, first_at);
+"""
+
+
+class TierLedger:
+    """Business-initiated recipients per phone number in the 24h tier window
+
+    Liegt in einer SQLite-Datei (WAL), damit alle Prozesse eines Hosts
+    dasselbe Kontingent zählen. Ist die Datei nicht erreichbar, wird
+    gesendet (Meta setzt das Tier ohnehin selbst durch) und der Fehler gezählt.
+    """
+
+    def __init__(self, path=TIER_DB_PATH):
+        self.path = path
+        self.errors = 0
+        self._local = threading.local()
+        self._pruned_at = 0.0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_TIER_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def reserve(self, phone_id, to, limit):
+        """Count `to` against the tier - False if the 24h limit is exhausted"""
+        now = time.time()
+        cutoff = now - TIER_WINDOW_SECONDS
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    'SELECT first_at FROM tier_recipients WHERE phone_id = ? AND recipient = ?', (phone_id, to)
+                ).fetchone()
+                if row and row[0] >= cutoff:
+                    allowed = True
+                else:
+                    used = conn.execute(
+                        'SELECT COUNT(*) FROM tier_recipients WHERE phone_id = ? AND first_at >= ?',
+                        (phone_id, cutoff)
+                    ).fetchone()[0]
+                    allowed = used < limit
+                    if allowed:
+                        conn.execute(
+                            'INSERT OR REPLACE INTO tier_recipients (phone_id, recipient, first_at) VALUES (?, ?, ?)',
+                            (phone_id, to, now)
+                        )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if now - self._pruned_at > TIER_PRUNE_INTERVAL:
+                self._pruned_at = now
+                conn.execute('DELETE FROM tier_recipients WHERE first_at < ?', (cutoff,))
+            return allowed
+        except sqlite3.Error:
+            self.errors += 1
+            return True
+
+    def count(self, phone_id):
+        try:
+            return self._connect().execute(
+                'SELECT COUNT(*) FROM tier_recipients WHERE phone_id = ? AND first_at >= ?',
+                (phone_id, time.time() - TIER_WINDOW_SECONDS)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+
+class WhatsAppTransport:
+    """Rate-limited sender for one WhatsApp business phone number"""
+
+    def __init__(self, phone_id, token, version=API_VERSION):
+        self.phone_id = phone_id
+        self.token = token
+        self.version = version
+        self.bucket = get_bucket('whatsapp', phone_id, MESSAGES_PER_SECOND, MESSAGES_PER_SECOND)
+        self.tier = MESSAGING_TIER
+        self.counters = Counter()
+        self.ledger = get_tier_ledger()
+        self._lock = threading.Lock()
+        self._limits_checked = 0.0
+
+    @property
+    def configured(self):
+        return bool(self.token and self.phone_id and not self.token.startswith('EAAG...'))
+
+    def request(self, method, path, json=None, params=None):
+        """Plain Graph API call on the pooled session - returns requests.Response"""
+        return get_session().request(
+            method, f'{GRAPH_BASE_URL}/{self.version}/{path.lstrip("/")}',
+            headers={'Authorization': f'Bearer {self.token}'},
+            json=json, params=params, timeout=DEFAULT_TIMEOUT
+        )
+
+    def refresh_limits(self, force=False):
+        """Read messaging tier and throughput level of the phone number from Meta"""
+        now = time.time()
+        if not force and now - self._limits_checked < LIMITS_REFRESH_SECONDS:
+            return
+        self._limits_checked = now
+        try:
+            info = self.request('GET', self.phone_id, params={'fields': 'messaging_limit_tier,throughput'}).json()
+        except (requests.exceptions.RequestException, ValueError):
+            return
+        if info.get('messaging_limit_tier') in TIERS:
+            self.tier = info['messaging_limit_tier']
+        level = (info.get('throughput') or {}).get('level')
+        if level in THROUGHPUT and 'WHATSAPP_MESSAGES_PER_SECOND' not in os.environ:
+            self.bucket.set_rate(THROUGHPUT[level], THROUGHPUT[level])
+
+    def _reserve_recipient(self, to):
+        """Count a business-initiated recipient against the 24h tier - False if exhausted"""
+        limit = TIERS.get(self.tier)
+        if limit is None:
+            return True
+        return self.ledger.reserve(self.phone_id, to, limit)
+
+    def send(self, payload, business_initiated=False):
+        """Send one message payload - returns the Graph response or {'error', 'code', 'retryable'}"""
+        if not self.configured:
+            return {'error': 'WhatsApp Token nicht konfiguriert', 'code': None, 'retryable': False}
+        if business_initiated and not self._reserve_recipient(payload['to']):
+            self._count('tier_limited')
+            return {'error': f'Messaging-Tier {self.tier} ausgeschöpft', 'code': None, 'retryable': True}
+
+        path = f'{self.phone_id}/messages'
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            try:
+                response = self.request('POST', path, json=payload)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                # Verbindung kam nicht zustande - die Nachricht ist sicher nicht raus
+                kind, body, code = 'transient', {'error': str(e)}, None
+            except requests.exceptions.RequestException as e:
+                # Read-Timeout o.ä.: evtl. zugestellt, nicht blind wiederholen
+                self._count('failed')
+                return {'error': str(e), 'code': None, 'retryable': False}
+            else:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = {'error': {'message': response.text[:200]}}
+                code = (body.get('error') or {}).get('code') if isinstance(body.get('error'), dict) else None
+                kind = classify(response.status_code, code)
+
+            if kind == 'ok':
+                self._count('sent')
+                return body
+            if kind == 'permanent' or attempt == MAX_RETRIES:
+                self._count('failed')
+                return {'error': _error_message(body), 'code': code, 'retryable': kind != 'permanent'}
+
+            self._count(kind)
+            if kind == 'throttled':
+                self.bucket.pause(THROTTLE_PAUSE_SECONDS * (attempt + 1))
+            elif kind == 'pair_rate':
+                time.sleep(PAIR_RATE_SECONDS)
+            else:
+                time.sleep(BACKOFF_SECONDS * (2 ** attempt))
+
+    def send_message(self, to, message_type='text', business_initiated=False, **kwargs):
+        return self.send(build_message(to, message_type, **kwargs), business_initiated)
+
+    def send_many(self, messages, workers=SEND_WORKERS, business_initiated=True, on_result=None):
+        """Send many payloads concurrently at the allowed rate - returns a report
+
+        messages: Iterable von Payloads (build_message) - wird gestreamt, es
+        sind höchstens 2 x workers Sends gleichzeitig unterwegs.
+        on_result(payload, result) wird für jede Nachricht aufgerufen.
+        """
+        self.refresh_limits()
+        started = time.monotonic()
+        report = Counter()
+        errors = Counter()
+        slots = threading.BoundedSemaphore(workers * 2)
+        report_lock = threading.Lock()
+
+        def run(payload):
+            try:
+                result = self.send(payload, business_initiated)
+                with report_lock:
+                    if 'error' in result:
+                        report['failed'] += 1
+                        errors[str(result.get('code') or result['error'])[:80]] += 1
+                    else:
+                        report['sent'] += 1
+                if on_result:
+                    on_result(payload, result)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='whatsapp-send') as pool:
+            for payload in messages:
+                slots.acquire()
+                report['total'] += 1
+                pool.submit(run, payload)
+
+        elapsed = time.monotonic() - started
+        return {
+            'total': report['total'],
+            'sent': report['sent'],
+            'failed': report['failed'],
+            'errors': dict(errors),
+            'elapsed_seconds': round(elapsed, 2),
+            'messages_per_second': round(report['sent'] / elapsed, 1) if elapsed else 0.0,
+            'tier': self.tier
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def metrics(self):
+        metrics = self.bucket.metrics()
+        with self._lock:
+            metrics.update({
+                'phone_id': self.phone_id,
+                'tier': self.tier,
+                'tier_recipients_24h': self.ledger.count(self.phone_id),
+                'tier_ledger_errors': self.ledger.errors,
+                **self.counters
+            })
+        return metrics
+
+
+def _error_message(body):
+    error = body.get('error')
+    if isinstance(error, dict):
+        return error.get('error_user_msg') or error.get('message') or str(error)
+    return str(error)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_tier_ledger():
+    """Process-wide handle on the shared tier ledger"""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = TierLedger()
+    return _ledger
+
+
+def get_transport(phone_id=None, token=None):
+    """Process-wide transport per phone number (defaults from WHATSAPP_PHONE_ID/WHATSAPP_TOKEN)"""
+    phone_id = phone_id or os.environ.get('WHATSAPP_PHONE_ID', '')
+    token = token or os.environ.get('WHATSAPP_TOKEN', '')
+    key = (phone_id, token)
+    transport = _transports.get(key)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.setdefault(key, WhatsAppTransport(phone_id, token))
+    return transport
+
+
+__all__ = [
+    'TierLedger',
+    'WhatsAppTransport',
+    'build_message',
+    'classify',
+    'get_session',
+    'get_transport'
+]
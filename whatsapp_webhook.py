@@ -2,20 +2,38 @@
 """
 WhatsApp Webhook Handler
 Verarbeitet eingehende Nachrichten
+
+Der Webhook schreibt die Payload nur in die Webhook-Queue und antwortet
+sofort - Meta wartet nie auf unseren ausgehenden Graph-API-Call. Ein
+Worker holt die Einträge ab, verwirft bereits beantwortete message.id
+(SeenSet mit TTL, auch bei Meta-Retries) und antwortet parallel pro
+Absender, in Eingangsreihenfolge je Absender.
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
 import os
 import hmac
 import hashlib
 import json
+import sqlite3
+import threading
 from datetime import datetime
 
+from intent_matcher import IntentMatcher
+from webhook_queue import SeenSet, WebhookQueue, WebhookWorkerPool
+from whatsapp_transport import get_transport
+
 whatsapp_webhook_bp = Blueprint('whatsapp_webhook', __name__)
 
 VERIFY_TOKEN = os.getenv('WEBHOOK_SECRET', 'westmoney_webhook_2025')
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN', '')
 
+# Meta wiederholt nicht bestätigte Webhooks bis zu 7 Tage
+IDEMPOTENCY_TTL = int(os.getenv('WHATSAPP_IDEMPOTENCY_TTL', str(7 * 24 * 3600)))
+SEEN_HOLD_SECONDS = 150  # Vormerkung bis zur Antwort - kürzer als das Queue-Lease (300s)
+REPLY_WORKERS = int(os.getenv('WHATSAPP_REPLY_WORKERS', '8'))
+
 # Message Handlers
 MESSAGE_HANDLERS = {
     '1': 'smart_home_info',
@@ -31,6 +49,17 @@ MESSAGE_HANDLERS = {
     'angebot': 'quote_request',
 }
 
+HANDOFF_KEYWORDS = ['mensch', 'mitarbeiter', 'agent', 'person']
+
+# Ein Automat für alle Keywords - frühere Einträge in MESSAGE_HANDLERS gewinnen,
+# Ziffern und sehr kurze Wörter ("hi") nur als ganzes Wort
+INTENTS = IntentMatcher()
+for rank, (keyword, handler) in enumerate(MESSAGE_HANDLERS.items()):
+    INTENTS.add(handler, [keyword], priority=len(MESSAGE_HANDLERS) - rank,
+                boundary='word' if len(keyword) <= 2 else 'prefix')
+INTENTS.add('human_handoff', HANDOFF_KEYWORDS, priority=0)
+INTENTS.compile()
+
 RESPONSES = {
     'welcome': '''Willkommen bei West Money OS! 👋
 
@@ -132,27 +161,122 @@ def verify_webhook():
 
 @whatsapp_webhook_bp.route('/api/whatsapp/webhook', methods=['POST'])
 def receive_webhook():
-    """Handle incoming WhatsApp messages"""
-    data = request.get_json()
+    """Queue incoming WhatsApp messages and acknowledge immediately"""
+    data = request.get_json(silent=True)
     
     if not data:
         return jsonify({'status': 'no data'}), 400
     
-    # Process messages
-    try:
-        for entry in data.get('entry', []):
-            for change in entry.get('changes', []):
-                value = change.get('value', {})
-                messages = value.get('messages', [])
-                
-                for message in messages:
-                    process_message(message, value.get('contacts', []))
-    except Exception as e:
-        print(f"Error processing webhook: {e}")
+    pool = get_message_pool()
+    pool.ensure_started(current_app._get_current_object())
+    pool.queue.append(request.get_data())
+    pool.notify()
     
     return jsonify({'status': 'ok'}), 200
 
 
+@whatsapp_webhook_bp.route('/api/whatsapp/webhook/status', methods=['GET'])
+def webhook_status():
+    """Queue depth, worker counters and idempotency statistics"""
+    pool = get_message_pool()
+    return jsonify({'status': 'ok', 'webhooks': pool.metrics(), 'messages': pool.handler.metrics()})
+
+
+class MessageProcessor:
+    """Answer queued messages once per message.id
+    
+    Ein Aufruf = ein claim() der Queue. Nachrichten werden nach Absender
+    gruppiert und parallel beantwortet (je Absender der Reihe nach). IDs
+    sind bis zur Antwort nur für SEEN_HOLD_SECONDS vorgemerkt und werden
+    erst nach der Antwort für IDEMPOTENCY_TTL bestätigt - stirbt der Worker
+    dazwischen, wird die erneut zugestellte Nachricht trotzdem beantwortet.
+    Schlägt eine Antwort fehl, wird ihre message.id wieder freigegeben und
+    der Batch erneut zugestellt - bereits beantwortete IDs fallen dann als
+    Duplikat weg.
+    """
+    
+    def __init__(self, seen=None, workers=REPLY_WORKERS):
+        self.seen = seen or SeenSet('whatsapp_messages', IDEMPOTENCY_TTL)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='whatsapp-reply')
+        self.processed = 0
+        self.failed = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    def __call__(self, payloads):
+        messages = self.extract(payloads)
+        new_ids = set(self.seen.add_new([message['id'] for message, _ in messages], hold=SEEN_HOLD_SECONDS))
+        
+        by_sender = {}
+        for message, contacts in messages:
+            if message['id'] in new_ids:
+                new_ids.discard(message['id'])
+                by_sender.setdefault(message.get('from'), []).append((message, contacts))
+        
+        failed = []
+        for result in self.executor.map(self._process_sender, by_sender.values()):
+            failed.extend(result)
+        if failed:
+            try:
+                self.seen.forget([message_id for message_id, _ in failed])
+            except sqlite3.Error as e:
+                self.last_error = f'Vormerkung nicht entfernt (läuft nach {SEEN_HOLD_SECONDS}s ab): {e}'
+            raise RuntimeError(f'{len(failed)} Antwort(en) fehlgeschlagen: {failed[0][1]}')
+    
+    @staticmethod
+    def extract(payloads):
+        """Raw webhook bodies -> [(message, contacts)] in arrival order"""
+        messages = []
+        for payload in payloads:
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                continue  # kaputte Payload nicht endlos wiederholen
+            for entry in data.get('entry', []):
+                for change in entry.get('changes', []):
+                    value = change.get('value', {})
+                    for message in value.get('messages', []):
+                        if message.get('id'):
+                            messages.append((message, value.get('contacts', [])))
+        return messages
+    
+    def _process_sender(self, messages):
+        failed = []
+        for message, contacts in messages:
+            try:
+                process_message(message, contacts)
+            except Exception as e:
+                failed.append((message['id'], str(e)))
+                continue
+            try:
+                self.seen.confirm([message['id']])  # sofort - ein Absturz danach darf nicht doppelt antworten
+            except sqlite3.Error as e:
+                self.last_error = f'message.id nicht bestätigt: {e}'
+        with self._lock:
+            self.processed += len(messages) - len(failed)
+            self.failed += len(failed)
+        return failed
+    
+    def metrics(self):
+        return {'processed': self.processed, 'failed': self.failed, 'last_error': self.last_error,
+                'seen': self.seen.metrics()}
+
+
+_message_pool = None
+_message_pool_lock = threading.Lock()
+
+
+def get_message_pool():
+    """Process-wide queue + worker for incoming WhatsApp messages"""
+    global _message_pool
+    if _message_pool is None:
+        with _message_pool_lock:
+            if _message_pool is None:
+                # Ein Worker holt ab (Reihenfolge), der Processor antwortet parallel
+                _message_pool = WebhookWorkerPool(WebhookQueue('whatsapp'), MessageProcessor(), workers=1)
+    return _message_pool
+
+
 def process_message(message, contacts):
     """Process a single incoming message"""
     msg_type = message.get('type')
@@ -187,55 +311,23 @@ def process_message(message, contacts):
 
 
 def get_response(text):
-    """Get appropriate response for message"""
-    text = text.lower().strip()
-    
-    # Check for exact matches
-    if text in MESSAGE_HANDLERS:
-        handler = MESSAGE_HANDLERS[text]
-        return RESPONSES.get(handler, RESPONSES['default'])
-    
-    # Check for partial matches
-    for keyword, handler in MESSAGE_HANDLERS.items():
-        if keyword in text:
-            return RESPONSES.get(handler, RESPONSES['default'])
-    
-    # Check for human handoff requests
-    if any(word in text for word in ['mensch', 'mitarbeiter', 'agent', 'person']):
-        return RESPONSES['human_handoff']
-    
-    return RESPONSES['default']
+    """Get appropriate response for message (best intent in one pass)"""
+    handler = INTENTS.best(text)
+    return RESPONSES.get(handler, RESPONSES['default'])
 
 
 def send_reply(to_number, message):
-    """Send reply via WhatsApp API"""
-    import requests
-    
-    if not WHATSAPP_TOKEN or WHATSAPP_TOKEN.startswith('EAAG...'):
+    """Send reply via WhatsApp API - raises on errors worth retrying"""
+    transport = get_transport(token=WHATSAPP_TOKEN)
+    if not transport.configured:
         print(f"⚠️ WhatsApp Token nicht konfiguriert")
-        return
-    
-    phone_id = os.getenv('WHATSAPP_PHONE_ID', '')
-    url = f'https://graph.facebook.com/v21.0/{phone_id}/messages'
-    
-    headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
-        'Content-Type': 'application/json'
-    }
-    
-    payload = {
-        'messaging_product': 'whatsapp',
-        'recipient_type': 'individual',
-        'to': to_number,
-        'type': 'text',
-        'text': {'body': message}
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code == 200:
-            print(f"✅ Reply sent to {to_number}")
-        else:
-            print(f"❌ Failed to send: {response.text}")
-    except Exception as e:
-        print(f"❌ Error sending message: {e}")
+        return False
+    
+    result = transport.send_message(to_number, text=message)
+    if 'error' not in result:
+        print(f"✅ Reply sent to {to_number}")
+        return True
+    if result['retryable']:
+        raise RuntimeError(result['error'])  # Queue-Retry
+    print(f"❌ Failed to send: {result['error']}")
+    return False